@@ -3,3 +3,19 @@ from . import datafeed
 from . import recorder
 from . import shapper
 from . import live_image
+from . import framecache
+from . import catalog
+from . import accumulator
+from . import framering
+from . import mockexchange
+from . import labels
+from . import storage
+from . import orderflow
+from . import stream
+from . import tradebuckets
+from . import profiling
+from . import feeds
+from . import snapshots
+from . import refprice
+from . import sparse
+from . import checkpoint
@@ -1 +1,139 @@
-__version__ = '0.0.1'
\ No newline at end of file
+__version__ = '0.0.1'
+
+import sys
+import time
+import asyncio
+import argparse
+
+from deep_orderbook import labels
+from deep_orderbook import storage
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.recorder import Writer
+from deep_orderbook.shapper import BookShapper
+from deep_orderbook.framecache import FrameCache
+from deep_orderbook.accumulator import ArrayAccumulator
+from deep_orderbook.profiling import Profiler
+from deep_orderbook import verify as verify_hours
+
+
+async def replay_seconds(args):
+    """the binned arrays of the replayed seconds, at most `args.seconds` of them"""
+    replayer = Replayer(args.data_folder, date_regexp=args.date_regexp, prefetch=args.prefetch)
+    cache = None
+    if args.cache:
+        cache = FrameCache(args.cache)
+        cache.check_zoom(args.zoom_frac)
+    replayers = [replayer.replay_seconds_async(pair, cache=cache) for pair in args.markets]
+    multi_replay = Replayer.multireplayL2_async(replayers)
+    genarr = BookShapper.gen_array_async(multi_replay, args.markets, width_per_side=args.side_width, zoom_frac=args.zoom_frac)
+    num = 0
+    async for second in genarr:
+        yield second
+        num += 1
+        if args.seconds and num >= args.seconds:
+            break
+    await genarr.aclose()
+
+
+async def replay(args):
+    num = 0
+    t = time.time()
+    async for second in replay_seconds(args):
+        num += 1
+    print(f"\nreplayed {num} seconds of {args.markets} in {time.time() - t:.1f}s")
+
+
+async def precompute(args):
+    codecs = None
+    if args.compress:
+        codecs = storage.SPARSE_CODECS if args.sparse_books else storage.CODECS
+    acc = ArrayAccumulator(args.markets, side_width=args.side_width,
+                           data_folder=args.out_folder, codecs=codecs)
+    async for _ in acc.accumulate_async(replay_seconds(args)):
+        pass
+    print(f"\nsaved the arrays of {args.markets} in {args.out_folder}")
+    # the labels of the last rows of a day look ahead into the next one
+    days = Replayer(args.out_folder, date_regexp=args.date_regexp, prefetch=0)
+    for market in args.markets:
+        files = [(fn_bs, fn_ps, storage.compressed(fn_ts) if args.compress else fn_ts)
+                 for fn_bs, fn_ps, fn_ts in days.training_files(market, args.side_bips, args.side_width)]
+        labels.backfill_time2level(files, side_bips=args.side_bips, side_width=args.side_width, overwrite=True)
+    print(f"saved the time2level of {args.markets} in {args.out_folder}")
+
+
+async def record(args):
+    writer = await Writer.create(markets=args.markets, data_folder=args.out_folder)
+    # when cancelled by the timeout, `run_writer` saves the updates received so far
+    await asyncio.wait_for(writer.run_writer(save_period_minutes=args.save_period), timeout=args.duration)
+
+
+async def verify(args):
+    t = time.time()
+    replayer = Replayer(args.data_folder, date_regexp=args.date_regexp, prefetch=0)
+    df = verify_hours.verify(replayer, args.markets, top=args.top, processes=args.processes, report=args.report)
+    print(f"\nchecked {len(df)} hours of {args.markets} in {time.time() - t:.1f}s, written {args.report}")
+    print(verify_hours.summary(df))
+
+
+COMMANDS = {'replay': replay, 'precompute': precompute, 'record': record, 'verify': verify}
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='deepbook', description="replays, records and precomputes order books")
+    parser.add_argument('--profile', nargs='?', const='sample', choices=['sample', 'cprofile'],
+                        help="profiles the command, by sampling (default) or with cProfile")
+    parser.add_argument('--profile-out', default='deepbook-profile',
+                        help="prefix of the profile files: .stages.txt, and .folded (sample) or .prof (cprofile)")
+    parser.add_argument('--profile-interval', type=float, default=0.005, help="seconds between two samples")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_replay_args(p):
+        p.add_argument('--data-folder', default='data/L2', help="the folder of the recorded L2 files")
+        p.add_argument('--markets', nargs='+', default=['BTCUSDT'])
+        p.add_argument('--date-regexp', default='')
+        p.add_argument('--side-width', type=int, default=64)
+        p.add_argument('--zoom-frac', type=float, default=1/256, help="the price span of the binning, relative to the price")
+        p.add_argument('--seconds', type=int, default=0, help="stops after that many seconds, 0 for all")
+        p.add_argument('--prefetch', type=int, default=2)
+        p.add_argument('--cache', help="folder of the frame cache")
+
+    add_replay_args(sub.add_parser('replay', help="replays the recorded L2 into binned arrays"))
+    p = sub.add_parser('precompute', help="replays and writes the day arrays and their time2level")
+    add_replay_args(p)
+    p.add_argument('--side-bips', type=int, default=10)
+    p.add_argument('--out-folder', default='data')
+    p.add_argument('--compress', action='store_true', help="writes the arrays with `storage.CODECS`")
+    p.add_argument('--sparse-books', action='store_true', help="with --compress, stores the non-zero bins of the books, exactly")
+    p = sub.add_parser('record', help="records the L2 updates and trades of Binance")
+    p.add_argument('--markets', nargs='+', default=['BTCUSDT'])
+    p.add_argument('--out-folder', default='data')
+    p.add_argument('--save-period', type=int, default=60, help="minutes between two saved files")
+    p.add_argument('--duration', type=float, help="seconds of recording, until interrupted when not given")
+    p = sub.add_parser('verify', help="checks the book replayed over each recorded hour against the next snapshot")
+    p.add_argument('--data-folder', default='data/L2', help="the folder of the recorded L2 files")
+    p.add_argument('--markets', nargs='+', default=['BTCUSDT'])
+    p.add_argument('--date-regexp', default='')
+    p.add_argument('--top', type=int, default=10, help="the number of levels compared on each side")
+    p.add_argument('--processes', type=int, help="the processes checking the days, 0 to check them in this one")
+    p.add_argument('--report', default='verify.csv', help="the csv report, a row per symbol and hour")
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    run = COMMANDS[args.command]
+    if not args.profile:
+        asyncio.run(run(args))
+        return
+    with Profiler(args.profile, interval=args.profile_interval) as profiler:
+        try:
+            asyncio.run(run(args))
+        except KeyboardInterrupt:
+            print("\ninterrupted")
+    print(f"\n{profiler.report()}")
+    for filename in profiler.save(args.profile_out):
+        print(f"written {filename}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
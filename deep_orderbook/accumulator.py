@@ -0,0 +1,114 @@
+import os
+import datetime
+import numpy as np
+
+from deep_orderbook import storage
+
+
+class ArrayAccumulator:
+    """
+    Accumulates the per-second arrays of `BookShapper.gen_array_async` into preallocated per-market buffers.
+
+    Without `max_length`, the buffers grow until the UTC day (read from the integer day counter
+    of the `ps` rows) rolls over; the finished day is then written straight from the buffer.
+    With `codecs` (see `storage.CODECS`), the day files are written compressed.
+    With `max_length`, each buffer is a ring of twice that length where every row is written twice,
+    so the last `max_length` rows are always available as one contiguous view, for live use.
+    """
+    def __init__(self, markets, max_length=None, reduce_func=None, side_bips=None, side_width=None, data_folder='data', capacity=4096, codecs=None):
+        self.markets = markets
+        self.max_length = max_length
+        self.reduce_func = reduce_func
+        self.side_bips = side_bips
+        self.side_width = side_width
+        self.data_folder = data_folder
+        self.capacity = capacity
+        self.codecs = codecs
+        self.buffers = {market: {} for market in markets}
+        self.count = {market: 0 for market in markets}
+        self.day = {market: None for market in markets}
+
+    @staticmethod
+    def day_of(ps_row):
+        return int(ps_row[1, 0])
+
+    def allocate(self, market, name, row):
+        size = 2 * self.max_length if self.max_length else self.capacity
+        self.buffers[market][name] = np.empty((size,) + row.shape, dtype=np.float32)
+
+    def grow(self, market):
+        n = self.count[market]
+        for name, buf in self.buffers[market].items():
+            if buf.shape[0] <= n:
+                bigger = np.empty((2 * buf.shape[0],) + buf.shape[1:], dtype=buf.dtype)
+                bigger[:n] = buf[:n]
+                self.buffers[market][name] = bigger
+
+    def write(self, market, rows):
+        n = self.count[market]
+        if self.max_length:
+            i = n % self.max_length
+            for name, row in rows.items():
+                buf = self.buffers[market][name]
+                buf[i] = row
+                buf[i + self.max_length] = row
+        else:
+            self.grow(market)
+            for name, row in rows.items():
+                self.buffers[market][name][n] = row
+        self.count[market] = n + 1
+
+    def view(self, market, name):
+        n = self.count[market]
+        buf = self.buffers[market][name]
+        if self.max_length and n > self.max_length:
+            start = n % self.max_length
+            return buf[start:start + self.max_length]
+        return buf[:n]
+
+    def views(self):
+        return {market: {name: self.view(market, name) for name in self.buffers[market]} for market in self.markets}
+
+    def add(self, element):
+        for market, second in element.items():
+            for rows in zip(*second.values()):
+                rows = dict(zip(second.keys(), rows))
+                if not self.buffers[market]:
+                    for name, row in rows.items():
+                        self.allocate(market, name, row)
+                day = self.day_of(rows['ps'])
+                if self.day[market] is not None and day > self.day[market] and not self.max_length:
+                    self.save_day(market)
+                    self.count[market] = 0
+                self.day[market] = day
+                self.write(market, rows)
+        return self.views()
+
+    def save_day(self, market):
+        if not self.data_folder or not self.count[market]:
+            return
+        date = datetime.date(1970, 1, 1) + datetime.timedelta(days=self.day[market])
+        books = self.view(market, 'bs')
+        prices = self.view(market, 'ps')
+        side_width = self.side_width or books.shape[1] // 2
+        folder = f'{self.data_folder}/sidepix{side_width:03}'
+        os.makedirs(folder, exist_ok=True)
+        ext = storage.EXT if self.codecs else '.npy'
+        storage.save_array(f'{folder}/{date}-{market}-bs{ext}', books, storage.codec_of('-bs', self.codecs))
+        storage.save_array(f'{folder}/{date}-{market}-ps{ext}', prices, storage.codec_of('-ps', self.codecs))
+        if self.reduce_func is not None:
+            t2l = self.reduce_func(books=books, prices=prices)
+            storage.save_array(f'{folder}/{date}-{market}-time2level-bip{self.side_bips:02}{ext}', t2l,
+                               storage.codec_of('-time2level', self.codecs))
+
+    def flush(self):
+        """saves the days still being accumulated, the last ones of a replay"""
+        if self.max_length:
+            return
+        for market in self.markets:
+            self.save_day(market)
+
+    async def accumulate_async(self, genarr):
+        async for element in genarr:
+            yield self.add(element)
+        self.flush()
@@ -0,0 +1,98 @@
+import os
+import re
+import sqlite3
+
+
+class Catalog:
+    """
+    Persistent index of the recorded and precomputed files of a data folder.
+
+    Maps symbol/timestamp to the L2 snapshot, update and trades files, the zipped days
+    and the sidepix training shards, so that `Replayer` never globs the folders again.
+    Only the folders whose modification time changed since the last `refresh` are listed.
+    """
+    RE_RAW = re.compile(r'^(?P<ts>\d{4}-\d\d-\d\dT\d\d-\d\d-\d\d)_(?P<kind>snapshot|update|trades)\.json$')
+    RE_TRAINING = re.compile(r'^(?P<ts>\d{4}-\d\d-\d\d)-(?P<symbol>[A-Z0-9]+)-(?P<kind>bs|ps|labels|time2level-bip(?P<bips>\d+))\.np[yzc]$')
+    RE_SIDEPIX = re.compile(r'^sidepix(?P<width>\d+)$')
+
+    def __init__(self, data_folder, db_path=None):
+        self.data_folder = data_folder
+        self.db_path = db_path or f"{data_folder}/.catalog.sqlite"
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript("""
+            PRAGMA journal_mode = MEMORY; -- a journal file would change the folder's mtime at every commit
+            CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, folder TEXT, name TEXT, symbol TEXT, kind TEXT, ts TEXT, width INTEGER, bips INTEGER);
+            CREATE INDEX IF NOT EXISTS files_query ON files (kind, symbol, ts);
+            CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+        """)
+        self.refresh()
+
+    def close(self):
+        self.db.close()
+
+    def parse(self, folder, name):
+        """returns the (symbol, kind, ts, width, bips) of a file, or None if it is not part of a dataset"""
+        subfolder = os.path.basename(folder) if folder != self.data_folder else ''
+        if not subfolder:
+            if name.endswith('.zip'):
+                return None, 'zip', name.split('.')[0], None, None
+            return None
+        sidepix = self.RE_SIDEPIX.match(subfolder)
+        if sidepix:
+            m = self.RE_TRAINING.match(name)
+            if not m:
+                return None
+            kind = 'time2level' if m['bips'] else m['kind']
+            bips = int(m['bips']) if m['bips'] else None
+            return m['symbol'], kind, m['ts'], int(sidepix['width']), bips
+        m = self.RE_RAW.match(name)
+        if not m:
+            return None
+        return subfolder, m['kind'], m['ts'], None, None
+
+    def refresh(self):
+        folders = [self.data_folder]
+        with os.scandir(self.data_folder) as it:
+            folders += sorted(e.path for e in it if e.is_dir())
+        known = dict(self.db.execute("SELECT path, mtime FROM folders"))
+        changed = 0
+        for folder in folders:
+            mtime = os.stat(folder).st_mtime_ns
+            if known.get(folder) == mtime:
+                continue
+            self.scan(folder)
+            self.db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, mtime))
+            changed += 1
+        for folder in set(known) - set(folders):
+            self.db.execute("DELETE FROM files WHERE folder = ?", (folder,))
+            self.db.execute("DELETE FROM folders WHERE path = ?", (folder,))
+        self.db.commit()
+        return changed
+
+    def scan(self, folder):
+        with os.scandir(folder) as it:
+            names = {e.name for e in it if e.is_file()}
+        indexed = {n for n, in self.db.execute("SELECT name FROM files WHERE folder = ?", (folder,))}
+        rows = []
+        for name in names - indexed:
+            parsed = self.parse(folder, name)
+            if parsed:
+                rows.append((f"{folder}/{name}", folder, name) + parsed)
+        self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.executemany("DELETE FROM files WHERE path = ?", [(f"{folder}/{n}",) for n in indexed - names])
+
+    def files(self, kinds, symbol=None, pattern='', start=None, end=None, width=None, bips=None):
+        """
+        sorted paths of the files of the given kind(s).
+        `pattern` is the glob prefix of the file names, `start`/`end` bound their timestamp (end excluded).
+        """
+        kinds = [kinds] if isinstance(kinds, str) else list(kinds)
+        query = f"SELECT path FROM files WHERE kind IN ({','.join('?' * len(kinds))}) AND name GLOB ?"
+        args = kinds + [f"{pattern}*"]
+        for cond, val in (("symbol = ?", symbol), ("ts >= ?", start), ("ts < ?", end), ("width = ?", width), ("bips = ?", bips)):
+            if val is not None:
+                query += f" AND {cond}"
+                args.append(val)
+        return [path for path, in self.db.execute(query + " ORDER BY path", args)]
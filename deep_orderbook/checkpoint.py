@@ -0,0 +1,60 @@
+import os
+import time
+import pickle
+import asyncio
+
+
+def save(filename, state):
+    """pickles `state` to a temporary file renamed over `filename`, so that a crash never leaves half a checkpoint"""
+    tmp = f"{filename}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as fp:
+        pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, filename)
+
+
+def load(filename):
+    """the state pickled in `filename`, None when there is none or it cannot be read"""
+    try:
+        with open(filename, 'rb') as fp:
+            return pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"cannot read the checkpoint {filename}: {e!r}")
+        return None
+
+
+class Checkpointer:
+    """
+    Saves the state of a live process to `filename` every `every` seconds, so that it restarts warm:
+    the books, the EMA of the reference prices, the pending trades and the recent frames.
+    The state is taken in the event loop, as copies, then pickled and written in a thread.
+    A checkpoint older than `max_age` seconds is not restored, the frames would not be valid anymore.
+    """
+    def __init__(self, filename, every=60, max_age=15 * 60):
+        self.filename = filename
+        self.every = every
+        self.max_age = max_age
+        self.last = None
+
+    def restore(self, now=None):
+        """the saved state, None when there is none recent enough"""
+        content = load(self.filename)
+        if content is None:
+            return None
+        age = (now or time.time()) - content['time']
+        if self.max_age is not None and age > self.max_age:
+            print(f"the checkpoint {self.filename} is {age:.0f}s old, starting cold")
+            return None
+        print(f"restoring the checkpoint {self.filename}, {age:.0f}s old")
+        return content['state']
+
+    async def maybe_save_async(self, get_state, now=None):
+        """saves `get_state()` when the last save is more than `every` seconds old, returns whether it did"""
+        now = now or time.time()
+        if self.last is not None and now - self.last < self.every:
+            return False
+        self.last = now
+        content = {'time': now, 'state': get_state()}
+        await asyncio.get_event_loop().run_in_executor(None, save, self.filename, content)
+        return True
@@ -3,12 +3,11 @@ import numpy as np
 import functools
 import random
 
-from deep_orderbook import replayer, shapper
+from deep_orderbook import replayer, shapper, labels, storage
 
 MAX_DAYS_FOR_NOW = 2
 
-def alpha(arr_time2level):
-    return 10 / (1 + (arr_time2level))
+alpha = labels.alpha
 
 
 class DataFeed(replayer.Replayer):
@@ -17,8 +16,8 @@ class DataFeed(replayer.Replayer):
         self.replay = replayer.Replayer('../data/crypto', date_regexp=date_regexp)
         file_gen = self.replay.training_files(self.symbol, side_bips=side_bips, side_width=side_width)
         fn_bs, fn_ps, fn_ts = zip(*list(file_gen)[-1:])
-        arr_books = np.concatenate(list(map(np.load, fn_bs)))
-        arr_prices = np.concatenate(list(map(np.load, fn_ps)))
+        arr_books = np.concatenate(list(map(storage.load_array, fn_bs)))
+        arr_prices = np.concatenate(list(map(storage.load_array, fn_ps)))
         #arr_time2level = np.concatenate(list(map(np.load, fn_ts)))
         #print('time2level', arr_time2level.shape, arr_time2level.min(), arr_time2level.mean(), arr_time2level.max())
 
@@ -39,6 +38,17 @@ class DataFeed(replayer.Replayer):
         self.loaded_files = 0
         self.last_loaded_file = 'none'
 
+    @staticmethod
+    def load(filename, name, buffers):
+        """reads a day file, decoding the compressed ones into the buffer `buffers[name]`, reused from day to day"""
+        if not filename.endswith(storage.EXT):
+            return np.load(filename)
+        arr = storage.ChunkedArray(filename)
+        buf = buffers.get(name)
+        if buf is None or buf.shape[0] < arr.shape[0] or buf.shape[1:] != arr.shape[1:]:
+            buf = buffers[name] = np.empty(arr.shape, dtype=np.float32)
+        return arr.read_into(buf)
+
     def raw_numpy_gen(self, frac_from=0.0, frac_to=1.0, seed=42):
         file_names = list(self.replay.training_files(pair=self.symbol, side_bips=self.side_bips, side_width=self.side_width))
         num = len(file_names)
@@ -52,14 +62,17 @@ class DataFeed(replayer.Replayer):
             random.shuffle(files_for_dataset)
         if rangefrom == 0: # count training files only
             self.loaded_files = 0
+        # each generator has its own buffers, the training and validation ones being interleaved
+        buffers = {}
         for fn_bs, fn_ps, fn_ts in files_for_dataset:
-            arr_books = np.load(fn_bs)
-            arr_prices = np.load(fn_ps)
+            # the arrays of compressed days are only valid until the next day is loaded
+            arr_books = self.load(fn_bs, 'bs', buffers)
+            arr_prices = self.load(fn_ps, 'ps', buffers)
             try:
-                arr_time2level = np.load(fn_ts)
+                arr_time2level = self.load(fn_ts, 'ts', buffers)
             except FileNotFoundError:
                 arr_time2level = shapper.BookShapper.build_time_level_trade(arr_books, arr_prices, side_bips=self.side_bips, side_width=self.side_width)
-                np.save(fn_ts, arr_time2level)
+                storage.save_array(fn_ts, arr_time2level)
             self.last_loaded_file = fn_bs.split('/')[-1][:10]
             if rangefrom == 0: # count training files only
                 self.loaded_files += 1
@@ -67,6 +80,19 @@ class DataFeed(replayer.Replayer):
             assert arr_books.shape[0] ==  arr_time2level.shape[0]
             yield arr_books, arr_prices, arr_time2level
 
+    def backfill_labels(self, workers=None, chunk_rows=3600, overwrite=False, bips=None, horizons=None):
+        """
+        computes the missing time2level files in parallel, with look-ahead across day boundaries.
+        With `bips` and `horizons`, computes the multi labels files instead.
+        """
+        file_names = self.replay.training_files(pair=self.symbol, side_bips=self.side_bips, side_width=self.side_width)
+        if bips or horizons:
+            return labels.backfill_multi_labels(file_names, side_width=self.side_width, bips=bips or [self.side_bips],
+                                                horizons=horizons or [labels.FUTURE], chunk_rows=chunk_rows,
+                                                workers=workers, overwrite=overwrite)
+        return labels.backfill_time2level(file_names, side_bips=self.side_bips, side_width=self.side_width,
+                                          chunk_rows=chunk_rows, workers=workers, overwrite=overwrite)
+
     def batch_length(self, arr, sample_length):
         sample_num = arr.shape[0] // sample_length
         arr_length = arr[:sample_num*sample_length]
@@ -0,0 +1,65 @@
+import collections
+import numpy as np
+
+
+class DepthEvent(collections.namedtuple('DepthEvent', 'symbol time first_id last_id bids asks')):
+    """
+    an update of the book: `time` in ms, the update ids it spans, and the new size of the changed
+    levels as [(price, size)] floats, size 0.0 removing the level
+    """
+    __slots__ = ()
+
+    @property
+    def second(self):
+        """the second at the end of which the update is available"""
+        return 1 + self.time // 1000
+
+
+# the book at update `last_id`, its levels as [(price, size)] floats
+Snapshot = collections.namedtuple('Snapshot', 'last_id bids asks')
+
+# the columns of the float64 trade arrays: event time and trade time in ms, price, quantity,
+# ids of the first and last trades aggregated, and whether the buyer is the maker (1.0) or the taker (0.0)
+TRADE_FIELDS = ['time', 'trade_time', 'price', 'size', 'first_id', 'last_id', 'buyer_maker']
+
+
+def levels(pairs):
+    return [(float(level[0]), float(level[1])) for level in pairs]
+
+
+class BinanceFeed:
+    """
+    Normalizes the messages of a venue into `DepthEvent`, `Snapshot` and trade arrays, once at the edge,
+    so that the book, the shapper and the writer do not depend on the venue's message fields.
+    This is the one of Binance's diff depth and aggTrade streams and order book REST snapshots.
+    The recorded files keep the messages as they came from the venue, and are normalized at replay.
+    """
+    name = 'binance'
+
+    @staticmethod
+    def symbol(msg):
+        return msg['s']
+
+    @staticmethod
+    def is_error(msg):
+        return msg.get('e') == 'error'
+
+    @staticmethod
+    def depth(msg):
+        """the `DepthEvent` of a depth message, None for the other messages"""
+        if msg.get('e') != 'depthUpdate':
+            return None
+        return DepthEvent(msg['s'], msg['E'], msg['U'], msg['u'], levels(msg['b']), levels(msg['a']))
+
+    @staticmethod
+    def snapshot(res):
+        return Snapshot(res['lastUpdateId'], levels(res['bids']), levels(res['asks']))
+
+    @staticmethod
+    def trades(list_trades):
+        """the [N, len(TRADE_FIELDS)] float64 array of aggTrade messages"""
+        rows = [(t['E'], t['T'], t['p'], t['q'], t['f'], t['l'], t['m']) for t in list_trades]
+        return np.array(rows, dtype=np.float64).reshape(-1, len(TRADE_FIELDS))
+
+
+FEEDS = {feed.name: feed for feed in [BinanceFeed]}
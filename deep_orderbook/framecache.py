@@ -0,0 +1,165 @@
+import os
+import glob
+import json
+import pickle
+import collections
+import hashlib
+import zipfile
+import numpy as np
+import pandas as pd
+
+from deep_orderbook.shapper import BookShapper
+from deep_orderbook.snapshots import SnapshotChain, is_delta
+
+
+class FrameCache:
+    """
+    Content-addressed on-disk cache of the per-second frames reconstructed by `Replayer.replayL2_async`,
+    as `Replayer.replay_seconds_async` serves them to `multireplayL2_async`.
+
+    One entry holds the first frame and the last frame of every second of one recorded hour of one pair,
+    with the levels that the binning of `gen_array_async` looks at up to `max_zoom_frac`.
+    Its key chains the hashes of the hour's source files, the key of the previous hour
+    (the EMA is carried from one hour to the next) and the shapper parameters, so that
+    a parameter sweep over `gen_array_async` only pays for the book reconstruction once.
+    Entries are evicted least-recently-used first when the cache grows beyond `max_bytes`.
+    """
+    VERSION = 4
+
+    def __init__(self, cache_folder, max_bytes=8 * 2**30, max_zoom_frac=1/32):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.max_zoom_frac = max_zoom_frac
+        self.price_frac = BookShapper.MAX_SPACING * max_zoom_frac * BookShapper.REF_MARGIN
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_folder, exist_ok=True)
+        # {path: size} in least-recently-used order, listed once, the modification time being the LRU clock on disk
+        entries = []
+        for fn in glob.glob(f"{self.cache_folder}/*/*.pkl"):
+            st = os.stat(fn)
+            entries.append((st.st_mtime, fn, st.st_size))
+        self.sizes = collections.OrderedDict((fn, size) for _, fn, size in sorted(entries))
+        self.total = sum(self.sizes.values())
+
+    def check_zoom(self, zoom_frac):
+        """raises when the binning with `zoom_frac` would look at levels the cache does not keep"""
+        if zoom_frac > self.max_zoom_frac:
+            raise ValueError(f"the frame cache keeps the levels for a zoom_frac up to {self.max_zoom_frac}, not {zoom_frac}")
+
+    @staticmethod
+    def file_hash(filename, zip_path=None):
+        if zip_path:
+            # the archive already stores a checksum of each member's content
+            with zipfile.ZipFile(zip_path) as myzip:
+                info = myzip.getinfo(filename)
+            return f"{info.CRC:08x}-{info.file_size}"
+        h = hashlib.sha1()
+        with open(filename, 'rb') as fp:
+            for block in iter(lambda: fp.read(2**20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def params(self, shapper):
+        return {'version': self.VERSION, 'emaNew': shapper.emaNew, 'price_frac': self.price_frac,
+                'order_flow': shapper.flow is not None}
+
+    def key(self, files, zip_path, shapper, prev_key=None):
+        h = hashlib.sha1()
+        h.update(json.dumps(self.params(shapper), sort_keys=True).encode())
+        h.update((prev_key or '').encode())
+        for fn in files:
+            h.update(self.file_hash(fn, zip_path).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return f"{self.cache_folder}/{key[:2]}/{key}.pkl"
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fp:
+                rows = pickle.load(fp)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        if path in self.sizes:
+            self.sizes.move_to_end(path)
+        self.hits += 1
+        return [self.row2frame(row) for row in rows]
+
+    def store(self, key, rows):
+        """stores the rows of `frame2row`"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as fp:
+            pickle.dump(rows, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+        self.total -= self.sizes.pop(path, 0)
+        self.sizes[path] = os.path.getsize(path)
+        self.total += self.sizes[path]
+        self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.sizes) > 1:
+            path, size = self.sizes.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def frame2row(self, frame):
+        """only keeps the levels within `price_frac` of the price, all that the binning looks at up to `max_zoom_frac`"""
+        low, high = frame['price'] * (1 - self.price_frac), frame['price'] * (1 + self.price_frac)
+        bids = frame['bids'][frame['bids'].index >= low]
+        asks = frame['asks'][frame['asks'].index <= high]
+        return (frame['time'], frame['price'], frame['emaPrice'],
+                np.stack([bids.index.values, bids['size'].values], axis=-1),
+                np.stack([asks.index.values, asks['size'].values], axis=-1),
+                frame['trades'], frame.get('flow'))
+
+    @staticmethod
+    def row2frame(row):
+        ts, px, ema, bids, asks, trades, flow = row
+        frame = {'time': ts,
+                 'price': px,
+                 'bids': pd.DataFrame(bids, columns=['price', 'size']).set_index('price'),
+                 'asks': pd.DataFrame(asks, columns=['price', 'size']).set_index('price'),
+                 'trades': trades,
+                 'emaPrice': ema,
+                 }
+        if flow is not None:
+            frame['flow'] = flow
+        return frame
+
+    async def replay_async(self, replayer, pair, shapper):
+        """the frames of each group of `pair` as `Replayer.last_of_seconds` keeps them, from the cache or replayed and stored"""
+        prev_key = None
+        # the book of the snapshot deltas, rebuilt when a delta comes after groups served from the cache
+        chain = SnapshotChain(shapper.feed)
+        for files, zip_path in replayer.file_groups(pair):
+            key = self.key(files, zip_path, shapper, prev_key)
+            prev_key = key
+            frames = self.load(key)
+            if frames is not None:
+                if frames:
+                    # the EMA goes on from there in the next group replayed
+                    last = frames[-1]
+                    shapper.ts, shapper.px, shapper.emaPrice = last['time'], last['price'], last['emaPrice']
+                for oneSec in frames:
+                    yield oneSec
+                chain = None
+                continue
+            js_updates, list_trades, snapshot = replayer.load_group(files, zip_path)
+            if chain is None:
+                chain = replayer.rebuilt_chain(pair, files, shapper.feed) if is_delta(snapshot) else SnapshotChain(shapper.feed)
+            snapshot = chain.group(snapshot, js_updates)
+            rows = []
+            group = replayer.replay_group_async(shapper, js_updates, list_trades, snapshot)
+            async for oneSec in replayer.last_of_seconds(group):
+                # served as they are stored, so that the frames are the same as from the cache
+                rows.append(self.frame2row(oneSec))
+                yield self.row2frame(rows[-1])
+            self.store(key, rows)
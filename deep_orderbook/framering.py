@@ -0,0 +1,97 @@
+import os
+import mmap
+import tempfile
+import numpy as np
+
+
+class FrameRing:
+    """
+    Double-buffered image of the last `length` seconds, in a memory-mapped file shared between processes.
+
+    The producer shifts the front image by one column into the back buffer, writes the new
+    column at the right edge and flips the buffers. Readers in any process map the same file
+    and get a zero-copy view of the front image; a view stays untouched until the producer
+    starts writing the second frame after it, which `valid` tells.
+    """
+    MAGIC = 0x52494E47  # b'RING'
+    HEADER = 64
+    # header slots (uint64)
+    H_MAGIC, H_STARTED, H_DONE, H_ACTIVE, H_HEIGHT, H_LENGTH, H_CHANNELS = range(7)
+
+    def __init__(self, path, shape=None, writable=False):
+        self.path = path
+        self.writable = writable
+        # the ring that created the file removes it when closed
+        self.owner = shape is not None
+        self.closed = False
+        if shape is not None:
+            size = self.HEADER + 2 * int(np.prod(shape)) * 4
+            with open(path, 'wb') as fp:
+                fp.truncate(size)
+        with open(path, 'r+b' if writable else 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.header = np.ndarray((self.HEADER // 8,), dtype=np.uint64, buffer=self.mm)
+        if shape is not None:
+            self.header[self.H_HEIGHT:self.H_CHANNELS + 1] = shape
+            self.header[self.H_MAGIC] = self.MAGIC
+        assert self.header[self.H_MAGIC] == self.MAGIC, f"not a frame ring: {path}"
+        self.shape = tuple(int(x) for x in self.header[self.H_HEIGHT:self.H_CHANNELS + 1])
+        self.buffers = np.ndarray((2,) + self.shape, dtype=np.float32, buffer=self.mm, offset=self.HEADER)
+
+    @classmethod
+    def create(cls, shape, path=None):
+        """`shape` is (height, length, channels) of the image"""
+        if path is None:
+            folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            # unique, a process may run several streams
+            fd, path = tempfile.mkstemp(prefix=f"deep_orderbook-{os.getpid()}-", suffix='.ring', dir=folder)
+            os.close(fd)
+        return cls(path, shape=shape, writable=True)
+
+    @classmethod
+    def attach(cls, path):
+        return cls(path)
+
+    def close(self):
+        """removes the file of the ring that created it, the memory is unmapped with the last reference to the ring or its images"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.owner:
+            # the readers still mapping it keep their view
+            os.remove(self.path)
+
+    @property
+    def seq(self):
+        return int(self.header[self.H_DONE])
+
+    def push(self, column):
+        """`column` is the (height, channels) image of the last second"""
+        front = int(self.header[self.H_ACTIVE])
+        back = 1 - front
+        self.header[self.H_STARTED] += 1
+        self.buffers[back, :, :-1] = self.buffers[front, :, 1:]
+        self.buffers[back, :, -1] = column
+        self.header[self.H_ACTIVE] = back
+        self.header[self.H_DONE] += 1
+
+    def load(self, image):
+        """replaces the whole image, e.g. the one of a checkpoint, as `push` does a column"""
+        front = int(self.header[self.H_ACTIVE])
+        back = 1 - front
+        self.header[self.H_STARTED] += 1
+        self.buffers[back] = image
+        self.header[self.H_ACTIVE] = back
+        self.header[self.H_DONE] += 1
+
+    def read(self):
+        """returns (seq, image), the image being a read-only view of the shared buffer"""
+        while True:
+            seq = self.seq
+            active = int(self.header[self.H_ACTIVE])
+            if seq == self.seq:
+                return seq, self.buffers[active]
+
+    def valid(self, seq):
+        """whether the image returned along `seq` by `read` is still intact"""
+        return int(self.header[self.H_STARTED]) <= seq + 1
@@ -0,0 +1,190 @@
+import os
+import json
+import functools
+import concurrent.futures
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from tqdm.auto import tqdm
+
+from deep_orderbook import storage
+
+FUTURE = 120
+
+
+def first_passage(prices, future=FUTURE, num_rows=None):
+    """
+    running extremes reached over the next `future` rows, for the first `num_rows` rows:
+    the highest bid (or trade after the first second) and the lowest ask (or trade).
+    A level is first reached at the index of the first extreme crossing it.
+    """
+    n = prices.shape[0]
+    num_rows = n if num_rows is None else num_rows
+    bids, asks = prices[:, 0, 1], prices[:, 0, 2]
+    up = np.fmax(bids, prices[:, 1, 2])
+    dn = np.fmin(asks, prices[:, 0, 0])
+    tail = np.full(max(0, num_rows + future - 1 - n), np.nan, dtype=prices.dtype)
+    reach = []
+    for side, first, accumulate in ((up, bids, np.fmax), (dn, asks, np.fmin)):
+        window = sliding_window_view(np.concatenate([side, tail]), future)[:num_rows].copy()
+        # cannot trade with bid/ask of elapsed second
+        window[:, 0] = first[:num_rows]
+        reach.append(accumulate.accumulate(window, axis=1))
+    return reach
+
+
+def hit_times(prices, pricesteps, side_width, future=FUTURE, num_rows=None):
+    """
+    index of the first row reaching each of the `side_width` levels on both sides, for each price step:
+    an array [num_rows, 2*side_width, len(pricesteps)], down levels first (furthest first), `future` if never reached
+    """
+    reach_up, reach_dn = first_passage(prices, future, num_rows)
+    num_rows = reach_up.shape[0]
+    thresh = np.arange(side_width)[:, None] * np.asarray(pricesteps, dtype=np.float64)[None, :]
+    # the levels are computed in float64 then compared in float32, as numpy does for the scalar thresholds
+    a = prices[:num_rows, 0, 2].astype(np.float64)
+    b = prices[:num_rows, 0, 1].astype(np.float64)
+    levels_up = (a[:, None, None] + thresh).astype(np.float32).reshape(num_rows, -1)
+    levels_dn = (b[:, None, None] - thresh).astype(np.float32).reshape(num_rows, -1)
+    times = np.empty((num_rows, 2, side_width * len(pricesteps)), dtype=np.int32)
+    for i in range(num_rows):
+        times[i, 1] = np.searchsorted(reach_up[i], levels_up[i])
+        times[i, 0] = np.searchsorted(-reach_dn[i], -levels_dn[i])
+    times = times.reshape(num_rows, 2, side_width, len(pricesteps))
+    return np.concatenate([times[:, 0, ::-1], times[:, 1]], axis=1)
+
+
+def horizon_labels(times, horizon):
+    """time to each level within `horizon`, `horizon*10` when not reached or reached at once"""
+    return np.where((times > 0) & (times < horizon), times, horizon * 10)
+
+
+def time2level_rows(prices, pricestep, side_width, num_rows=None, future=FUTURE):
+    """
+    time for the price to reach each of the `side_width` levels on both sides, for the first `num_rows` rows.
+    The rows after them are only used as look-ahead.
+    """
+    times = hit_times(prices, [pricestep], side_width, future, num_rows)
+    return horizon_labels(times, future).astype(np.float32)
+
+
+def multi_labels(prices, side_width, bips, horizons, num_rows=None, day_prices=None):
+    """
+    the time2level labels of several bip widths and horizons, sharing one first-passage computation:
+    an array [num_rows, 2*side_width, len(horizons), len(bips)].
+    The level spacings are relative to the first row of `day_prices` (default `prices`).
+    """
+    day_prices = prices if day_prices is None else day_prices
+    steps = [pricestep_of(day_prices, side_bips, side_width) for side_bips in bips]
+    times = hit_times(prices, steps, side_width, max(horizons), num_rows)
+    labels = np.stack([horizon_labels(times, horizon) for horizon in horizons], axis=2)
+    assert labels.max() <= np.iinfo(np.uint16).max, 'horizons too long for uint16 labels'
+    return labels.astype(np.uint16)
+
+
+def save_labels(filename, labels, side_width, bips, horizons, chunk_rows=3600):
+    """saves multi labels as compressed chunks of `chunk_rows` rows, with their metadata"""
+    meta = {'side_width': side_width, 'bips': list(bips), 'horizons': list(horizons),
+            'rows': labels.shape[0], 'chunk_rows': chunk_rows}
+    chunks = {f"chunk{n:05}": labels[start:start + chunk_rows] for n, start in enumerate(range(0, labels.shape[0], chunk_rows))}
+    np.savez_compressed(filename, meta=json.dumps(meta), **chunks)
+
+
+def load_labels(filename, horizon=None, side_bips=None, start=0, stop=None):
+    """
+    loads the rows [start, stop) of a multi labels file, only decompressing the chunks they span.
+    Selecting a `horizon` and `side_bips` gives the float32 [rows, 2*side_width, 1] time2level layout.
+    """
+    with np.load(filename) as npz:
+        meta = json.loads(str(npz['meta']))
+        stop = meta['rows'] if stop is None else min(stop, meta['rows'])
+        size = meta['chunk_rows']
+        parts = [npz[f"chunk{n:05}"] for n in range(start // size, (stop - 1) // size + 1)] if stop > start else []
+    labels = np.concatenate(parts)[start % size:][:stop - start] if parts else np.zeros((0,), dtype=np.uint16)
+    if horizon is None and side_bips is None:
+        return labels, meta
+    h = meta['horizons'].index(horizon if horizon is not None else meta['horizons'][0])
+    b = meta['bips'].index(side_bips if side_bips is not None else meta['bips'][0])
+    return labels[:, :, h, b, None].astype(np.float32), meta
+
+
+def alpha(time2level):
+    """the training target of the time2level labels"""
+    return 10 / (1 + (time2level))
+
+
+def pricestep_of(prices, side_bips, side_width):
+    """the level spacing, relative to the first bid of the day"""
+    mult = 0.0001 * side_bips / side_width
+    return prices[0, 0, 1] * mult
+
+
+def day_of(prices):
+    return int(prices[0, 1, 0])
+
+
+def chunks_with_halo(days, chunk_rows, future=FUTURE):
+    """
+    cuts the consecutive `days` (a list of `ps` arrays) into (day index, start, window, num_rows) chunks.
+    Each window holds the `future` rows following its chunk, taken from the next day when it directly follows.
+    """
+    for n, prices in enumerate(days):
+        halo = np.zeros((0,) + prices.shape[1:], dtype=prices.dtype)
+        if n + 1 < len(days) and day_of(days[n + 1]) == day_of(prices) + 1:
+            halo = days[n + 1][:future]
+        num = prices.shape[0]
+        for start in range(0, num, chunk_rows):
+            stop = min(start + chunk_rows, num)
+            window = np.concatenate([prices[start:stop + future], halo[:max(0, stop + future - num)]])
+            yield n, start, window, stop - start
+
+
+def backfill(training_files, targets, compute, save, chunk_rows=3600, future=FUTURE, workers=None, overwrite=False):
+    """
+    computes and saves the labels of a list of (bs, ps, ...) day files in a process pool.
+    The days are split in chunks, each with a halo of look-ahead rows, and the results stitched back per day,
+    so that the last minutes of a day see the beginning of the next one.
+    `compute(window, day_prices, num_rows)` labels a chunk, `save(target, labels)` writes a day.
+    """
+    training_files = list(training_files)
+    todo = [n for n, target in enumerate(targets) if overwrite or not os.path.exists(target)]
+    if not todo:
+        return []
+    days = [storage.load_array(files[1], mmap_mode='r') for files in training_files]
+    results = {n: [] for n in todo}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for n, start, window, num_rows in chunks_with_halo(days, chunk_rows, future):
+            if n in results:
+                fut = pool.submit(compute, np.array(window), np.array(days[n][:1]), num_rows)
+                futures.append((n, start, fut))
+        for n, start, fut in tqdm(futures, leave=False):
+            results[n].append(fut.result())
+    for n in todo:
+        save(targets[n], np.concatenate(results[n]))
+    return [targets[n] for n in todo]
+
+
+def backfill_time2level(training_files, side_bips, side_width, chunk_rows=3600, future=FUTURE, workers=None, overwrite=False):
+    """the single time2level file of each (bs, ps, time2level) day"""
+    training_files = list(training_files)
+    compute = functools.partial(_time2level_chunk, side_bips=side_bips, side_width=side_width, future=future)
+    return backfill(training_files, [fn_ts for _, _, fn_ts in training_files], compute, storage.save_array,
+                    chunk_rows=chunk_rows, future=future, workers=workers, overwrite=overwrite)
+
+
+def backfill_multi_labels(training_files, side_width, bips, horizons, chunk_rows=3600, workers=None, overwrite=False):
+    """one `-labels.npz` file per day, next to its `-ps.npy` file, holding all the bip widths and horizons"""
+    training_files = list(training_files)
+    targets = [fn_ps[:-len('ps.npy')] + 'labels.npz' for _, fn_ps, *_ in training_files]
+    compute = functools.partial(_multi_chunk, side_width=side_width, bips=bips, horizons=horizons)
+    save = functools.partial(save_labels, side_width=side_width, bips=bips, horizons=horizons, chunk_rows=chunk_rows)
+    return backfill(training_files, targets, compute, save,
+                    chunk_rows=chunk_rows, future=max(horizons), workers=workers, overwrite=overwrite)
+
+
+def _time2level_chunk(window, day_prices, num_rows, side_bips, side_width, future):
+    return time2level_rows(window, pricestep_of(day_prices, side_bips, side_width), side_width, num_rows, future)
+
+
+def _multi_chunk(window, day_prices, num_rows, side_width, bips, horizons):
+    return multi_labels(window, side_width, bips, horizons, num_rows, day_prices=day_prices)
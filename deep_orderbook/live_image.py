@@ -1,6 +1,9 @@
 from deep_orderbook.recorder import Receiver, Writer
 from deep_orderbook.shapper import BookShapper
+from deep_orderbook.framering import FrameRing
+from deep_orderbook.checkpoint import Checkpointer
 
+import time
 import asyncio
 import pandas as pd
 import numpy as np
@@ -13,36 +16,101 @@ MARKETS = ["ETHBTC", "BTCUSDT", "ETHUSDT", "BNBBTC", "BNBETH", "BNBUSDT"]
 LENGTH = 512
 
 class ImageStream:
-    def __init__(self, markets):
-        self.frame = None
+    """
+    The live image of the markets in a `FrameRing`. With `checkpoint`, a file name, the shappers and the
+    image are saved every `checkpoint_every` seconds and restored on start-up, so that the EMA of the
+    reference prices and the history of the image do not have to be rebuilt.
+    """
+    def __init__(self, markets, ring_path=None, checkpoint=None, checkpoint_every=60):
+        self.ring = None
+        self.ring_path = ring_path
+        self.loop = None
+        self.task = None
         self.markets = markets or MARKETS
-    
+        self.checkpointer = Checkpointer(checkpoint, every=checkpoint_every) if checkpoint else None
+
     async def setup(self):
         self.receiver = await Receiver.create(markets=self.markets, print_level=1)
 
         shappers = {pair: await BookShapper.create() for pair in self.markets}
+        state = self.checkpointer.restore() if self.checkpointer else None
+        if state is not None and set(state['shappers']) != set(self.markets):
+            print(f"the checkpoint is of the markets {list(state['shappers'])}, starting cold")
+            state = None
+        if state is not None:
+            # the books are those of the receiver, fetched fresh from the exchange: a checkpointed one would miss
+            # the updates of the restart, only the reference prices, trades and image are restored
+            for pair, shapper in shappers.items():
+                await shapper.set_state_async(state['shappers'][pair])
+        self.shappers = shappers
         multi_replay = self.receiver.multi_generator(shappers)
 
         _ = await multi_replay.__anext__()
 
-        genarr = BookShapper.gen_array_async(market_replay=multi_replay, markets=self.markets)
-        _ = await aioitertools.next(genarr)
+        self.genarr = BookShapper.gen_array_async(market_replay=multi_replay, markets=self.markets)
+        first = await aioitertools.next(self.genarr)
+
+        column = BookShapper.image_column(first, self.markets)
+        self.ring = FrameRing.create(shape=(column.shape[0], LENGTH, column.shape[1]), path=self.ring_path)
+        self.ring_path = self.ring.path
+        image = self.resumed_image(state, time.time()) if state is not None else None
+        if image is not None and image.shape == self.ring.shape:
+            self.ring.load(image)
+        self.ring.push(column * 255)
 
-        self.genacc = aioitertools.accumulate(genarr, functools.partial(BookShapper.build, max_length=LENGTH))
-        _ = await aioitertools.next(self.genacc)
+    @staticmethod
+    def resumed_image(state, now):
+        """the checkpointed image shifted by blank columns for the seconds missed until `now`, None when all were"""
+        image = state['image']
+        missed = int(now - state['time']) - 1
+        if missed >= image.shape[1]:
+            return None
+        if missed <= 0:
+            return image
+        resumed = np.zeros_like(image)
+        resumed[:, :-missed] = image[:, missed:]
+        return resumed
+
+    def get_state(self):
+        return {'shappers': {pair: shapper.get_state() for pair, shapper in self.shappers.items()},
+                'image': self.ring.read()[1].copy(),
+                # of the last column of the image
+                'time': time.time()}
 
     async def run(self):
-        async for toshow in BookShapper.images(accumulated_arrays=self.genacc, every=1, LENGTH=LENGTH):
-            self.frame = toshow.copy()
+        try:
+            async for second in self.genarr:
+                self.ring.push(BookShapper.image_column(second, self.markets) * 255)
+                if self.checkpointer:
+                    await self.checkpointer.maybe_save_async(self.get_state)
+        finally:
+            self.close_ring()
 
     def start(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        asyncio.get_event_loop().run_until_complete(self.setup())
-        asyncio.get_event_loop().run_until_complete(self.run())
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.setup())
+        self.task = self.loop.create_task(self.run())
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
 
     def stop(self):
-        pass
+        """stops `run`, from any thread, the ring being closed once it has"""
+        if self.task is not None and not self.task.done():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        else:
+            self.close_ring()
+
+    def close_ring(self):
+        ring, self.ring = self.ring, None
+        if ring is not None:
+            ring.close()
 
     def read(self):
-        return self.frame if self.frame is None else self.frame * 255
\ No newline at end of file
+        """zero-copy view of the latest picture, other processes can `FrameRing.attach(self.ring_path)`"""
+        ring = self.ring
+        if ring is None:
+            return None
+        return ring.read()[1]
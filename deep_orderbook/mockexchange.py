@@ -0,0 +1,150 @@
+import time
+import asyncio
+import datetime
+import collections
+
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.feeds import BinanceFeed
+from deep_orderbook.snapshots import is_delta
+
+
+class MockExchange:
+    """
+    Local stand-in for Binance serving recorded L2 files, to be given as `transport` to a `Receiver` or `Writer`.
+
+    The REST client serves the recorded hourly snapshots, and the recorded depth updates and
+    aggregated trades are pushed to the websocket callbacks at their recorded pace sped up by
+    `speed` (as fast as possible when `speed` is None). All streams share one clock, started by
+    the first one. Messages that could not be delivered within `max_lag` seconds of their due
+    time are dropped, as the exchange would do with a slow consumer, and counted in `stats`.
+    """
+    feed = BinanceFeed()
+
+    def __init__(self, data_folder, speed=1.0, max_lag=None, date_regexp=''):
+        self.replayer = Replayer(data_folder, date_regexp=date_regexp, prefetch=0)
+        self.speed = speed
+        self.max_lag = max_lag
+        self.t0_wall = None
+        self.t0_event = None
+        self.position = {}
+        self.finished = {}
+        self.groups = {}
+        self.stats = collections.defaultdict(lambda: {'sent': 0, 'dropped': 0, 'lag_sum': 0.0, 'lag_max': 0.0})
+
+    async def create_client(self):
+        return MockClient(self)
+
+    def socket_manager(self, client):
+        return MockSocketManager(self)
+
+    def file_groups(self, symbol):
+        """the recorded groups of `symbol`, listed on the first request for it"""
+        if symbol not in self.groups:
+            self.groups[symbol] = list(self.replayer.file_groups(symbol))
+        return self.groups[symbol]
+
+    @staticmethod
+    def group_time_ms(files):
+        ts = files[0].split('/')[-1][:19]
+        utc = datetime.datetime.strptime(ts, '%Y-%m-%dT%H-%M-%S').replace(tzinfo=datetime.timezone.utc)
+        return int(utc.timestamp() * 1000)
+
+    def due_time(self, event_ms):
+        if self.speed is None:
+            return None
+        return self.t0_wall + (event_ms - self.t0_event) / 1000 / self.speed
+
+    def order_book(self, symbol, limit):
+        """the last recorded snapshot before the current position of the symbol's depth stream"""
+        groups = self.file_groups(symbol)
+        position = self.position.get(symbol)
+        chosen = 0
+        for n, (files, zip_path) in enumerate(groups):
+            if position is not None and self.group_time_ms(files) <= position:
+                chosen = n
+        files, zip_path = groups[chosen]
+        snapshot = Replayer.load_file(files[0], zip_path)
+        if is_delta(snapshot):
+            chain = Replayer.chain_of(groups, chosen, self.feed)
+            expanded = chain.group(snapshot, Replayer.load_file(files[2], zip_path))
+            snapshot = {'lastUpdateId': expanded.last_id, 'bids': expanded.bids, 'asks': expanded.asks}
+        return {'lastUpdateId': snapshot['lastUpdateId'], 'bids': snapshot['bids'][:limit], 'asks': snapshot['asks'][:limit]}
+
+    async def wait_finished(self, timeout=None):
+        """waits until the streams started have sent all their recorded messages"""
+        await asyncio.wait_for(asyncio.gather(*[event.wait() for event in self.finished.values()]), timeout)
+
+    def stream(self, symbol, kind, callback):
+        """the coroutine sending the messages of a stream, awaited by `wait_finished` from now on"""
+        finished = self.finished[f"{symbol}@{kind}"] = asyncio.Event()
+        return self.send_async(symbol, kind, callback, finished)
+
+    async def send_async(self, symbol, kind, callback, finished):
+        loop = asyncio.get_event_loop()
+        stats = self.stats[f"{symbol}@{kind}"]
+        for files, zip_path in self.file_groups(symbol):
+            if self.t0_wall is None:
+                self.t0_wall = time.time()
+                self.t0_event = self.group_time_ms(files)
+            # files are (snapshot, trades, update)
+            filename = files[2] if kind == 'depth' else files[1]
+            msgs = await loop.run_in_executor(None, Replayer.load_file, filename, zip_path)
+            for msg in msgs:
+                due = self.due_time(msg['E'])
+                if due is None:
+                    await asyncio.sleep(0)
+                else:
+                    delay = due - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    lag = max(0.0, -delay)
+                    if self.max_lag is not None and lag > self.max_lag:
+                        stats['dropped'] += 1
+                        continue
+                    stats['lag_sum'] += lag
+                    stats['lag_max'] = max(stats['lag_max'], lag)
+                if kind == 'depth':
+                    self.position[symbol] = msg['E']
+                stats['sent'] += 1
+                await callback(msg)
+        finished.set()
+
+
+class MockClient:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    async def get_symbol_ticker(self, symbol):
+        book = self.exchange.order_book(symbol, limit=1)
+        return {'symbol': symbol, 'price': book['bids'][0][0]}
+
+    async def get_order_book(self, symbol, limit=100):
+        return self.exchange.order_book(symbol, limit)
+
+    async def close_connection(self):
+        pass
+
+
+class MockSocketManager:
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.tasks = {}
+
+    async def start_socket(self, conn_key, coro):
+        self.tasks[conn_key] = asyncio.ensure_future(coro)
+        return conn_key
+
+    async def start_depth_socket(self, symbol, callback, depth=None, interval=None):
+        return await self.start_socket(f"{symbol.lower()}@depth", self.exchange.stream(symbol, 'depth', callback))
+
+    async def start_aggtrade_socket(self, symbol, callback):
+        return await self.start_socket(f"{symbol.lower()}@aggTrade", self.exchange.stream(symbol, 'aggTrade', callback))
+
+    async def stop_socket(self, conn_key):
+        task = self.tasks.pop(conn_key, None)
+        if task:
+            task.cancel()
+
+    async def close(self):
+        for conn_key in list(self.tasks):
+            await self.stop_socket(conn_key)
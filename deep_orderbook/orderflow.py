@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class OrderFlow:
+    """
+    Per-level order flow of one book between two ticks, fed by `DepthCachePlus` with every level update
+    before it is applied: the size added and removed at each price, the number of times the level was
+    emptied (queue depletion) and the number of updates, at O(1) per update.
+
+    `levels` is {'bids': {price: [added, removed, emptied, updates]}, 'asks': {...}}.
+    A new `levels` dict is started at each tick, so that a finished one is never modified again.
+    """
+    CHANNELS = ['added', 'removed', 'emptied', 'updates']
+
+    def __init__(self):
+        self.second = None
+        self.levels = {'bids': {}, 'asks': {}}
+
+    def on_level(self, side, price, size, previous):
+        stats = self.levels[side].get(price)
+        if stats is None:
+            stats = self.levels[side][price] = [0.0, 0.0, 0, 0]
+        if size > previous:
+            stats[0] += size - previous
+        else:
+            stats[1] += previous - size
+        if size == 0.0 and previous > 0.0:
+            stats[2] += 1
+        stats[3] += 1
+
+    def roll(self, second=None):
+        """starts the accumulation of a new tick, returns the finished one"""
+        levels = self.levels
+        self.second = second
+        self.levels = {'bids': {}, 'asks': {}}
+        return levels
+
+    def at(self, second):
+        """the accumulation of `second`, started when the previous updates were of another second"""
+        if second != self.second:
+            self.roll(second)
+        return self.levels
+
+    @staticmethod
+    def binned(flows, edges):
+        """
+        the order flow of several books in the levels of `BookShapper.bin_books_batch` (`edges` [S, 2W]):
+        a [S, 2W, 4] array of the arcsinh of each statistic, bids - asks. `flows` may contain None.
+        """
+        num, width = edges.shape
+        out = np.zeros((num, width, len(OrderFlow.CHANNELS)))
+        for side, sign in (('bids', 1), ('asks', -1)):
+            sides = [flow[side] if flow else {} for flow in flows]
+            length = max(map(len, sides), default=0)
+            prices = np.full((num, length), np.nan)
+            stats = np.zeros((num, length, len(OrderFlow.CHANNELS)))
+            for n, levels in enumerate(sides):
+                if levels:
+                    prices[n, :len(levels)] = list(levels.keys())
+                    stats[n, :len(levels)] = list(levels.values())
+            # as for the books: a bid level holds the prices from its edge up to the next one, an ask level
+            # the prices above the previous edge up to its own, and the outermost edges hold nothing
+            if side == 'bids':
+                level = (edges[:, None, :] <= prices[:, :, None]).sum(-1) - 1
+                valid = (level >= 0) & (level < width - 1)
+            else:
+                level = (edges[:, None, :] < prices[:, :, None]).sum(-1)
+                valid = (level >= 1) & (level < width)
+            rows = np.broadcast_to(np.arange(num)[:, None], level.shape)
+            binned = np.zeros_like(out)
+            np.add.at(binned, (rows[valid], level[valid]), stats[valid])
+            out += sign * np.arcsinh(binned)
+        return out.astype(np.float32)
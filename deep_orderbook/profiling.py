@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import collections
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+# the stage a module of the package belongs to, the others are their own stage
+STAGES = {
+    'replayer': 'replay', 'catalog': 'replay', 'framecache': 'replay',
+    'recorder': 'record', 'mockexchange': 'record', 'orderflow': 'record',
+    'shapper': 'shape', 'tradebuckets': 'shape',
+    'accumulator': 'write', 'storage': 'write',
+    '__main__': 'cli', 'profiling': 'cli',
+}
+# a thread whose innermost frame is in these modules is waiting, e.g. an executor worker on its queue
+IDLE = {'threading.py', 'queue.py', 'selectors.py', 'thread.py'}
+
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def stage_of(filename):
+    """the stage of the code in `filename`, None when outside of the package"""
+    if not os.path.abspath(filename).startswith(PACKAGE):
+        return None
+    module = os.path.splitext(os.path.basename(filename))[0]
+    return STAGES.get(module, module)
+
+
+class Profiler:
+    """
+    Profiles a block of code, as a context manager:
+
+    - 'sample' (default): a thread samples the stacks of the other threads every `interval` seconds,
+      with little overhead, so it can run on full days of data.
+    - 'cprofile': deterministic profiling with `cProfile` of the calling thread, exact call counts but slower.
+
+    Both give a per-stage time breakdown, a stage being the module of the package that is innermost
+    in the stack (see `STAGES`), 'other' for the time spent outside of it (event loop, reading files),
+    'idle' for the sampled threads waiting on a lock or a queue.
+    `save(prefix)` writes the breakdown to `prefix.stages.txt`, and the stacks to `prefix.folded`
+    (sampling) for flamegraph.pl / speedscope / inferno, or to `prefix.prof` (cProfile) for pstats / snakeviz.
+    """
+    def __init__(self, mode='sample', interval=0.005):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError(f"unknown profiling mode: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stages = collections.Counter()
+        self.num_samples = 0
+        self.rounds = 0
+        self.elapsed = 0.0
+        self.profile = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.thread = threading.Thread(target=self.sample_loop, name='profiler', daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.disable()
+            self.stages = self.cprofile_stages(pstats.Stats(self.profile))
+        else:
+            self.stopping.set()
+            self.thread.join()
+        self.elapsed = time.perf_counter() - self.start
+        return False
+
+    def sample_loop(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopping.wait(self.interval):
+            self.rounds += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.add_sample(names.get(ident, str(ident)), frame)
+
+    def add_sample(self, thread_name, frame):
+        stack = []
+        stage = 'idle' if os.path.basename(frame.f_code.co_filename) in IDLE else None
+        while frame is not None:
+            stack.append(frame_name(frame.f_code))
+            if stage is None:
+                stage = stage_of(frame.f_code.co_filename)
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.stacks[';'.join(reversed(stack))] += 1
+        self.stages[stage or 'other'] += 1
+        self.num_samples += 1
+
+    @staticmethod
+    def cprofile_stages(stats):
+        """
+        own time of the functions summed per stage, the time of a function outside of the package
+        (numpy, pandas, json) being shared among the stages of its callers, pro rata of the time spent for each
+        """
+        shares = {}
+
+        def shares_of(func, visiting=()):
+            if func in shares:
+                return shares[func]
+            stage = stage_of(func[0])
+            callers = stats.stats[func][4]
+            if stage is not None or not callers or func in visiting:
+                return {stage or 'other': 1.0}
+            mix = collections.Counter()
+            total = sum(ct for cc, nc, tt, ct in callers.values()) or 1
+            for caller, (cc, nc, tt, ct) in callers.items():
+                for caller_stage, share in shares_of(caller, visiting + (func,)).items():
+                    mix[caller_stage] += share * ct / total
+            shares[func] = mix
+            return mix
+
+        stages = collections.Counter()
+        for func, (cc, nc, tottime, cumtime, callers) in stats.stats.items():
+            for stage, share in shares_of(func).items():
+                stages[stage] += share * tottime
+        return stages
+
+    def breakdown(self):
+        """[(stage, seconds, fraction)] by decreasing time"""
+        total = sum(self.stages.values()) or 1
+        if self.mode == 'cprofile':
+            return [(stage, t, t / total) for stage, t in self.stages.most_common()]
+        # in thread-seconds, each round of samples spanning the same share of the run
+        per_sample = self.elapsed / max(self.rounds, 1)
+        return [(stage, n * per_sample, n / total) for stage, n in self.stages.most_common()]
+
+    def report(self):
+        lines = [f"{self.mode} profile: {self.elapsed:.2f}s" + (f", {self.num_samples} samples" if self.num_samples else '')]
+        lines += [f"{stage:>12} {seconds:10.3f}s {100 * frac:6.1f}%" for stage, seconds, frac in self.breakdown()]
+        return '\n'.join(lines)
+
+    def save(self, prefix):
+        """writes the breakdown and the stacks, returns the written files"""
+        folder = os.path.dirname(prefix)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        written = [f"{prefix}.stages.txt"]
+        with open(written[0], 'w') as fp:
+            fp.write(self.report() + '\n')
+        if self.profile is not None:
+            written.append(f"{prefix}.prof")
+            self.profile.dump_stats(written[-1])
+        else:
+            written.append(f"{prefix}.folded")
+            with open(written[-1], 'w') as fp:
+                for stack, count in self.stacks.most_common():
+                    fp.write(f"{stack} {count}\n")
+        return written
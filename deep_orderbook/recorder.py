@@ -3,62 +3,120 @@ import datetime
 import json
 import os, sys
 import collections
-import copy
-import threading
+import bisect
 import asyncio
-import aiofiles
 from binance import AsyncClient, DepthCacheManager # Import the Binance Client
 
 # Import the Binance Socket Manager
 from binance.websockets import BinanceSocketManager
 from binance.exceptions import BinanceAPIException
 from binance.depthcache import DepthCache
+from deep_orderbook.orderflow import OrderFlow
+from deep_orderbook.feeds import BinanceFeed
+from deep_orderbook import snapshots
 
 # https://github.com/binance-exchange/binance-official-api-docs/blob/master/web-socket-streams.md#how-to-manage-a-local-order-book-correctly
-DEBUG = False
 
 class DepthCachePlus(DepthCache):
-    def add_bid(self, bid):
-        pr = float(bid[0])
-        sz = float(bid[1])
-        self._bids[pr] = sz
+    """
+    Depth cache keeping the prices of each side sorted as they are updated, so that the book
+    is read without sorting and its best levels in O(1).
+
+    A crossed book, usually from a missed update, is repaired by popping the crossing levels
+    from the best end of each side, in O(levels removed). The repairs are counted in `stats`,
+    and `gap_hint` keeps the update time of the last one, for the manager to resync from a snapshot.
+    """
+    # an `orderflow.OrderFlow` fed with every level update, when set
+    flow = None
+
+    def __init__(self, symbol, *args, **kwargs):
+        super().__init__(symbol, *args, **kwargs)
+        # ascending bid prices and negated ask prices: the best level of both sides is the last one
+        self._bid_keys = []
+        self._ask_keys = []
+        self.stats = collections.Counter()
+        self.gap_hint = None
+
+    def clear(self):
+        self._bids = {}
+        self._asks = {}
+        self._bid_keys = []
+        self._ask_keys = []
+        self.gap_hint = None
+
+    @staticmethod
+    def set_level(levels, keys, key, pr, sz):
         if sz == 0.0:
-            del self._bids[pr]
+            if levels.pop(pr, None) is not None:
+                del keys[bisect.bisect_left(keys, key)]
+            return
+        if pr not in levels:
+            bisect.insort(keys, key)
+        levels[pr] = sz
+
+    def set_bid(self, pr, sz):
+        if self.flow is not None:
+            self.flow.on_level('bids', pr, sz, self._bids.get(pr, 0.0))
+        self.set_level(self._bids, self._bid_keys, pr, pr, sz)
+
+    def set_ask(self, pr, sz):
+        if self.flow is not None:
+            self.flow.on_level('asks', pr, sz, self._asks.get(pr, 0.0))
+        self.set_level(self._asks, self._ask_keys, -pr, pr, sz)
+
+    def add_bid(self, bid):
+        self.set_bid(float(bid[0]), float(bid[1]))
 
     def add_ask(self, ask):
-        pr = float(ask[0])
-        sz = float(ask[1])
-        self._asks[pr] = sz
-        if sz == 0.0:
-            del self._asks[pr]
+        self.set_ask(float(ask[0]), float(ask[1]))
+
+    def get_bids(self):
+        return [[p, self._bids[p]] for p in reversed(self._bid_keys)]
+
+    def get_asks(self):
+        return [[-k, self._asks[-k]] for k in reversed(self._ask_keys)]
+
+    def uncross(self):
+        """removes the bids at or above the best ask and the asks at or below the best bid"""
+        bid_keys, ask_keys = self._bid_keys, self._ask_keys
+        best_bid, best_ask = bid_keys[-1], -ask_keys[-1]
+        if best_bid < best_ask:
+            return
+        self.stats['crossed'] += 1
+        self.gap_hint = self.update_time
+        while bid_keys and bid_keys[-1] >= best_ask:
+            del self._bids[bid_keys.pop()]
+            self.stats['removed_bids'] += 1
+        while ask_keys and -ask_keys[-1] <= best_bid:
+            del self._asks[-ask_keys.pop()]
+            self.stats['removed_asks'] += 1
+
+    def best(self):
+        """the best bid and ask levels, as the first ones of `get_bids_asks`"""
+        self.uncross()
+        bid, ask = self._bid_keys[-1], -self._ask_keys[-1]
+        assert bid < ask
+        return [bid, self._bids[bid]], [ask, self._asks[ask]]
 
     def get_bids_asks(self):
+        self.uncross()
         bids = self.get_bids()
         asks = self.get_asks()
-        if bids[0][0] >= asks[0][0]:
-            print(f"\ncleaning the crossed BBO \nBIDS: {bids[:5]}\nASKS: {asks[:5]}")
-            for p in list(self._bids.keys()):
-                if p >= asks[0][0]:
-                    if DEBUG:
-                        print(f"del bids[{p}]")
-                    del self._bids[p]
-            for p in list(self._asks.keys()):
-                if p <= bids[0][0]:
-                    if DEBUG:
-                        print(f"del asks[{p}]")
-                    del self._asks[p]
-            bids = self.get_bids()
-            asks = self.get_asks()
-            print(f"result: \nBIDS: {bids[:5]}\nASKS: {asks[:5]}")
-
         assert bids[0][0] < asks[0][0]
         return bids, asks
 
 
 class MessageDepthCacheManager(DepthCacheManager):
+    """
+    Depth cache manager applying the `feeds.DepthEvent` of the messages normalized by `feed`,
+    either as they come from the depth socket (`_depth_event`) or replayed (`on_event`),
+    with the snapshots given as `feeds.Snapshot` (replayed) or fetched from the client.
+    """
     _default_refresh = 60 * 30  # 30 minutes
+    # seconds between two snapshots fetched to resync a repaired book
+    _min_resync = 10
     @classmethod
-    async def create(cls, client, loop, symbol, coro=None, refresh_interval=_default_refresh, bm=None, limit=500, msg_coro=None):
+    async def create(cls, client, loop, symbol, coro=None, refresh_interval=_default_refresh, bm=None, limit=500, msg_coro=None, feed=None):
         self = MessageDepthCacheManager()
         self._client = client
         self._loop = loop
@@ -66,11 +124,14 @@ class MessageDepthCacheManager(DepthCacheManager):
         self._limit = limit
         self._coro = coro
         self._msg_coro = msg_coro
+        self.feed = feed or BinanceFeed()
         self._last_update_id = None
         self._depth_message_buffer = []
         self._bm = bm
         self._depth_cache = DepthCachePlus(self._symbol)
         self._refresh_interval = refresh_interval
+        self._refresh_time = None
+        self._snapshot_time = None
         self.trades = list()
 
         if self._client:
@@ -80,45 +141,100 @@ class MessageDepthCacheManager(DepthCacheManager):
         return self
         
     async def _init_cache(self, snapshot=None):
-        if self._client:
-            await super()._init_cache()
-            return
+        # a snapshot is not order flow
+        flow, self._depth_cache.flow = self._depth_cache.flow, None
+        try:
+            await self._load_cache(snapshot)
+        finally:
+            self._depth_cache.flow = flow
 
-        if not snapshot:
+    async def _load_cache(self, snapshot=None):
+        if snapshot is None and not self._client:
             return
 
         self._last_update_id = None
         self._depth_message_buffer = []
-        res = snapshot
-        self._depth_cache._bids = {}
-        self._depth_cache._asks = {}
+        if snapshot is None:
+            res = await self._client.get_order_book(symbol=self._symbol, limit=self._limit)
+            snapshot = self.feed.snapshot(res)
+            self._snapshot_time = time.time()
+            # set a time to refresh the depth cache
+            if self._refresh_interval:
+                self._refresh_time = int(time.time()) + self._refresh_interval
+        self._depth_cache.clear()
 
         # process bid and asks from the order book
-        for bid in res['bids']:
-            self._depth_cache.add_bid(bid)
-        for ask in res['asks']:
-            self._depth_cache.add_ask(ask)
+        for pr, sz in snapshot.bids:
+            self._depth_cache.set_bid(pr, sz)
+        for pr, sz in snapshot.asks:
+            self._depth_cache.set_ask(pr, sz)
 
         # set first update id
-        self._last_update_id = res['lastUpdateId']
-        # print("\nfirst update", self._last_update_id)
-
-#        # set a time to refresh the depth cache
-#        if self._refresh_interval:
-#            self._refresh_time = int(time.time()) + self._refresh_interval
+        self._last_update_id = snapshot.last_id
 
         # Apply any updates from the websocket
-        for msg in self._depth_message_buffer:
-            await self._process_depth_message(msg, buffer=True)
+        for event in self._depth_message_buffer:
+            await self._process_depth_message(event, buffer=True)
 
         # clear the depth buffer
         del self._depth_message_buffer
 
+    async def _process_depth_message(self, event, buffer=False):
+        if buffer and event.last_id <= self._last_update_id:
+            return
+        elif event.first_id != self._last_update_id + 1:
+            await self._init_cache()
+
+        depth_cache = self._depth_cache
+        for pr, sz in event.bids:
+            depth_cache.set_bid(pr, sz)
+        for pr, sz in event.asks:
+            depth_cache.set_ask(pr, sz)
+        depth_cache.update_time = event.time
+        if self._coro:
+            await self._coro(depth_cache)
+        self._last_update_id = event.last_id
+
+        if self._refresh_time and int(time.time()) > self._refresh_time:
+            await self._init_cache()
+        elif self.needs_resync():
+            depth_cache.stats['resyncs'] += 1
+            await self._init_cache()
+
+    def needs_resync(self):
+        """whether the book was repaired from a crossing since the last snapshot fetched, not too recently"""
+        if not self._client or self._depth_cache.gap_hint is None:
+            return False
+        return self._snapshot_time is None or time.time() - self._snapshot_time > self._min_resync
+
+    async def on_event(self, event):
+        if self._last_update_id is None:
+            self._depth_message_buffer.append(event)
+        else:
+            await self._process_depth_message(event)
+
     async def _depth_event(self, msg):
-        await super()._depth_event(msg)
+        event = self.feed.depth(msg)
+        if event is not None:
+            await self.on_event(event)
+        elif self.feed.is_error(msg):
+            # the library closes the socket
+            await super()._depth_event(msg)
+            return
         if self._msg_coro:
             await self._msg_coro(msg)
 
+class BinanceTransport:
+    """the REST client and websocket manager the receiver talks to, see `mockexchange.MockExchange` for a local one"""
+    feed = BinanceFeed()
+
+    async def create_client(self):
+        return await AsyncClient.create()
+
+    def socket_manager(self, client):
+        return BinanceSocketManager(client, loop=asyncio.get_event_loop())
+
+
 class Receiver:
 
     @classmethod
@@ -128,22 +244,32 @@ class Receiver:
         await self.setup(**kwargs)
         return self
 
-    async def setup(self, markets, print_level=2):
+    @staticmethod
+    def feed_of(transport):
+        """the `feeds` adapter of the messages of `transport`"""
+        return getattr(transport, 'feed', None) or BinanceFeed()
+
+    async def setup(self, markets, print_level=2, transport=None, order_flow=False):
         self.last_update_time = time.time()
         self.print_level = print_level
+        self.order_flow = order_flow
         self.markets = markets
+        self.transport = transport or BinanceTransport()
+        self.feed = self.feed_of(self.transport)
         # Instantiate a Client
-        self.client = await AsyncClient.create()
+        self.client = await self.transport.create_client()
         #print(json.dumps(await self.client.get_exchange_info(), indent=2))
         for m in self.markets:
             print(json.dumps(await self.client.get_symbol_ticker(symbol=m), indent=2))
 
         # Instantiate a BinanceSocketManager, passing in the client that you instantiated
-        self.bm = BinanceSocketManager(self.client, loop=asyncio.get_event_loop())
+        self.bm = self.transport.socket_manager(self.client)
         self.nummsg = collections.defaultdict(int)
         self.conn_keys = []
         self.depth_managers = {}
         self.trade_managers = collections.defaultdict(list)
+        self.tick_trades = None
+        self.tick_stats = collections.Counter()
 
         await self.stoprestart()
 
@@ -171,14 +297,14 @@ class Receiver:
             ]
         }
         """
-        symbol = msg['s']
+        symbol = self.feed.symbol(msg)
 
     async def on_depth(self, depth_cache):
         symbol = depth_cache.symbol
         if symbol not in self.depth_managers:
             return
-        self.depth_managers[symbol].trades = copy.deepcopy(self.trade_managers[symbol])
-        self.trade_managers[symbol] = list()
+        # the messages were copied as they came
+        self.depth_managers[symbol].trades, self.trade_managers[symbol] = self.trade_managers[symbol], list()
 
     async def on_aggtrades(self, msg):
         """
@@ -197,8 +323,11 @@ class Receiver:
         }
         """
         self.last_update_time = time.time()
-        symbol = msg["s"]
-        self.trade_managers[symbol].append(copy.deepcopy(msg))
+        symbol = self.feed.symbol(msg)
+        # the messages are never modified, the writer and the tick share them
+        self.trade_managers[symbol].append(msg)
+        if self.tick_trades is not None:
+            self.tick_trades[symbol].append(msg)
         self.nummsg[symbol] += 1
         if self.print_level >= 2:
             print(', '.join([f'{s}: {self.nummsg[s]:06}' for s in self.markets]), end='\r')
@@ -225,76 +354,150 @@ class Receiver:
                                                                      self.on_depth,
                                                                      bm=self.bm,
                                                                      limit=1000,
-                                                                     msg_coro=self.on_depth_msg
+                                                                     msg_coro=self.on_depth_msg,
+                                                                     feed=self.feed
                                                                      )
+                if self.order_flow:
+                    depthmanager.get_depth_cache().flow = OrderFlow()
                 self.depth_managers[symbol] = depthmanager
 
-    async def multi_generator(self, symbol_shappers):
+    def snapshot_books(self, symbols):
+        """books and trades of all symbols, taken without yielding to the event loop"""
+        snapshot = {}
+        for symbol in symbols:
+            depth_cache = self.depth_managers[symbol].get_depth_cache()
+            bids, asks = depth_cache.get_bids_asks()
+            flow = depth_cache.flow.roll() if depth_cache.flow is not None else None
+            snapshot[symbol] = bids, asks, self.tick_trades.pop(symbol, []), flow
+        return snapshot
+
+    @staticmethod
+    def build_frame(shapper, bids, asks, list_trades, flow, twake):
+        shapper.ema_step(bids, asks, twake)
+        shapper.add_trades(list_trades, force_t_avail=twake)
+        return shapper.make_frames(t_avail=twake, bids=bids, asks=asks, flow=flow)
+
+    async def multi_generator(self, symbol_shappers, executor=None):
+        """
+        yields the frames of all symbols at each wall-clock second.
+        The books are snapshotted together at the tick and the frames are built in parallel in `executor`
+        (the default thread pool when None). When the building falls more than a second behind, the missed
+        ticks are skipped and their trades coalesced into the next one, as counted in `tick_stats`.
+        """
+        loop = asyncio.get_event_loop()
+        self.tick_trades = collections.defaultdict(list)
         tall = time.time()
-        tall = tall // 1
+        tall = tall // 1 + 1
         while True:
             twake = tall
             timesleep = twake - time.time()
             if timesleep > 0:
                 await asyncio.sleep(timesleep)
-            else:
-                print(f"time sleep is negative: {timesleep}")
-
-            oneSec = {}
-            for symbol,shapper in symbol_shappers.items():
-                bids, asks = self.depth_managers[symbol].get_depth_cache().get_bids_asks()
-                await shapper.update_ema(bids, asks, twake)
-                list_trades = self.depth_managers[symbol].trades
-                await shapper.on_trades_bunch(list_trades, force_t_avail=twake)
-                oneSec[symbol] = await shapper.make_frames_async(t_avail=twake, bids=bids, asks=asks)
+            elif timesleep <= -1:
+                missed = int(-timesleep)
+                self.tick_stats['skipped'] += missed
+                twake = tall = tall + missed
+
+            snapshot = self.snapshot_books(symbol_shappers)
+            frames = await asyncio.gather(*[
+                loop.run_in_executor(executor, self.build_frame, symbol_shappers[symbol], *snapshot[symbol], twake)
+                for symbol in symbol_shappers])
+            oneSec = dict(zip(symbol_shappers, frames))
+
+            lag = time.time() - twake
+            self.tick_stats['ticks'] += 1
+            self.tick_stats['lag_max'] = max(self.tick_stats['lag_max'], lag)
+            if self.print_level >= 3:
+                print(f"tick {twake}: lag {lag:.3f}s, {dict(self.tick_stats)}")
             yield oneSec
             tall += 1
 
 
+def write_json(filename, content):
+    """encodes and writes in one call, to run in an executor"""
+    with open(filename, 'w') as fp:
+        fp.write(json.dumps(content))
+
+
+class SymbolWriter:
+    """
+    The buffers and files of one symbol of a `Writer`. The buffers are only touched from the event loop,
+    and swapped for empty ones when flushed, so that recording goes on while the files are encoded and written.
+    """
+    def __init__(self, symbol, folder, feed):
+        self.symbol = symbol
+        self.folder = folder
+        self.updates = []
+        self.trades = []
+        self.chain = snapshots.SnapshotChain(feed)
+        self.stats = collections.Counter()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def swap(self):
+        updates, self.updates = self.updates, []
+        trades, self.trades = self.trades, []
+        return updates, trades
+
+    async def flush(self, upds):
+        """writes the updates and trades received since the last flush in the files of period `upds`"""
+        loop = asyncio.get_event_loop()
+        updates, trades = self.swap()
+        await asyncio.gather(
+            loop.run_in_executor(None, write_json, f"{self.folder}/{upds}_update.json", updates),
+            loop.run_in_executor(None, write_json, f"{self.folder}/{upds}_trades.json", trades))
+        self.chain.pending = updates
+
+    def snapshot_content(self, res, full=False):
+        """the REST snapshot `res`, or its delta on the book rebuilt from the previous snapshot and the updates since"""
+        content = self.chain.encode(res, self.updates, full)
+        if content is res:
+            self.stats['full'] += 1
+        else:
+            num_levels = len(content['bids']) + len(content['asks'])
+            self.stats['delta' if num_levels else 'match'] += 1
+            self.stats['delta_levels'] += num_levels
+        return content
+
+    async def save_snapshot(self, snap, res, full=False):
+        content = self.snapshot_content(res, full)
+        await asyncio.get_event_loop().run_in_executor(None, write_json, f"{self.folder}/{snap}_snapshot.json", content)
+
+
 class Writer(Receiver):
-    async def setup(self, markets, data_folder, print_level=2):
-        self.store = collections.defaultdict(list)
-        self.tradestore = collections.defaultdict(list)
+    """
+    Records the depth updates and trades of `markets` in hourly files, with a snapshot at the start of each hour.
+    Each symbol has its own `SymbolWriter`, and they are flushed concurrently, the files being encoded and written
+    in the default thread pool.
+    With `delta_snapshots`, the snapshots are checked against the book rebuilt from the previous one and the
+    recorded updates, and stored as a `snapshots.delta` (a checksum when they match), except the first one
+    of each day and after a reconnection, which are stored in full.
+    """
+    async def setup(self, markets, data_folder, print_level=2, transport=None, delta_snapshots=True):
+        self.delta_snapshots = delta_snapshots
+        self.snapshot_day = None
         self.L2folder = f"{data_folder}/L2"
-        self.lock = threading.Lock()
-        self.tradelock = threading.Lock()
-
-        for symbol in markets:
-            os.makedirs(f"{self.L2folder}/{symbol}", exist_ok=True)
+        feed = self.feed_of(transport)
+        self.writers = {symbol: SymbolWriter(symbol, f"{self.L2folder}/{symbol}", feed) for symbol in markets}
 
-        await super().setup(markets, print_level=print_level)
+        await super().setup(markets, print_level=print_level, transport=transport)
 
     async def on_depth_msg(self, msg):
         await super().on_depth_msg(msg)
-        symbol = msg['s']
-        with self.lock:
-            self.store[symbol].append(msg)
+        self.writers[self.feed.symbol(msg)].updates.append(msg)
 
     async def on_depth(self, depth_cache):
         await super().on_depth(depth_cache)
         symbol = depth_cache.symbol
-        with self.tradelock:
-            if symbol not in self.depth_managers:
-                return
-            self.tradestore[symbol] += self.depth_managers[symbol].trades
+        if symbol not in self.depth_managers:
+            return
+        self.writers[symbol].trades += self.depth_managers[symbol].trades
 
     async def save_updates_since(self, prev_ts=None):
         prev_ts = prev_ts or self.prev_th
-        progressbar = self.markets
         upds = datetime.datetime.utcfromtimestamp(prev_ts).isoformat().replace(":", "-")  # .replace('-',"_")
-        for symbol in progressbar:
-            with self.lock:
-                tosave = copy.deepcopy(self.store[symbol])
-                self.store[symbol] = list()
-                self.nummsg[symbol] = 0
-            with self.tradelock:
-                tradetosave = copy.deepcopy(self.tradestore[symbol])
-                self.tradestore[symbol] = list()
-
-            async with aiofiles.open(f"{self.L2folder}/{symbol}/{upds}_update.json", "w") as fp:
-                await fp.write(json.dumps(tosave))
-            async with aiofiles.open(f"{self.L2folder}/{symbol}/{upds}_trades.json", "w") as fp:
-                await fp.write(json.dumps(tradetosave))
+        for symbol in self.markets:
+            self.nummsg[symbol] = 0
+        await asyncio.gather(*[self.writers[symbol].flush(upds) for symbol in self.markets])
         print(f"\nsaved_updates since {upds}")
 
     async def save_snapshot(self, cur_ts, max_levels=1000):
@@ -302,10 +505,12 @@ class Writer(Receiver):
         if cur_ts:
             L2s_coro = [self.client.get_order_book(symbol=pair, limit=max_levels) for pair in self.markets]
             L2s = await asyncio.gather(*L2s_coro)
-            for symbol, L2 in zip(self.markets, L2s):
-                async with aiofiles.open(f"{self.L2folder}/{symbol}/{snap}_snapshot.json", "w") as fp:
-                    await fp.write(json.dumps(L2))
-        print("\nsaved_snapshot")
+            day = cur_ts // 86400
+            full = not self.delta_snapshots or day != self.snapshot_day
+            self.snapshot_day = day
+            await asyncio.gather(*[self.writers[symbol].save_snapshot(snap, L2, full)
+                                   for symbol, L2 in zip(self.markets, L2s)])
+        print("\nsaved_snapshot", {symbol: dict(writer.stats) for symbol, writer in self.writers.items()})
 
     async def run_writer(self, save_period_minutes=60):
         save_period_seconds = save_period_minutes * 60
@@ -335,6 +540,9 @@ class Writer(Receiver):
             await self.save_updates_since()
         except ConnectionClosedError as e:
             print("restarting recorder")
+            # the updates missed in between are not in the files
+            for writer in self.writers.values():
+                writer.chain = snapshots.SnapshotChain(self.feed)
             await asyncio.sleep(5)
             await self.stoprestart()
         except Exception as e:
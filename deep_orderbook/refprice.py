@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def alpha_of(alpha=None, halflife=None):
+    """the weight of the new value in the EMA, given directly or by its half-life in updates"""
+    if halflife is not None:
+        return 1 - 0.5 ** (1 / halflife)
+    return alpha
+
+
+def microprice(bid_price, bid_size, ask_price, ask_size):
+    """the mid weighted by the size on the other side, rounded to 8 decimals, of scalars or arrays"""
+    price = (bid_price * ask_size + ask_price * bid_size) / (bid_size + ask_size)
+    return np.round(price, 8)
+
+
+def ema(values, alpha, init=None, block=64):
+    """
+    y[t] = alpha * values[t] + (1 - alpha) * y[t-1], starting from y[-1] = `init` (values[0] when None).
+    Computed in closed form over blocks of at most `block` rows, relative to the value before the block
+    to keep the precision: y[t] - y0 = sum_k alpha * (1 - alpha)^(t-k) * (values[k] - y0).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if not len(values) or alpha >= 1:
+        out[:] = values
+        return out
+    prev = values[0] if init is None else init
+    # the decay over a block stays above 1e-3, not to lose the precision of the older values
+    block = int(min(block, max(1, np.log(1e-3) / np.log(1 - alpha))))
+    decay = (1 - alpha) ** np.arange(block)
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block] - prev
+        n = len(chunk)
+        out[start:start + n] = prev + alpha * decay[:n] * np.cumsum(chunk / decay[:n])
+        prev = out[start + n - 1]
+    return out
+
+
+class RefPrice:
+    """
+    The reference price of a book: its microprice and the EMA of it, updated one top of book at a time
+    with `step` (live frames), or over a batch of them in one pass with `batch` (replays).
+    """
+    def __init__(self, alpha=1/32, halflife=None):
+        self.alpha = alpha_of(alpha, halflife)
+        self.ema = None
+
+    def step(self, bid_price, bid_size, ask_price, ask_size):
+        px = float(microprice(bid_price, bid_size, ask_price, ask_size))
+        self.ema = px * self.alpha + (self.ema if self.ema is not None else px) * (1 - self.alpha)
+        return px, self.ema
+
+    def batch(self, tops):
+        """the microprices and EMAs of the [N, 4] (bid price, bid size, ask price, ask size) rows"""
+        tops = np.asarray(tops, dtype=np.float64)
+        px = microprice(*tops.T)
+        emas = ema(px, self.alpha, init=self.ema)
+        if len(emas):
+            self.ema = float(emas[-1])
+        return px, emas
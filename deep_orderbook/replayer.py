@@ -6,20 +6,33 @@ import pandas as pd
 import numpy as np
 import asyncio
 import itertools
+import collections
+import heapq
+import concurrent.futures
 import aiofiles
 import aioitertools
 from tqdm.auto import tqdm
 import zipfile
 
 from deep_orderbook.shapper import BookShapper
+from deep_orderbook.framecache import FrameCache
+from deep_orderbook.catalog import Catalog
+from deep_orderbook import storage
+from deep_orderbook.feeds import Snapshot
+from deep_orderbook.snapshots import SnapshotChain, is_delta
 
 MARKETS = ["ETHBTC", "BTCUSDT", "ETHUSDT", "BNBBTC", "BNBETH", "BNBUSDT"]
 
 
 class Replayer:
-    def __init__(self, data_folder, date_regexp=''):
+    RAW_KINDS = ['snapshot', 'trades', 'update']
+
+    def __init__(self, data_folder, date_regexp='', prefetch=2, prefetch_processes=False, catalog=None):
         self.data_folder = data_folder
         self.date_regexp = date_regexp
+        self.catalog = Catalog(data_folder) if catalog is True else catalog
+        self.prefetch = prefetch
+        self.prefetch_processes = prefetch_processes
         self.dates = self.zipped_dates()
         if self.dates:
             print(f"using zipped file generator.")
@@ -35,6 +48,9 @@ class Replayer:
             print(f"the data folder doen't seem to contain any raw or zipped files: {self.data_folder}")
 
     def raw_files(self):
+        if self.catalog:
+            yield from self.catalog.files(self.RAW_KINDS, pattern=self.date_regexp)
+            return
         zs = sorted(glob.glob(f'{self.data_folder}/*/{self.date_regexp}*.json'))
         yield from zs
 
@@ -43,6 +59,9 @@ class Replayer:
         return [d[0] for d in dates]
 
     def zipped(self):
+        if self.catalog:
+            yield from self.catalog.files('zip', pattern=self.date_regexp)
+            return
         zs = sorted(glob.glob(f'{self.data_folder}/{self.date_regexp}*.zip'))
         yield from zs
 
@@ -55,32 +74,113 @@ class Replayer:
         return json.load(open_fc(filename))
 
     def snapshots(self, pair):
+        if self.catalog:
+            return self.catalog.files('snapshot', symbol=pair, pattern=self.date_regexp)
         return sorted(glob.glob(f'{self.data_folder}/{pair}/{self.date_regexp}*snapshot.json'))
 
     def updates_files(self, pair):
+        if self.catalog:
+            return self.catalog.files('update', symbol=pair, pattern=self.date_regexp)
         Bs = sorted(glob.glob(f'{self.data_folder}/{pair}/{self.date_regexp}*update.json'))
         return Bs
 
     def trades_file(self, pair):
+        if self.catalog:
+            return self.catalog.files('trades', symbol=pair, pattern=self.date_regexp)
         Ts = sorted(glob.glob(f'{self.data_folder}/{pair}/{self.date_regexp}*trades.json'))
         return Ts
 
     def book_updates_and_trades(self, pair):
         Bs = self.updates_files(pair)
-        Ts = self.trades_file(pair) 
+        Ts = set(self.trades_file(pair))
         return [(b, b.replace('update', 'trades')) for b in Bs if b.replace('update', 'trades') in Ts]
 
-    async def book_updates_trades_and_snapshots_raw(self, pair, file_generator=None, open_fc=None):
-        file_generator = file_generator or self.raw_files()
-        open_fc = open_fc or open
+    @staticmethod
+    def pair_groups(pair, file_generator):
         fns_pair = filter(lambda fn: pair in fn, file_generator)
         fns_pair_time = itertools.groupby(fns_pair, lambda fn: fn.split('/')[-1][:19])
-        for js_group in tqdm(fns_pair_time, leave=False):
-            ts, gr = js_group
+        for ts, gr in fns_pair_time:
             files = list(gr)
             if len(files) == 3:
-                snapshot_file, trades_file, updates_file = [json.load(open_fc(fn)) for fn in files]
-                yield updates_file, trades_file, snapshot_file
+                yield files
+
+    def file_groups(self, pair):
+        """yields the (snapshot, trades, update) file names of each recorded hour, with the zip they are in, if any"""
+        if self.file_generator == self.book_updates_trades_and_snapshots_zip:
+            for z in self.zipped():
+                with zipfile.ZipFile(z) as myzip:
+                    fns = sorted(myzip.namelist())
+                for files in self.pair_groups(pair, fns):
+                    yield files, z
+        else:
+            for files in self.pair_groups(pair, self.raw_files()):
+                yield files, None
+
+    def rebuilt_chain(self, pair, files, feed=None):
+        """the `SnapshotChain` of `pair` having read the groups before `files`, from the last full snapshot"""
+        groups = list(self.file_groups(pair))
+        return self.chain_of(groups, [fns for fns, zip_path in groups].index(files), feed)
+
+    @staticmethod
+    def chain_of(groups, stop, feed=None):
+        """the `SnapshotChain` having read the (files, zip_path) `groups` before `stop`, from the last full snapshot"""
+        start = stop
+        while start > 0 and is_delta(Replayer.load_file(groups[start - 1][0][0], groups[start - 1][1])):
+            start -= 1
+        chain = SnapshotChain(feed)
+        for fns, zip_path in groups[max(start - 1, 0):stop]:
+            js_updates, list_trades, snapshot = Replayer.load_group(fns, zip_path)
+            chain.group(snapshot, js_updates)
+        return chain
+
+    @staticmethod
+    def load_file(filename, zip_path=None):
+        if zip_path:
+            with zipfile.ZipFile(zip_path) as myzip:
+                return json.load(myzip.open(filename))
+        return json.load(open(filename))
+
+    @staticmethod
+    def load_group(files, zip_path=None):
+        if zip_path:
+            with zipfile.ZipFile(zip_path) as myzip:
+                snapshot_file, trades_file, updates_file = [json.load(myzip.open(fn)) for fn in files]
+        else:
+            snapshot_file, trades_file, updates_file = [json.load(open(fn)) for fn in files]
+        return updates_file, trades_file, snapshot_file
+
+    async def prefetched_groups(self, pair):
+        """
+        reads and decodes the next `prefetch` file groups in the background while the current one is replayed,
+        so that up to `prefetch` + 1 decoded groups are held.
+        In threads (the default), `json.load` holds the GIL, so only the latency of the reads is hidden,
+        on a network or slow disk; with `prefetch_processes` the decoding overlaps the replay as well,
+        at the cost of pickling the decoded groups back from the workers.
+        """
+        loop = asyncio.get_event_loop()
+        if self.prefetch_processes:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.prefetch)
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch)
+        pending = collections.deque()
+        try:
+            for files, zip_path in tqdm(self.file_groups(pair), leave=False):
+                pending.append(loop.run_in_executor(pool, self.load_group, files, zip_path))
+                if len(pending) > self.prefetch:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for fut in pending:
+                fut.cancel()
+            pool.shutdown(wait=False)
+
+    async def book_updates_trades_and_snapshots_raw(self, pair, file_generator=None, open_fc=None):
+        file_generator = file_generator or self.raw_files()
+        open_fc = open_fc or open
+        for files in tqdm(self.pair_groups(pair, file_generator), leave=False):
+            snapshot_file, trades_file, updates_file = [json.load(open_fc(fn)) for fn in files]
+            yield updates_file, trades_file, snapshot_file
 
     async def book_updates_trades_and_snapshots_zip(self, pair):
         zs_gen = self.zipped()
@@ -92,10 +192,15 @@ class Replayer:
                     yield fff
 
     def training_files(self, pair, side_bips, side_width):
-        BTs = sorted(glob.glob(f'{self.data_folder}/sidepix{side_width:03}/{self.date_regexp}*{pair}*ps.npy'))
-        for fn_ps in BTs:
-            fn_bs = fn_ps.replace('ps.npy', 'bs.npy')
-            fn_ts = fn_ps.replace('ps.npy', f'time2level-bip{side_bips:02}.npy')
+        if self.catalog:
+            BTs = self.catalog.files('ps', symbol=pair, pattern=self.date_regexp, width=side_width)
+        else:
+            BTs = sorted(glob.glob(f'{self.data_folder}/sidepix{side_width:03}/{self.date_regexp}*{pair}*ps.np[yc]'))
+        # a day may be there both raw and compressed, the compressed files are used then
+        for stem in sorted({fn_ps[:-len('ps.npy')] for fn_ps in BTs}):
+            fn_bs = storage.existing(f'{stem}bs.npy')
+            fn_ps = storage.existing(f'{stem}ps.npy')
+            fn_ts = storage.existing(f'{stem}time2level-bip{side_bips:02}.npy')
             yield (fn_bs, fn_ps, fn_ts)
 
     def training_samples(self, pair):
@@ -125,57 +230,127 @@ class Replayer:
 
     async def replayL2_async(self, pair, shapper):
         yield pair
-        file_updates_tqdm = self.file_generator(pair)
+        if self.prefetch:
+            file_updates_tqdm = self.prefetched_groups(pair)
+        else:
+            file_updates_tqdm = self.file_generator(pair)
+        chain = SnapshotChain(shapper.feed)
         async for js_updates, list_trades, snapshot in file_updates_tqdm:
             #file_updates_tqdm.set_description(fupdate.replace(self.data_folder, ''))
-            await shapper.on_trades_bunch(list_trades)
-            js_updates_tqdm = tqdm(js_updates, leave=False)
+            snapshot = chain.group(snapshot, js_updates)
+            async for oneSec in self.replay_group_async(shapper, js_updates, list_trades, snapshot):
+                yield oneSec
+
+    async def replay_seconds_async(self, pair, cache=None, **shapper_args):
+        """
+        the replay of `pair` as `multireplayL2_async` reads it, the first frame and the last frame of each second,
+        from the frame cache `cache` when given, with the levels it keeps. The shapper is made with `shapper_args`
+        and not handed out, as it only holds the prices of the last frame after a replay served from the cache.
+        """
+        shapper = await BookShapper.create(**shapper_args)
+        yield pair
+        if cache is not None:
+            frames = cache.replay_async(self, pair, shapper)
+        else:
+            frames = self.replayL2_async(pair, shapper)
+            await frames.__anext__()
+        async for oneSec in self.last_of_seconds(frames):
+            yield oneSec
+
+    @staticmethod
+    async def last_of_seconds(frames):
+        """the first frame of `frames`, then the last frame of each second"""
+        started, pending = False, None
+        async for oneSec in frames:
+            if not started:
+                started = True
+                yield oneSec
+                continue
+            if pending is not None and pending['time'] != oneSec['time']:
+                yield pending
+            pending = oneSec
+        if pending is not None:
+            yield pending
+
+    @staticmethod
+    async def replay_group_async(shapper, js_updates, list_trades, snapshot, batch=256):
+        """
+        replays one recorded group, the messages being normalized by the `feeds` adapter of the shapper.
+        `snapshot` is the recorded one or, when it is a delta, the `feeds.Snapshot` expanded by a `SnapshotChain`.
+        The frames are priced `batch` at a time, with `BookShapper.priced_frames`.
+        """
+        feed = shapper.feed
+        await shapper.on_trades_bunch(list_trades)
+        js_updates_tqdm = tqdm(js_updates, leave=False)
 
-            lastUpdateId = snapshot['lastUpdateId']
-            await shapper.on_snaphsot_async(snapshot)
+        if not isinstance(snapshot, Snapshot):
+            snapshot = feed.snapshot(snapshot)
+        await shapper.on_snaphsot_async(snapshot)
 
-            for book_upd in js_updates_tqdm:
-                if book_upd['e'] != 'depthUpdate':
-                    print("not update:", book_upd['e'])
-                    continue
-                firstID = book_upd['U']
-                finalID = book_upd['u']
-                if finalID < lastUpdateId:
-                    continue
-                eventTime = book_upd['E']
-                ts = 1 + eventTime // 1000
+        frames = []
+        tops = np.empty((batch, 4))
+        for book_upd in js_updates_tqdm:
+            event = feed.depth(book_upd)
+            if event is None:
+                print("not update:", book_upd)
+                continue
+            if event.last_id < snapshot.last_id:
+                continue
 
-                px = await shapper.on_depth_msg_async(book_upd)
+            (bbp, bbs), (bap, bas) = await shapper.apply_event_async(event)
 
-                t_avail = shapper.secondAvail(book_upd)
-                oneSec = await shapper.make_frames_async(t_avail)
-                BBO = oneSec['bids'].index[0], oneSec['asks'].index[0]
+            t_avail = event.second
+            shapper.ts = t_avail
+            oneSec = await shapper.make_frames_async(t_avail)
+            tops[len(frames)] = bbp, bbs, bap, bas
+            frames.append(oneSec)
 
-                js_updates_tqdm.set_description(f"ts={datetime.datetime.utcfromtimestamp(ts)}, tr={len(oneSec['trades']):02}, BBO:{BBO}")#", px={px:16.12f}")
+            js_updates_tqdm.set_description(f"ts={datetime.datetime.utcfromtimestamp(t_avail)}, tr={len(oneSec['trades']):02}, BBO:{(bbp, bap)}")
 
-                yield oneSec
+            if len(frames) == batch:
+                for oneSec in shapper.priced_frames(frames, tops):
+                    yield oneSec
+                frames = []
+        for oneSec in shapper.priced_frames(frames, tops[:len(frames)]):
+            yield oneSec
 
     @staticmethod
-    async def multireplayL2_async(replayers):
+    async def multireplayL2_async(replayers, every_second=True, max_gap=60):
+        """
+        merges the replays of several pairs into a {pair: frame} of the last frame of each pair before each second.
+        This is a k-way merge on the time of the next frame of each pair, so a second only costs the pairs that changed.
+        Every second is yielded, except that gaps of more than `max_gap` seconds without any update are jumped over;
+        with `every_second=False`, only the seconds where at least one pair changed are.
+        The same dict is yielded each time, updated in place.
+        """
         pairs = [await replayer.__anext__() for replayer in replayers]
-        gens = {pairs[i]: replayers[i] for i in range(len(pairs))}
+        gens = dict(zip(pairs, replayers))
         nexs = {pair: await gens[pair].__anext__() for pair in pairs}
-        def next_sec(pair): return nexs[pair]['time']
-        tall = max([next_sec(p) for p in pairs])
-        curs = {pair: nexs[pair] for pair in pairs}
+        curs = dict(nexs)
+        heap = [(nexs[pair]['time'], n, pair) for n, pair in enumerate(pairs)]
+        heapq.heapify(heap)
+        tall = max(t for t, _, _ in heap)
         print('tall', tall)
+        changed = True
         while True:
-            for pair in pairs:
-                while next_sec(pair) < tall:
+            while heap[0][0] < tall:
+                _, n, pair = heap[0]
+                while nexs[pair]['time'] < tall:
+                    changed |= curs[pair] is not nexs[pair]
                     curs[pair] = nexs[pair]
                     try:
                         nexs[pair] = await gens[pair].__anext__()
                     except StopAsyncIteration:
-                        return # break
-            yield curs
-            next_overall_sec = min([next_sec(pair) for pair in pairs])
+                        return
+                heapq.heapreplace(heap, (nexs[pair]['time'], n, pair))
+            if every_second or changed:
+                yield curs
+            changed = False
+            next_overall_sec = heap[0][0]
             jump = next_overall_sec - tall
-            if jump > 60:
+            if not every_second:
+                tall = max(tall + 1, next_overall_sec + 1)
+            elif jump > max_gap:
                 print(f"\njumping {datetime.timedelta(seconds=jump)} seconds to have an update from one of the symbols")
                 tall += jump
             else:
@@ -196,7 +371,8 @@ async def main():
         pass
         break
 
-    replayers = [file_replayer.replayL2_async(pair, await BookShapper.create()) for pair in markets]
+    cache = FrameCache('../crypto-trading/data/cache')
+    replayers = [file_replayer.replay_seconds_async(pair, cache=cache) for pair in markets]
     multi_replay = file_replayer.multireplayL2_async(replayers)
     async for d in multi_replay:
         pass
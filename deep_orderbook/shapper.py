@@ -9,6 +9,12 @@ import aiofiles
 
 from tqdm.auto import tqdm
 from deep_orderbook.recorder import MessageDepthCacheManager
+from deep_orderbook.accumulator import ArrayAccumulator
+from deep_orderbook.orderflow import OrderFlow
+from deep_orderbook.tradebuckets import TradeBuckets
+from deep_orderbook.feeds import BinanceFeed, Snapshot
+from deep_orderbook.refprice import RefPrice
+from deep_orderbook import labels
 import aioitertools
 
 pd.set_option('precision', 12)
@@ -17,58 +23,107 @@ import matplotlib.pyplot as plt
 
 class BookShapper:
     PriceShape = [2,3]
+    # the outermost level of `gen_array_async`, relative to its zoom
+    MAX_SPACING = 3 * np.arcsin(1.0) - 2
+    # the levels of `gen_array_async` are around the previous EMA, up to that much further from the price
+    REF_MARGIN = 1.5
 
     @classmethod
-    async def create(cls):
+    async def create(cls, order_flow=False, feed=None, ema_alpha=1/32, ema_halflife=None):
         self = cls()
-        self._depth_manager = await MessageDepthCacheManager.create(client=None, loop=None, symbol=None, refresh_interval=None)
-        self.sec_trades = dict()
+        self.feed = feed or BinanceFeed()
+        self._depth_manager = await MessageDepthCacheManager.create(client=None, loop=None, symbol=None, refresh_interval=None, feed=self.feed)
+        self.flow = OrderFlow() if order_flow else None
+        self._depth_manager.get_depth_cache().flow = self.flow
+        self.sec_trades = TradeBuckets()
         self.bids = None
         self.asks = None
         self.tpr = None
         self.ts = None
         self.px = None
 #        self.prev_px = None
-        self.emaPrice = None
-        self.emaNew = 1/32
+        self.ref = RefPrice(alpha=ema_alpha, halflife=ema_halflife)
+        self.emaNew = self.ref.alpha
         self.emptyframe = pd.DataFrame(columns=['p', 'q', 'delay', 'num', 'up']).set_index(['p'])
         return self
 
     async def on_snaphsot_async(self, snapshot):
+        """resets the book to a `feeds.Snapshot`"""
         await self._depth_manager._init_cache(snapshot)
 
+    def get_state(self):
+        """the book, reference price and pending trades, for `checkpoint`, restored with `set_state_async`"""
+        book = None
+        if self._depth_manager._last_update_id is not None:
+            depth_cache = self._depth_manager.get_depth_cache()
+            book = Snapshot(self._depth_manager._last_update_id, depth_cache.get_bids(), depth_cache.get_asks())
+        return {'book': book, 'ts': self.ts, 'px': self.px, 'ema': self.ref.ema, 'alpha': self.ref.alpha,
+                'trades': self.sec_trades.get_state()}
+
+    async def set_state_async(self, state):
+        if state['book'] is not None:
+            await self.on_snaphsot_async(state['book'])
+        self.ts, self.px = state['ts'], state['px']
+        # the EMA of another weight is still the best start
+        self.ref.ema = state['ema']
+        self.sec_trades.set_state(state['trades'])
+
+    @property
+    def emaPrice(self):
+        return self.ref.ema
+
+    @emaPrice.setter
+    def emaPrice(self, value):
+        self.ref.ema = value
+
+    async def apply_event_async(self, event):
+        """applies a `feeds.DepthEvent` to the book, returns its best levels"""
+        if self.flow is not None:
+            self.flow.at(event.second)
+        await self._depth_manager.on_event(event)
+        return self._depth_manager.get_depth_cache().best()
+
+    async def on_depth_event_async(self, event):
+        best_bid, best_ask = await self.apply_event_async(event)
+        await self.update_ema([best_bid], [best_ask], event.second)
+
     async def on_depth_msg_async(self, msg):
-        await self._depth_manager._depth_event(msg)
-        bids, asks = self._depth_manager.get_depth_cache().get_bids_asks()
-        ts = self.secondAvail(msg)
-        await self.update_ema(bids, asks, ts)
+        await self.on_depth_event_async(self.feed.depth(msg))
 
     async def update_ema(self, bids, asks, ts):
+        return self.ema_step(bids, asks, ts)
+
+    def ema_step(self, bids, asks, ts):
         self.ts = ts
         bbp, bbs = bids[0]
         bap, bas = asks[0]
-        price = (bbp * bas + bap * bbs) / (bbs + bas)
-        self.px = round(price, 8)
-        self.emaPrice = self.px * self.emaNew + (self.emaPrice if self.emaPrice is not None else self.px) * (1-self.emaNew)
+        self.px, _ = self.ref.step(bbp, bbs, bap, bas)
         self.px += 1e-12
         return self.px
 
+    def priced_frames(self, frames, tops):
+        """
+        sets the price and EMA of frames made without them, from the [N, 4] best levels of their books,
+        in one `RefPrice.batch`
+        """
+        px, emas = self.ref.batch(tops)
+        px += 1e-12
+        for frame, p, e in zip(frames, px.tolist(), emas.tolist()):
+            frame['price'] = p
+            frame['emaPrice'] = e
+        if frames:
+            self.px = frames[-1]['price']
+        return frames
+
     @staticmethod
     def secondAvail(tr_dict):
         return 1 + tr_dict['E'] // 1000
 
     async def on_trades_bunch(self, list_trades, force_t_avail=None):
-        list_trades = [{k:float(v) for k,v in trs.items() if k not in 'Msea'} for trs in list_trades]
-        if not list_trades:
-            return
-        if force_t_avail:
-            self.sec_trades[force_t_avail] = self.trades2frame(list_trades).drop(['tavail'], axis=1)
-            return
-        alltrades = self.trades2frame(list_trades)
-        for i,l in alltrades.groupby('tavail'):
-            # print(f'{i}\n{l}')
-            self.sec_trades[i] = l.drop(['tavail'], axis=1)
-        return
+        self.add_trades(list_trades, force_t_avail=force_t_avail)
+
+    def add_trades(self, list_trades, force_t_avail=None):
+        self.sec_trades.add(self.feed.trades(list_trades), force_second=force_t_avail or None)
 
     @staticmethod
     def trades2frame(list_trades):
@@ -84,17 +139,24 @@ class BookShapper:
 #        self.prev_px = self.px
         return ts
 
-    async def make_frames_async(self, t_avail, bids=None, asks=None):
+    async def make_frames_async(self, t_avail, bids=None, asks=None, flow=None):
+        return self.make_frames(t_avail, bids=bids, asks=asks, flow=flow)
+
+    def make_frames(self, t_avail, bids=None, asks=None, flow=None):
         if bids is None or asks is None:
             bids, asks = self._depth_manager.get_depth_cache().get_bids_asks()
+        if flow is None and self.flow is not None:
+            flow = self.flow.levels
 
         oneSec = {'time': self.ts,
                   'price': self.px,
                   'bids': pd.DataFrame(bids, columns=['price', 'size']).set_index('price'),
                   'asks': pd.DataFrame(asks, columns=['price', 'size']).set_index('price'),
-                  'trades': self.sec_trades.pop(t_avail, self.emptyframe),
+                  'trades': self.sec_trades.pop(t_avail, default=self.emptyframe),
                  'emaPrice': self.emaPrice,
                  }
+        if flow is not None:
+            oneSec['flow'] = flow
         return oneSec
 
 
@@ -124,6 +186,82 @@ class BookShapper:
         reind_a = np.arcsinh(reind_a).astype(np.float32)
         return reind_b, reind_a, treind_b, treind_a
 
+    @staticmethod
+    def level_edges(ref_prices, zoom_frac=FRAC_LEVELS, spacing=SPACING):
+        """the ascending [S, 2W] price levels of `bin_books`, for each reference price"""
+        ref_prices = np.asarray(ref_prices, dtype=np.float64)[:, None]
+        b_idx = np.round(ref_prices * (1-spacing*zoom_frac), 7)
+        a_idx = np.round(ref_prices * (1+spacing*zoom_frac), 7)
+        return np.concatenate([b_idx[:, ::-1], a_idx], axis=1)
+
+    @staticmethod
+    def padded(arrays, channels=()):
+        """stacks arrays of different lengths into [S, L, *channels], padded with NaN"""
+        out = np.full((len(arrays), max(map(len, arrays), default=0)) + tuple(channels), np.nan)
+        for n, arr in enumerate(arrays):
+            out[n, :len(arr)] = arr
+        return out
+
+    @staticmethod
+    def cumulated_at(prices, sizes, edges, above):
+        """
+        total size at or above (or at or below) each of the `edges` [S, E], for the NaN-padded `prices` [S, L]
+        sorted from the top (or from the bottom) and their `sizes` [S, L, C]: [S, E, C]
+        """
+        cum = np.nancumsum(sizes, axis=1)
+        cum = np.concatenate([np.zeros((cum.shape[0], 1) + cum.shape[2:]), cum], axis=1)
+        at_or_above = (prices[:, None, :] >= edges[:, :, None]).sum(-1)
+        at_or_below = (prices[:, None, :] <= edges[:, :, None]).sum(-1)
+        if above:
+            # as in `bin_books`, where pandas takes an index of a single price as increasing when forward filling
+            valid = ~np.isnan(prices)
+            distinct = valid[:, :1].sum(-1) + (valid[:, 1:] & (prices[:, 1:] != prices[:, :-1])).sum(-1)
+            count = np.where(distinct[:, None] == 1, at_or_below, at_or_above)
+        else:
+            count = at_or_below
+        return np.take_along_axis(cum, count[:, :, None], axis=1)
+
+    @staticmethod
+    def bin_books_batch(frames, ref_prices, zoom_frac=FRAC_LEVELS, spacing=SPACING):
+        """
+        `bin_books` of several frames (the symbols of a second, or the seconds of a chunk) at once, as in `gen_array_async`:
+        a [S, 2W, 3] array of the book size (bids - asks), and the trade quantity and count (up - down) of each level
+        """
+        edges = BookShapper.level_edges(ref_prices, zoom_frac=zoom_frac, spacing=spacing)
+        bids = BookShapper.padded([f['bids'].index.values for f in frames])
+        asks = BookShapper.padded([f['asks'].index.values for f in frames])
+        vol_b = BookShapper.cumulated_at(bids, BookShapper.padded([f['bids'].values for f in frames], [1]), edges, above=True)
+        vol_a = BookShapper.cumulated_at(asks, BookShapper.padded([f['asks'].values for f in frames], [1]), edges, above=False)
+        tr_p = [f['trades'].index.values.astype(np.float64) for f in frames]
+        tr_qn = [f['trades'][['q', 'num']].values.astype(np.float64) for f in frames]
+        tr_up = [f['trades']['up'].values.astype(np.float64) for f in frames]
+        sells = [up <= 0 for up in tr_up]
+        buys = [up >= 0 for up in tr_up]
+        # sells are cumulated from the top, buys from the bottom
+        vol_tb = BookShapper.cumulated_at(BookShapper.padded([p[m][::-1] for p, m in zip(tr_p, sells)]),
+                                          BookShapper.padded([qn[m][::-1] for qn, m in zip(tr_qn, sells)], [2]),
+                                          edges, above=True)
+        vol_ta = BookShapper.cumulated_at(BookShapper.padded([p[m] for p, m in zip(tr_p, buys)]),
+                                          BookShapper.padded([qn[m] for qn, m in zip(tr_qn, buys)], [2]),
+                                          edges, above=False)
+        def levels_down(vol):
+            return np.arcsinh(np.concatenate([vol[:, :-1] - vol[:, 1:], np.zeros_like(vol[:, :1])], axis=1)).astype(np.float32)
+        def levels_up(vol):
+            return np.arcsinh(np.concatenate([np.zeros_like(vol[:, :1]), vol[:, 1:] - vol[:, :-1]], axis=1)).astype(np.float32)
+        books = levels_down(vol_b) - levels_up(vol_a)
+        trades = levels_up(vol_ta) - levels_down(vol_tb)
+        return np.concatenate([books, trades], axis=-1)
+
+    @staticmethod
+    def price_rows(frames):
+        """the [S, 2, 3] `ps` rows of the frames: [[lowtrade, bid, ask], [day, secofday, hightrade]]"""
+        rows = np.empty((len(frames), 2, 3), dtype=np.float64)
+        for n, sec in enumerate(frames):
+            tr = sec['trades'].index
+            rows[n] = [[tr.min(), sec['bids'].index[0], sec['asks'].index[0]],
+                       [sec['time'] // (3600 * 24), sec['time'] % (3600 * 24), tr.max()]]
+        return rows.astype(np.float32)
+
 
 
     def sampleArrays(self, replayer, numpoints=None, apply_fnct=None):
@@ -178,115 +316,54 @@ class BookShapper:
         plt.show()
 
     @staticmethod
-    async def gen_array_async(market_replay, markets, width_per_side=64, zoom_frac=1/256):
-        #market_replay = self.multireplayL2(markets)
-        prev_price = {p: None for p in markets}
+    def level_spacing(width_per_side):
+        """the distances of the levels of a side to the reference price, relative to the zoom, up to `MAX_SPACING`"""
         spacing = np.arange(width_per_side)
         #spacing = np.square(spacing) + spacing
         spacing = spacing / spacing[-1]
-        spacing = np.arcsin(spacing)*3 - spacing*2
+        return np.arcsin(spacing)*3 - spacing*2
+
+    @staticmethod
+    async def gen_array_async(market_replay, markets, width_per_side=64, zoom_frac=1/256, order_flow=False):
+        """
+        yields the binned arrays of each second of `market_replay`.
+        With `order_flow`, the `OrderFlow.CHANNELS` of the frames are appended to the book and trade channels.
+        """
+        #market_replay = self.multireplayL2(markets)
+        prev_price = {p: None for p in markets}
+        prev_frame = {p: None for p in markets}
+        spacing = BookShapper.level_spacing(width_per_side)
         async for second in market_replay:
-            market_second = {}#collections.defaultdict(list)
-            for pair in markets:
-                sec = second[pair]
-                prev_price[pair] = prev_price[pair] or sec['price']
-                bib,aib,trb,tra  = BookShapper.bin_books(sec['bids'],sec['asks'],sec['trades'], ref_price=prev_price[pair], zoom_frac=zoom_frac, spacing=spacing)
+            frames = [second[pair] for pair in markets]
+            refs = [prev_price[pair] or sec['price'] for pair, sec in zip(markets, frames)]
+            books = BookShapper.bin_books_batch(frames, refs, zoom_frac=zoom_frac, spacing=spacing)
+            if order_flow:
+                # a market without any update in the second repeats its previous frame, but had no flow
+                flows = [sec.get('flow') if sec is not prev_frame[pair] else None for pair, sec in zip(markets, frames)]
+                edges = BookShapper.level_edges(refs, zoom_frac=zoom_frac, spacing=spacing)
+                books = np.concatenate([books, OrderFlow.binned(flows, edges)], axis=-1)
+            prices = BookShapper.price_rows(frames)
+            for pair, sec in zip(markets, frames):
                 prev_price[pair] = sec['emaPrice']
-                arr0 = bib.values - aib.values
-                arr1 = tra.values - trb.values
-                utc = datetime.datetime.utcfromtimestamp(sec['time'])
-                d = sec['time'] // (3600 * 24) # int(utc.strftime('%y%m%d'))
-                t = sec['time'] % (3600 * 24)  #float(utc.strftime('%H%M%S.%f'))
-                lowtrade = sec['trades'].index.min()
-                hightrade = sec['trades'].index.max()
-                #print(lowtrade, hightrade)
-                tp = np.array([[lowtrade, sec['bids'].index[0], sec['asks'].index[0]], [d, t, hightrade]], dtype=np.float32)
-                # print('tp', tp)
-                arr3d = np.concatenate([arr0, arr1[:,::2]], axis=-1)
-                market_second[pair] = {'ps': [tp], 'bs': [arr3d]}
-            yield market_second
+                prev_frame[pair] = sec
+            yield {pair: {'ps': [prices[n]], 'bs': [books[n]]} for n, pair in enumerate(markets)}
 
 
     @staticmethod
     def build_time_level_trade(books, prices, side_bips=32, side_width=64):
-        mult =  0.0001 * side_bips / side_width
-        FUTURE = 120#0*10
-        time2levels = np.zeros_like(books[:, :2*side_width, :1]) + FUTURE
-        #########################################################
-                                    #######
-        for i in tqdm(range(prices.shape[0])):
-                                    #######
-        #########################################################
-            timeupdn = []
-            pricestep = prices[0, 0, 1] * mult
-            for j in range(side_width):
-                thresh = j * pricestep
-                [_, b, a], [d, t, _] = prices[i]
-                bids = prices[i:i+FUTURE, 0, 1]
-                asks = prices[i:i+FUTURE, 0, 2]
-                waitUp = bids < a + thresh
-                waitDn = asks > b - thresh
-                #### trades also define potential price hit
-                lowtrade = prices[i:i+FUTURE, 0, 0]
-                hightrade = prices[i:i+FUTURE, 1, 2] 
-                tradeUp = hightrade >= a + thresh
-                tradeDn = lowtrade <= b - thresh
-                # cannot trade with bid/ask of elapsed second
-                tradeUp[0] = False
-                tradeDn[0] = False
-                # first one to NOT wait defines the price hit
-                waitUp &= ~tradeUp
-                waitDn &= ~tradeDn
-                ###########################################
-                timeUp = np.argmin(waitUp) or FUTURE*10
-                timeDn = np.argmin(waitDn) or FUTURE*10
-                timeupdn.insert(0, [timeDn])
-                timeupdn.append([timeUp])
-            time2levels[i] = timeupdn
+        pricestep = labels.pricestep_of(prices, side_bips=side_bips, side_width=side_width)
+        time2levels = labels.time2level_rows(prices, pricestep, side_width=side_width)
         # print('time2levels minmaxmean', time2levels.min(), time2levels.max(), time2levels.mean(), 'pricestep', pricestep)
         assert time2levels.min() > 0
-        return time2levels.astype(np.float32)
-
+        return time2levels
 
-    @staticmethod
-    def build(total, element, reduce_func, max_length=None, side_bips=None, side_width=None):
-        force_save = element is None
-        element = element or total
-        for market,second in element.items():
-            dt = total[market]['ps'][-1][1] # datetime.datetime.strptime(str(int(total[market]['ps'][-1][1,0])), '%y%m%d').date()
-            datetotal = datetime.datetime.utcfromtimestamp(int(dt[0]) * 3600 * 24 + int(dt[1])).date()
-            de = element[market]['ps'][-1][1] # dateeleme = datetime.datetime.strptime(str(int(element[market]['ps'][-1][1,0])), '%y%m%d').date()
-            # print(dt, dt[0] * 3600 * 24 + dt[1])
-            dateeleme = datetime.datetime.utcfromtimestamp(int(de[0]) * 3600 * 24 + int(de[1])).date()
-            newDay = datetotal < dateeleme
-            if not (newDay or force_save):
-                for name,arrs in second.items():
-                    total[market][name] += arrs
-            else:
-                arrday_bs = np.stack(total[market]['bs']).astype(np.float32)
-                arrday_ps = np.stack(total[market]['ps']).astype(np.float32)
-                np.save(f'data/sidepix{side_width:03}/{datetotal}-{market}-bs.npy', arrday_bs)
-                np.save(f'data/sidepix{side_width:03}/{datetotal}-{market}-ps.npy', arrday_ps)
-                if reduce_func is not None:
-                    t2l = reduce_func(
-                        books=np.stack(total[market]['bs']).astype(np.float32),
-                        prices=np.stack(total[market]['ps']).astype(np.float32),
-                    )
-                    np.save(f'data/sidepix{side_width:03}/{datetotal}-{market}-time2level-bip{side_bips:02}.npy', t2l)
-
-            if max_length:
-                for name,arrs in second.items():
-                    if len(total[market][name]) > max_length:
-                        total[market][name] = total[market][name][-max_length:]
-            if newDay:
-                for name,arrs in second.items():
-                    total[market][name] = arrs
-        return total
 
     @staticmethod
-    def accumulate_array(genarr, markets):
-        genacc = aioitertools.accumulate(genarr, BookShapper.build)
-        return genacc
+    def accumulate_array(genarr, markets, max_length=None, reduce_func=None, side_bips=None, side_width=None, data_folder='data', codecs=None):
+        accumulator = ArrayAccumulator(markets, max_length=max_length, reduce_func=reduce_func,
+                                       side_bips=side_bips, side_width=side_width,
+                                       data_folder=None if max_length else data_folder, codecs=codecs)
+        return accumulator.accumulate_async(genarr)
 
     @staticmethod
     async def images(accumulated_arrays, every=10, LENGTH=128):
@@ -296,7 +373,7 @@ class BookShapper:
             allim = []
             for symb, data in sec.items():
                 #prices_dts = np.stack(data['ps'][-LENGTH:])
-                books = np.stack(data['bs'][-LENGTH:])
+                books = np.array(data['bs'][-LENGTH:], dtype=np.float32)
                 im = books
                 im[:,:,0] /= 10
                 im += 0.5
@@ -306,6 +383,18 @@ class BookShapper:
             toshow = np.concatenate(allim, axis=0)
             yield toshow
 
+    @staticmethod
+    def image_column(market_second, markets):
+        """the one-second column of the image of `images`, for all markets stacked"""
+        allcol = []
+        for symb in markets:
+            col = np.array(market_second[symb]['bs'][-1], dtype=np.float32)
+            col[:,0] /= 10
+            col += 0.5
+            col = np.clip(col, 0, 1)
+            allcol.append(col[::-1])
+        return np.concatenate(allcol, axis=0)
+
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
@@ -0,0 +1,171 @@
+import json
+import zlib
+import collections
+
+from deep_orderbook.feeds import BinanceFeed, Snapshot
+
+
+def checksum(snapshot):
+    return zlib.crc32(json.dumps([snapshot.bids, snapshot.asks]).encode())
+
+
+def is_delta(raw):
+    """whether a recorded snapshot file holds a delta rather than the snapshot of the venue"""
+    return 'checksum' in raw
+
+
+def side_delta(reference, levels, inside):
+    changed = [(p, q) for p, q in levels if reference.get(p) != q]
+    within = dict(levels)
+    return changed + [(p, 0.0) for p in reference if inside(p) and p not in within]
+
+
+def side_within(bound, above):
+    if bound is None:
+        return lambda p: False
+    return (lambda p: p >= bound) if above else (lambda p: p <= bound)
+
+
+def delta(bids, asks, snapshot):
+    """
+    the levels of `snapshot` that differ from the reference book `bids`, `asks` ({price: size}),
+    size 0.0 for the levels to remove, within the depth of the snapshot
+    """
+    bid_floor = snapshot.bids[-1][0] if snapshot.bids else None
+    ask_ceiling = snapshot.asks[-1][0] if snapshot.asks else None
+    return {'lastUpdateId': snapshot.last_id,
+            'checksum': checksum(snapshot),
+            'bid_floor': bid_floor,
+            'ask_ceiling': ask_ceiling,
+            'bids': side_delta(bids, snapshot.bids, side_within(bid_floor, above=True)),
+            'asks': side_delta(asks, snapshot.asks, side_within(ask_ceiling, above=False)),
+            }
+
+
+def expand(bids, asks, raw):
+    """the `Snapshot` of a delta on the reference book `bids`, `asks`, checked against the recorded checksum"""
+    sides = []
+    for reference, bound, above, changes in [(bids, raw['bid_floor'], True, raw['bids']),
+                                             (asks, raw['ask_ceiling'], False, raw['asks'])]:
+        inside = side_within(bound, above)
+        levels = {p: q for p, q in reference.items() if inside(p)}
+        for p, q in changes:
+            if q == 0.0:
+                levels.pop(p, None)
+            else:
+                levels[p] = q
+        sides.append(sorted(levels.items(), reverse=above))
+    snapshot = Snapshot(raw['lastUpdateId'], *sides)
+    if checksum(snapshot) != raw['checksum']:
+        raise ValueError(f"the snapshot at update {raw['lastUpdateId']} does not match its checksum once expanded")
+    return snapshot
+
+
+class SnapshotChain:
+    """
+    The book of one symbol rebuilt from its recorded snapshots and depth updates, one hourly group after the other,
+    as the `Writer` records them and the replayer reads them.
+
+    A group's snapshot is stored as a delta on the book rebuilt from the previous snapshot, the previous
+    group's updates and the updates of the group up to the snapshot's update id. It is only the levels
+    that differ, often none, in which case the delta is just a checksum: each delta also checks the recorded
+    stream. The updates of a group are only applied when the next snapshot is a delta.
+    `gaps` counts the updates applied that do not follow the previous one, missed updates.
+    """
+    def __init__(self, feed=None):
+        self.feed = feed or BinanceFeed()
+        self.bids = None
+        self.asks = None
+        self.base_id = None
+        self.next_id = None
+        self.gaps = 0
+        self.pending = []
+
+    @property
+    def ready(self):
+        return self.bids is not None
+
+    def reset(self, snapshot, updates=()):
+        self.bids = dict(snapshot.bids)
+        self.asks = dict(snapshot.asks)
+        self.base_id = snapshot.last_id
+        self.next_id = snapshot.last_id + 1
+        self.pending = updates
+
+    def apply(self, updates, until=None):
+        """applies the depth messages as the replayer does, up to update `until`"""
+        for msg in updates:
+            event = self.feed.depth(msg)
+            if event is None or event.last_id < self.base_id:
+                continue
+            if until is not None and event.last_id > until:
+                break
+            if event.first_id > self.next_id:
+                self.gaps += 1
+            self.next_id = event.last_id + 1
+            for side, levels in [(self.bids, event.bids), (self.asks, event.asks)]:
+                for p, q in levels:
+                    if q == 0.0:
+                        side.pop(p, None)
+                    else:
+                        side[p] = q
+
+    def rebuild(self, last_id, updates):
+        """the book at update `last_id`, having applied the pending updates and `updates` up to it"""
+        self.apply(self.pending)
+        self.pending = []
+        self.apply(updates, until=last_id)
+        return self.bids, self.asks
+
+    def encode(self, raw, updates, full=False):
+        """
+        what to record of the venue's snapshot `raw`: itself when `full` or first, else its delta on the book
+        rebuilt with the previous group's updates and `updates`, those recorded since the end of that group
+        """
+        snapshot = self.feed.snapshot(raw)
+        content = raw
+        if self.ready and not full:
+            content = delta(*self.rebuild(snapshot.last_id, updates), snapshot)
+        self.reset(snapshot)
+        return content
+
+    def group(self, raw, updates):
+        """the `Snapshot` of a group's recorded snapshot `raw`, its depth messages being `updates`"""
+        if is_delta(raw):
+            if not self.ready:
+                raise LookupError(f"the snapshot at update {raw['lastUpdateId']} is a delta on groups that were not read, "
+                                  f"the replay should start from a full snapshot")
+            snapshot = expand(*self.rebuild(raw['lastUpdateId'], updates), raw)
+        else:
+            snapshot = self.feed.snapshot(raw)
+        self.reset(snapshot, updates)
+        return snapshot
+
+
+def encode_folder(replayer, pair):
+    """
+    rewrites the recorded snapshots of `pair` as deltas, keeping the first one of each day in full,
+    for the recordings made before the `Writer` stored deltas. Zipped days are left as they are.
+    """
+    chain = SnapshotChain()
+    stats = collections.Counter()
+    day = None
+    for files, zip_path in replayer.file_groups(pair):
+        if zip_path:
+            chain = SnapshotChain()
+            continue
+        js_updates, list_trades, raw = replayer.load_group(files)
+        first_of_day = files[0].split('/')[-1][:10] != day
+        day = files[0].split('/')[-1][:10]
+        if is_delta(raw):
+            chain.group(raw, js_updates)
+            continue
+        content = chain.encode(raw, js_updates, full=first_of_day)
+        chain.pending = js_updates
+        if content is raw:
+            stats['full'] += 1
+            continue
+        stats['delta' if content['bids'] or content['asks'] else 'match'] += 1
+        with open(files[0], 'w') as fp:
+            json.dump(content, fp)
+    return stats
@@ -0,0 +1,94 @@
+import json
+import struct
+import numpy as np
+
+
+MAGIC = b'SPF1'
+
+
+class SparseFrames:
+    """
+    CSR encoding of the [N, ...] binned frames of `gen_array_async` (the `bs` books, [N, 2W, C] float32):
+    for frame i, the flat positions within the frame of its non-zero bins are indices[indptr[i]:indptr[i+1]],
+    with their values. The bins far from the touch are mostly zero, and the trades channel almost always,
+    so that the frames take a fraction of their dense size to store or send to another process.
+    """
+    def __init__(self, shape, indptr, indices, values):
+        self.shape = tuple(shape)
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+
+    @staticmethod
+    def index_dtype(shape):
+        return np.uint16 if int(np.prod(shape[1:])) <= 1 << 16 else np.uint32
+
+    @classmethod
+    def encode(cls, arr):
+        arr = np.asarray(arr, dtype=np.float32)
+        flat = arr.reshape(arr.shape[0], int(np.prod(arr.shape[1:])))
+        rows, indices = np.nonzero(flat)
+        indptr = np.zeros(arr.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=arr.shape[0]), out=indptr[1:])
+        return cls(arr.shape, indptr, indices.astype(cls.index_dtype(arr.shape)), flat[rows, indices])
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+    @property
+    def density(self):
+        return len(self.values) / max(1, int(np.prod(self.shape)))
+
+    def __getitem__(self, rows):
+        """the frames of the slice `rows`, sharing the arrays of these ones"""
+        start, stop, step = rows.indices(self.shape[0])
+        assert step == 1, "only contiguous frames can be taken"
+        stop = max(start, stop)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        return SparseFrames((stop - start,) + self.shape[1:], self.indptr[start:stop + 1] - lo,
+                            self.indices[lo:hi], self.values[lo:hi])
+
+    def densify_into(self, out, start=0, stop=None):
+        """writes the frames [start, stop) into the preallocated float32 array `out`, returns the filled view"""
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        view = out[:stop - start]
+        assert view.shape == (stop - start,) + self.shape[1:], f"{out.shape} cannot hold frames {start}:{stop} of {self.shape}"
+        view[...] = 0
+        lo, hi = self.indptr[start], self.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        flat = view.reshape(stop - start, int(np.prod(self.shape[1:])))
+        flat[rows, self.indices[lo:hi]] = self.values[lo:hi]
+        return view
+
+    def densify(self, start=0, stop=None):
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        return self.densify_into(np.empty((stop - start,) + self.shape[1:], dtype=np.float32), start, stop)
+
+    def to_bytes(self):
+        """one buffer holding the frames, for a file or a pipe, read back with `from_bytes` without copying"""
+        header = json.dumps({'shape': self.shape, 'nnz': len(self.values), 'index': np.dtype(self.indices.dtype).name}).encode()
+        # padded so that the arrays are aligned
+        header += b' ' * (-len(header) % 8)
+        return b''.join([struct.pack('<4sI', MAGIC, len(header)), header,
+                         self.indptr.tobytes(), self.values.tobytes(), self.indices.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, buf):
+        magic, size = struct.unpack_from('<4sI', buf)
+        assert magic == MAGIC, "not sparse frames"
+        header = json.loads(bytes(buf[8:8 + size]))
+        shape, nnz = tuple(header['shape']), header['nnz']
+        offset = 8 + size
+        indptr = np.frombuffer(buf, dtype=np.int64, count=shape[0] + 1, offset=offset)
+        offset += indptr.nbytes
+        values = np.frombuffer(buf, dtype=np.float32, count=nnz, offset=offset)
+        offset += values.nbytes
+        indices = np.frombuffer(buf, dtype=header['index'], count=nnz, offset=offset)
+        return cls(shape, indptr, indices, values)
+
+    def __reduce__(self):
+        return SparseFrames.from_bytes, (self.to_bytes(),)
@@ -0,0 +1,156 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+from deep_orderbook.sparse import SparseFrames
+
+
+EXT = '.npc'
+MAGIC = b'NPC1'
+# default codec of each kind of sidepix array: books are quantized, prices kept exact, labels are small integers
+CODECS = {'bs': 'int8', 'ps': 'float32', 'time2level': 'float16'}
+# books kept exact, only their non-zero bins being stored
+SPARSE_CODECS = dict(CODECS, bs='sparse')
+
+
+class ChunkedArray:
+    """
+    Float32 array stored as zlib-compressed chunks of rows, each chunk encoded with `codec`:
+    'float32' (lossless), 'float16', 'int8' scaled by the largest absolute value of the chunk,
+    or 'sparse' (lossless, the `SparseFrames` of the rows).
+
+    The file starts with a JSON header holding the shape, the codec and the offset of every chunk,
+    so that any range of rows is decoded from the chunks it spans only.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            magic, size = struct.unpack('<4sI', fp.read(8))
+            assert magic == MAGIC, f"not a chunked array: {filename}"
+            self.header = json.loads(fp.read(size))
+        self.base = 8 + size
+        self.shape = tuple(self.header['shape'])
+        self.codec = self.header['codec']
+        self.chunk_rows = self.header['chunk_rows']
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @staticmethod
+    def encode(chunk, codec):
+        scale = 1.0
+        if codec == 'int8':
+            scale = float(np.abs(chunk).max(initial=0)) / 127 or 1.0
+            chunk = np.rint(chunk / scale).astype(np.int8)
+        elif codec == 'sparse':
+            return SparseFrames.encode(chunk).to_bytes(), scale
+        elif codec == 'float16':
+            chunk = chunk.astype(np.float16)
+        else:
+            chunk = chunk.astype(np.float32)
+        return chunk.tobytes(), scale
+
+    @staticmethod
+    def save(filename, arr, codec='float32', chunk_rows=4096, level=1):
+        arr = np.asarray(arr, dtype=np.float32)
+        blobs, chunks, offset = [], [], 0
+        for start in range(0, arr.shape[0], chunk_rows):
+            raw, scale = ChunkedArray.encode(arr[start:start + chunk_rows], codec)
+            blob = zlib.compress(raw, level)
+            chunks.append([offset, len(blob), scale])
+            blobs.append(blob)
+            offset += len(blob)
+        header = json.dumps({'shape': arr.shape, 'codec': codec, 'chunk_rows': chunk_rows, 'chunks': chunks}).encode()
+        tmp = f"{filename}.tmp{os.getpid()}"
+        with open(tmp, 'wb') as fp:
+            fp.write(struct.pack('<4sI', MAGIC, len(header)))
+            fp.write(header)
+            for blob in blobs:
+                fp.write(blob)
+        os.replace(tmp, filename)
+
+    def read_into(self, out, start=0, stop=None):
+        """decodes the rows [start, stop) into the preallocated float32 array `out`, returns the filled view"""
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        view = out[:stop - start]
+        assert view.shape == (stop - start,) + self.shape[1:], f"{out.shape} cannot hold rows {start}:{stop} of {self.shape}"
+        dtype = {'int8': np.int8, 'float16': np.float16}.get(self.codec, np.float32)
+        with open(self.filename, 'rb') as fp:
+            for n in range(start // self.chunk_rows, (stop - 1) // self.chunk_rows + 1 if stop > start else 0):
+                offset, size, scale = self.header['chunks'][n]
+                fp.seek(self.base + offset)
+                raw = zlib.decompress(fp.read(size))
+                if self.codec == 'sparse':
+                    chunk = SparseFrames.from_bytes(raw)
+                else:
+                    chunk = np.frombuffer(raw, dtype=dtype).reshape((-1,) + self.shape[1:])
+                first = n * self.chunk_rows
+                lo, hi = max(start, first) - first, min(stop, first + len(chunk)) - first
+                dest = view[first + lo - start:first + hi - start]
+                if self.codec == 'sparse':
+                    chunk.densify_into(dest, lo, hi)
+                elif self.codec == 'int8':
+                    np.multiply(chunk[lo:hi], np.float32(scale), out=dest, casting='unsafe')
+                else:
+                    dest[...] = chunk[lo:hi]
+        return view
+
+    def read(self, start=0, stop=None):
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        return self.read_into(np.empty((stop - start,) + self.shape[1:], dtype=np.float32), start, stop)
+
+
+def codec_of(filename, codecs=None):
+    """the codec for a sidepix file name, from its kind"""
+    for kind, codec in (codecs or CODECS).items():
+        if f"-{kind}" in os.path.basename(filename):
+            return codec
+    return 'float32'
+
+
+def compressed(filename):
+    return os.path.splitext(filename)[0] + EXT
+
+
+def existing(filename):
+    """the compressed version of a `.npy` file name if it exists, the file name otherwise"""
+    return compressed(filename) if os.path.exists(compressed(filename)) else filename
+
+
+def load_array(filename, out=None, mmap_mode=None):
+    """loads a `.npy` or compressed array, decoding the latter into `out` when given"""
+    if filename.endswith(EXT):
+        arr = ChunkedArray(filename)
+        if out is None:
+            return arr.read()
+        return arr.read_into(out)
+    arr = np.load(filename, mmap_mode=mmap_mode)
+    if out is None:
+        return arr
+    out[:arr.shape[0]] = arr
+    return out[:arr.shape[0]]
+
+
+def save_array(filename, arr, codec=None):
+    if filename.endswith(EXT):
+        ChunkedArray.save(filename, arr, codec=codec or codec_of(filename))
+    else:
+        np.save(filename, arr)
+
+
+def compress_folder(folder, codecs=None, remove=False):
+    """converts the `.npy` files of a sidepix folder, returns the (original, compressed) sizes in bytes"""
+    before = after = 0
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.npy'):
+            continue
+        filename = f"{folder}/{name}"
+        ChunkedArray.save(compressed(filename), np.load(filename), codec=codec_of(name, codecs))
+        before += os.path.getsize(filename)
+        after += os.path.getsize(compressed(filename))
+        if remove:
+            os.remove(filename)
+    return before, after
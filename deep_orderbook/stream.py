@@ -0,0 +1,107 @@
+import asyncio
+import numpy as np
+
+from deep_orderbook import labels
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.shapper import BookShapper
+
+
+class TrainingStream:
+    """
+    Streams recorded L2 straight into (books, alpha, prices) training windows of `sample_length` seconds,
+    without writing the day arrays: replay -> `gen_array_async` -> labels over a look-ahead buffer.
+
+    Only the current window and its `future` seconds of look-ahead are kept in memory. The labels are
+    the time2level of the day files, with the level spacing of each row's day taken from the first row
+    streamed for that day, and looking ahead across day boundaries. The seconds at the very end of the
+    replay, which lack the look-ahead, are not yielded.
+    """
+    def __init__(self, replayer, markets, side_bips, side_width, sample_length=256, future=labels.FUTURE,
+                 zoom_frac=1/256, cache=None):
+        self.replayer = replayer
+        self.markets = markets
+        self.side_bips = side_bips
+        self.side_width = side_width
+        self.sample_length = sample_length
+        self.future = future
+        self.zoom_frac = zoom_frac
+        self.cache = cache
+        self.capacity = sample_length + future
+        self.books = {market: None for market in markets}
+        self.prices = {market: np.empty((self.capacity, 2, 3), dtype=np.float32) for market in markets}
+        self.steps = {market: np.empty(self.capacity) for market in markets}
+        self.first_row = {market: None for market in markets}
+        self.count = 0
+
+    async def seconds_async(self):
+        replayers = [self.replayer.replay_seconds_async(market, cache=self.cache) for market in self.markets]
+        multi = Replayer.multireplayL2_async(replayers)
+        async for second in BookShapper.gen_array_async(multi, self.markets, width_per_side=self.side_width, zoom_frac=self.zoom_frac):
+            yield second
+
+    def add(self, second):
+        n = self.count
+        for market in self.markets:
+            books, prices = second[market]['bs'][-1], second[market]['ps'][-1]
+            if self.books[market] is None:
+                self.books[market] = np.empty((self.capacity,) + books.shape, dtype=np.float32)
+            first = self.first_row[market]
+            if first is None or labels.day_of(prices[None]) != labels.day_of(first):
+                first = self.first_row[market] = prices[None].copy()
+            self.books[market][n] = books
+            self.prices[market][n] = prices
+            self.steps[market][n] = labels.pricestep_of(first, self.side_bips, self.side_width)
+        self.count = n + 1
+
+    def window(self, market):
+        """the full window of `market` with its labels, computed per day as the level spacing changes with it"""
+        length = self.sample_length
+        prices, steps = self.prices[market], self.steps[market]
+        time2level = np.empty((length, 2 * self.side_width, 1), dtype=np.float32)
+        cuts = [0] + list(np.flatnonzero(np.diff(steps[:length])) + 1) + [length]
+        for start, stop in zip(cuts[:-1], cuts[1:]):
+            time2level[start:stop] = labels.time2level_rows(prices[start:self.capacity], steps[start], self.side_width,
+                                                            num_rows=stop - start, future=self.future)
+        return self.books[market][:length].copy(), labels.alpha(time2level), prices[:length].copy()
+
+    def shift(self):
+        """keeps the look-ahead rows as the start of the next window"""
+        length = self.sample_length
+        for market in self.markets:
+            for buf in (self.books[market], self.prices[market], self.steps[market]):
+                buf[:self.future] = buf[length:self.capacity]
+        self.count = self.future
+
+    async def windows_async(self):
+        """yields {market: (books, alpha, prices)} for each window"""
+        async for second in self.seconds_async():
+            self.add(second)
+            if self.count == self.capacity:
+                yield {market: self.window(market) for market in self.markets}
+                self.shift()
+
+    def samples(self, market):
+        """
+        the windows of one market as a plain generator, running the replay in its own event loop,
+        e.g. for `tf.data.Dataset.from_generator`
+        """
+        loop = asyncio.new_event_loop()
+        windows = self.windows_async()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(windows.__anext__())[market]
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(windows.aclose())
+            loop.close()
+
+    def batches(self, market, batch_size):
+        """the windows of one market stacked by `batch_size`: ([B, L, 2W, C], [B, L, 2W, 1], [B, L, 2, 3])"""
+        batch = []
+        for sample in self.samples(market):
+            batch.append(sample)
+            if len(batch) == batch_size:
+                yield tuple(np.stack(arrs) for arrs in zip(*batch))
+                batch = []
@@ -0,0 +1,87 @@
+import heapq
+import collections
+import numpy as np
+import pandas as pd
+
+
+class TradeBuckets:
+    """
+    Aggregated trades grouped by the second they become available, stored as typed arrays in time order.
+
+    `pop(second)` hands out the trades of a second and moves the watermark to it: the older seconds
+    were never asked for (skipped by the replay, or drifted) and are evicted, their trades counted
+    as dropped. Trades for a second before the watermark arrive too late and are dropped as well.
+    At most `max_seconds` seconds are held, the oldest being evicted first, so memory stays flat.
+    """
+    COLUMNS = ['q', 'delay', 'num', 'up']
+
+    def __init__(self, max_seconds=4 * 3600):
+        self.max_seconds = max_seconds
+        self.buckets = {}
+        self.seconds = []
+        self.watermark = None
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @staticmethod
+    def parse(trades):
+        """the (tavail, p, q, delay, num, up) columns of a `feeds.TRADE_FIELDS` array, sorted by price as `BookShapper.trades2frame`"""
+        E, T, p, q, f, l, m = trades.T
+        order = np.argsort(p, kind='quicksort')
+        cols = np.stack([E // 1000 + 1, p, q, E - T, l - f + 1, 1 - 2 * m])
+        return cols[:, order]
+
+    def add(self, trades, force_second=None):
+        """stores the trades of a `feeds.TRADE_FIELDS` array, all in `force_second` (replacing what it held) when given"""
+        if not len(trades):
+            return
+        cols = self.parse(trades)
+        if force_second is not None:
+            self.put(force_second, cols[1:], replace=True)
+            return
+        tavail = cols[0]
+        order = np.argsort(tavail, kind='stable')
+        seconds, starts = np.unique(tavail[order], return_index=True)
+        for second, chunk in zip(seconds, np.split(cols[1:, order], starts[1:], axis=1)):
+            self.put(int(second), chunk)
+
+    def put(self, second, cols, replace=False):
+        if self.watermark is not None and second < self.watermark:
+            self.stats['late'] += cols.shape[1]
+            return
+        if second not in self.buckets:
+            heapq.heappush(self.seconds, second)
+        elif not replace:
+            # the trades of a second can come in two bunches, e.g. from two hourly files
+            self.stats['merged'] += 1
+            cols = np.concatenate([self.buckets[second], cols], axis=1)
+            cols = cols[:, np.argsort(cols[0], kind='quicksort')]
+        self.buckets[second] = cols
+        while len(self.buckets) > self.max_seconds:
+            self.evict(heapq.heappop(self.seconds))
+
+    def get_state(self):
+        """the held trades, to restore with `set_state`, the arrays being shared as they are never modified"""
+        return {'buckets': dict(self.buckets), 'watermark': self.watermark}
+
+    def set_state(self, state):
+        self.buckets = dict(state['buckets'])
+        self.seconds = sorted(self.buckets)
+        self.watermark = state['watermark']
+
+    def evict(self, second):
+        self.stats['dropped'] += self.buckets.pop(second).shape[1]
+
+    def pop(self, second, default=None):
+        """the trades of `second` as a frame indexed by price, evicting the older ones"""
+        self.watermark = second if self.watermark is None else max(self.watermark, second)
+        while self.seconds and self.seconds[0] < self.watermark:
+            self.evict(heapq.heappop(self.seconds))
+        cols = self.buckets.pop(second, None)
+        if cols is None:
+            return default
+        heapq.heappop(self.seconds)
+        self.stats['served'] += cols.shape[1]
+        return pd.DataFrame(dict(zip(self.COLUMNS, cols[1:])), index=pd.Index(cols[0], name='p'))
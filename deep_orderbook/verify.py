@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import collections
+import concurrent.futures
+import pandas as pd
+
+from deep_orderbook.feeds import BinanceFeed
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.snapshots import SnapshotChain, expand, is_delta
+
+# ok: the book rebuilt from the hour's updates matches the next snapshot on its top levels
+# gap: it matches, but updates are missing from the recorded stream
+# diverged: it does not match
+# checksum: the next snapshot is a delta that does not match its checksum, the book is unknown until the next full one
+# unknown: the book the hour starts from is unknown
+# unchecked: no next snapshot was recorded
+STATUSES = ['ok', 'gap', 'diverged', 'checksum', 'unknown', 'unchecked']
+COLUMNS = ['symbol', 'hour', 'snapshot', 'gaps', 'bid_diff', 'ask_diff', 'best', 'status']
+
+
+def hour_of(files):
+    return files[0].split('/')[-1][:19]
+
+
+def side_diff(side, levels, top, bids):
+    """the number of price levels among the `top` best that differ between the book `side` {price: size} and `levels`"""
+    expected = dict(levels[:top])
+    best = heapq.nlargest if bids else heapq.nsmallest
+    rebuilt = dict(best(top, side.items()))
+    return sum(expected.get(p) != rebuilt.get(p) for p in expected.keys() | rebuilt.keys())
+
+
+def best_of(side, bids):
+    return (max if bids else min)(side, default=None)
+
+
+def check_hours(symbol, groups, first, last, top=10, feed=None):
+    """
+    the report rows of the hours of groups[first:last], each hour being checked at the snapshot of the group after it:
+    the book replayed from the hour's snapshot and updates is compared to the next snapshot on its `top` levels
+    """
+    feed = feed or BinanceFeed()
+    try:
+        chain = Replayer.chain_of(groups, first + 1, feed)
+    except (LookupError, ValueError):
+        chain = SnapshotChain(feed)
+    rows = []
+    for i in range(first, last):
+        row = {'symbol': symbol, 'hour': hour_of(groups[i][0]), 'snapshot': None, 'gaps': 0,
+               'bid_diff': 0, 'ask_diff': 0, 'best': None}
+        rows.append(row)
+        if i + 1 == len(groups):
+            row['status'] = 'unchecked'
+            break
+        js_updates, _, raw = Replayer.load_group(*groups[i + 1])
+        row['snapshot'] = raw['lastUpdateId']
+        if not chain.ready:
+            row['status'] = 'unknown'
+            if not is_delta(raw):
+                chain.group(raw, js_updates)
+            continue
+        gaps = chain.gaps
+        bids, asks = chain.rebuild(raw['lastUpdateId'], js_updates)
+        row['gaps'] = chain.gaps - gaps
+        try:
+            snapshot = expand(bids, asks, raw) if is_delta(raw) else feed.snapshot(raw)
+        except ValueError:
+            row['status'] = 'checksum'
+            chain = SnapshotChain(feed)
+            continue
+        row['bid_diff'] = side_diff(bids, snapshot.bids, top, bids=True)
+        row['ask_diff'] = side_diff(asks, snapshot.asks, top, bids=False)
+        row['best'] = ((best_of(bids, True), best_of(asks, False)) ==
+                       (snapshot.bids[0][0] if snapshot.bids else None, snapshot.asks[0][0] if snapshot.asks else None))
+        if row['bid_diff'] or row['ask_diff']:
+            row['status'] = 'diverged'
+        else:
+            row['status'] = 'gap' if row['gaps'] else 'ok'
+        chain.reset(snapshot, js_updates)
+    return rows
+
+
+def day_tasks(replayer, pairs):
+    """the (symbol, groups, first, last) of each recorded day of each pair, the groups being all the ones of the pair"""
+    for pair in pairs:
+        groups = list(replayer.file_groups(pair))
+        first = 0
+        for day, hours in itertools.groupby(groups, lambda group: hour_of(group[0])[:10]):
+            last = first + len(list(hours))
+            yield pair, groups, first, last
+            first = last
+
+
+def verify(replayer, pairs, top=10, processes=None, report=None, feed=None):
+    """
+    checks every recorded hour of `pairs`, each day in a process of its own (in this one when `processes` is 0),
+    and returns the report, a row per hour, written as csv to `report` when given
+    """
+    tasks = list(day_tasks(replayer, pairs))
+    args = [[task[i] for task in tasks] for i in range(4)] + [[top] * len(tasks), [feed] * len(tasks)]
+    if processes == 0:
+        days = map(check_hours, *args)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+        days = executor.map(check_hours, *args)
+    try:
+        rows = [row for day in days for row in day]
+    finally:
+        if processes != 0:
+            executor.shutdown()
+    df = pd.DataFrame(rows, columns=COLUMNS).astype({'snapshot': 'Int64'})
+    if report:
+        df.to_csv(report, index=False)
+    return df
+
+
+def summary(df):
+    """the number of hours of each status, per symbol"""
+    counts = df.groupby(['symbol', 'status']).size().unstack(fill_value=0)
+    return counts.reindex(columns=[s for s in STATUSES if s in counts.columns])
+
+
+def safe_hours(df):
+    """the hours that can be replayed, {symbol: [hour]}"""
+    safe = collections.defaultdict(list)
+    for symbol, hour in df[df['status'] == 'ok'][['symbol', 'hour']].itertuples(index=False):
+        safe[symbol].append(hour)
+    return dict(safe)
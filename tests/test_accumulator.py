@@ -0,0 +1,61 @@
+import os
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook.accumulator import ArrayAccumulator
+from deep_orderbook import storage
+
+
+def second(t, val):
+    d, s = t // (3600 * 24), t % (3600 * 24)
+    return {'ETHBTC': {'ps': [np.array([[0, 1, 2], [d, s, 3]], dtype=np.float32)],
+                       'bs': [np.full((4, 3), val, dtype=np.float32)]}}
+
+
+class ArrayAccumulatorTest(unittest.TestCase):
+    T0 = 18400 * 3600 * 24
+
+    def test_01_ring(self):
+        acc = ArrayAccumulator(['ETHBTC'], max_length=5)
+        for i in range(13):
+            views = acc.add(second(self.T0 + i, i))
+            bs = views['ETHBTC']['bs']
+            self.assertEqual(list(bs[:, 0, 0]), list(range(max(0, i - 4), i + 1)))
+
+    def test_02_day_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            acc = ArrayAccumulator(['ETHBTC'], data_folder=tmp, capacity=2)
+            for i in range(-10, 3):
+                views = acc.add(second(self.T0 + i, i))
+            self.assertEqual(len(views['ETHBTC']['ps']), 3)
+            bs = np.load(f"{tmp}/sidepix002/2020-05-17-ETHBTC-bs.npy")
+            ps = np.load(f"{tmp}/sidepix002/2020-05-17-ETHBTC-ps.npy")
+            self.assertEqual(list(bs[:, 0, 0]), list(range(-10, 0)))
+            self.assertEqual(ps.shape, (10, 2, 3))
+
+    def test_03_compressed_day_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            acc = ArrayAccumulator(['ETHBTC'], data_folder=tmp, codecs=storage.CODECS)
+            for i in range(-10, 3):
+                acc.add(second(self.T0 + i, i))
+            bs = storage.load_array(f"{tmp}/sidepix002/2020-05-17-ETHBTC-bs{storage.EXT}")
+            ps = storage.load_array(f"{tmp}/sidepix002/2020-05-17-ETHBTC-ps{storage.EXT}")
+            np.testing.assert_allclose(bs[:, 0, 0], range(-10, 0), atol=0.05)
+            self.assertEqual(ps.shape, (10, 2, 3))
+
+    def test_04_last_day_saved(self):
+        async def seconds():
+            for i in range(-10, 3):
+                yield second(self.T0 + i, i)
+
+        async def go(acc):
+            async for _ in acc.accumulate_async(seconds()):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(go(ArrayAccumulator(['ETHBTC'], data_folder=tmp)))
+            bs = np.load(f"{tmp}/sidepix002/2020-05-18-ETHBTC-bs.npy")
+            self.assertEqual(list(bs[:, 0, 0]), [0, 1, 2])
+            self.assertTrue(os.path.exists(f"{tmp}/sidepix002/2020-05-17-ETHBTC-bs.npy"))
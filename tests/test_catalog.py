@@ -0,0 +1,43 @@
+import os
+import time
+import tempfile
+import unittest
+
+from deep_orderbook.catalog import Catalog
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        for symb in ['BTCUSDT', 'ETHBTC']:
+            os.makedirs(f"{self.folder}/{symb}")
+            for hour in ['2020-05-01T10-00-00', '2020-05-02T11-00-00']:
+                for kind in ['snapshot', 'trades', 'update']:
+                    open(f"{self.folder}/{symb}/{hour}_{kind}.json", 'w').close()
+        os.makedirs(f"{self.folder}/sidepix064")
+        for kind in ['bs', 'ps', 'time2level-bip32']:
+            open(f"{self.folder}/sidepix064/2020-05-01-BTCUSDT-{kind}.npy", 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_01_query(self):
+        catalog = Catalog(self.folder)
+        self.assertEqual(len(catalog.files(['snapshot', 'trades', 'update'])), 12)
+        upd = catalog.files('update', symbol='ETHBTC', pattern='2020-05-02')
+        self.assertEqual(upd, [f"{self.folder}/ETHBTC/2020-05-02T11-00-00_update.json"])
+        self.assertEqual(len(catalog.files('snapshot', start='2020-05-01T10', end='2020-05-02')), 2)
+        self.assertEqual(len(catalog.files('ps', symbol='BTCUSDT', width=64)), 1)
+        self.assertEqual(len(catalog.files('time2level', bips=32)), 1)
+
+    def test_02_incremental(self):
+        catalog = Catalog(self.folder)
+        self.assertEqual(catalog.refresh(), 0)
+        time.sleep(0.01)
+        open(f"{self.folder}/BTCUSDT/2020-05-03T00-00-00_trades.json", 'w').close()
+        self.assertEqual(catalog.refresh(), 1)
+        self.assertEqual(len(catalog.files('trades', symbol='BTCUSDT')), 3)
+        catalog.close()
+        # the index persists across instances
+        self.assertEqual(len(Catalog(self.folder).files('trades')), 5)
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook import checkpoint
+from deep_orderbook.checkpoint import Checkpointer
+from deep_orderbook.feeds import BinanceFeed, DepthEvent
+from deep_orderbook.framering import FrameRing
+from deep_orderbook.live_image import ImageStream
+from deep_orderbook.shapper import BookShapper
+from test_tradebuckets import trade
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_01_shapper(self):
+        async def go(filename):
+            shapper = await BookShapper.create()
+            await shapper.on_snaphsot_async(BinanceFeed.snapshot({'lastUpdateId': 10, 'bids': [['99.0', '1.0']], 'asks': [['101.0', '1.0']]}))
+            await shapper.on_depth_event_async(DepthEvent('BTCUSDT', 1000, 11, 12, [(100.0, 2.0)], [(102.0, 3.0)]))
+            await shapper.on_depth_event_async(DepthEvent('BTCUSDT', 2000, 13, 13, [(100.0, 1.0)], []))
+            shapper.add_trades([trade(2500, '101.0'), trade(3500, '100.0', maker=True)])
+            checkpoint.save(filename, shapper.get_state())
+            restored = await BookShapper.create()
+            await restored.set_state_async(checkpoint.load(filename))
+            event = DepthEvent('BTCUSDT', 2600, 14, 14, [], [(101.0, 0.5)])
+            frames = []
+            for s in [shapper, restored]:
+                await s.on_depth_event_async(event)
+                frames.append([s.make_frames(3), s.make_frames(4)])
+            return frames
+
+        with tempfile.TemporaryDirectory() as tmp:
+            frames, restored = asyncio.run(go(f'{tmp}/state.pkl'))
+            self.assertEqual(os.listdir(tmp), ['state.pkl'])
+        for f, r in zip(frames, restored):
+            for key in ['time', 'price', 'emaPrice']:
+                self.assertEqual(f[key], r[key])
+            for key in ['bids', 'asks', 'trades']:
+                self.assertTrue(f[key].equals(r[key]))
+        self.assertEqual(len(restored[1]['trades']), 1)
+
+    def test_02_ring(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ring = FrameRing.create((4, 8, 3), path=f'{tmp}/ring')
+            image = np.arange(4 * 8 * 3, dtype=np.float32).reshape(4, 8, 3)
+            ring.load(image)
+            ring.push(np.ones((4, 3)))
+            seq, read = ring.read()
+            self.assertEqual(seq, 2)
+            np.testing.assert_array_equal(read[:, :-1], image[:, 1:])
+            ring.close()
+
+    def test_03_checkpointer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            saver = Checkpointer(f'{tmp}/state.pkl', every=60, max_age=300)
+            self.assertIsNone(saver.restore())
+            saved = [asyncio.run(saver.maybe_save_async(lambda: {'n': t}, now=1000 + t)) for t in [0, 30, 70]]
+            self.assertEqual(saved, [True, False, True])
+            self.assertEqual(saver.restore(now=1100), {'n': 70})
+            self.assertIsNone(saver.restore(now=1500))
+
+    def test_04_resumed_image(self):
+        image = np.arange(1, 9, dtype=np.float32)[None, :, None]
+        state = {'image': image, 'time': 1000.2}
+        # the next column is the one of the second after the checkpoint
+        self.assertIs(ImageStream.resumed_image(state, 1001.5), image)
+        self.assertEqual(list(ImageStream.resumed_image(state, 1004.5)[0, :, 0]), [4, 5, 6, 7, 8, 0, 0, 0])
+        self.assertIsNone(ImageStream.resumed_image(state, 1009.5))
@@ -0,0 +1,33 @@
+import asyncio
+import unittest
+import numpy as np
+
+from deep_orderbook.feeds import BinanceFeed, DepthEvent, TRADE_FIELDS
+from deep_orderbook.shapper import BookShapper
+
+
+class BinanceFeedTest(unittest.TestCase):
+    def test_01_normalize(self):
+        msg = {'e': 'depthUpdate', 'E': 1588327200500, 's': 'BTCUSDT', 'U': 157, 'u': 160,
+               'b': [['99.00', '10', []]], 'a': [['101.00', '0', []]]}
+        event = BinanceFeed.depth(msg)
+        self.assertEqual(event, DepthEvent('BTCUSDT', 1588327200500, 157, 160, [(99.0, 10.0)], [(101.0, 0.0)]))
+        self.assertEqual(event.second, 1588327201)
+        self.assertIsNone(BinanceFeed.depth({'e': 'aggTrade'}))
+
+        trades = BinanceFeed.trades([{'e': 'aggTrade', 'E': 1000, 's': 'BTCUSDT', 'a': 1, 'p': '101.5', 'q': '0.5',
+                                      'f': 3, 'l': 5, 'T': 998, 'm': True, 'M': True}])
+        self.assertEqual(trades.shape, (1, len(TRADE_FIELDS)))
+        np.testing.assert_array_equal(trades[0], [1000, 998, 101.5, 0.5, 3, 5, 1])
+        self.assertEqual(BinanceFeed.trades([]).shape, (0, len(TRADE_FIELDS)))
+
+    def test_02_book(self):
+        async def go():
+            shapper = await BookShapper.create()
+            await shapper.on_snaphsot_async(BinanceFeed.snapshot({'lastUpdateId': 10, 'bids': [['99.0', '1.0']], 'asks': [['101.0', '1.0']]}))
+            await shapper.on_depth_event_async(DepthEvent('BTCUSDT', 1000, 11, 12, [(100.0, 2.0)], [(101.0, 0.0), (102.0, 3.0)]))
+            return shapper._depth_manager.get_depth_cache().get_bids_asks(), shapper.px
+        (bids, asks), px = asyncio.run(go())
+        self.assertEqual(bids, [[100.0, 2.0], [99.0, 1.0]])
+        self.assertEqual(asks, [[102.0, 3.0]])
+        self.assertAlmostEqual(px, (100.0 * 3.0 + 102.0 * 2.0) / 5.0)
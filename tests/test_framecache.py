@@ -0,0 +1,108 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from deep_orderbook.framecache import FrameCache
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.shapper import BookShapper
+from test_recorder import write_recording
+
+PAIRS = ['BTCUSDT', 'ETHBTC']
+
+
+def frame(t, px):
+    return {'time': t,
+            'price': px,
+            'bids': pd.DataFrame([[px - 0.01, 1.0], [px * 0.5, 2.0]], columns=['price', 'size']).set_index('price'),
+            'asks': pd.DataFrame([[px + 0.01, 3.0], [px * 2, 4.0]], columns=['price', 'size']).set_index('price'),
+            'trades': pd.DataFrame(columns=['p', 'q', 'delay', 'num', 'up']).set_index(['p']),
+            'emaPrice': px,
+            }
+
+
+class FrameCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = FrameCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_01_roundtrip(self):
+        self.assertIsNone(self.cache.load('00key'))
+        self.cache.store('00key', [self.cache.frame2row(frame(1, 100.0)), self.cache.frame2row(frame(2, 101.0))])
+        frames = self.cache.load('00key')
+        self.assertEqual([f['time'] for f in frames], [1, 2])
+        # levels far from the price are dropped
+        self.assertEqual(list(frames[0]['bids'].index), [99.99])
+        self.assertEqual(list(frames[1]['asks']['size']), [3.0])
+
+    def test_02_eviction(self):
+        rows = [self.cache.frame2row(frame(1, 100.0))]
+        self.cache.store('00old', rows)
+        self.cache.store('01used', rows)
+        self.cache.store('02used', rows)
+        for n, key in enumerate(['00old', '01used', '02used']):
+            os.utime(self.cache.path(key), (n, n))
+        size = os.path.getsize(self.cache.path('00old'))
+        # the entries on disk are listed when the cache is opened, in the order they were last used
+        cache = FrameCache(self.tmp.name, max_bytes=int(size * 3.5))
+        self.assertEqual(cache.total, 3 * size)
+        cache.load('01used')
+        cache.store('03new', rows)
+        cache.store('04new', rows)
+        self.assertEqual([os.path.exists(cache.path(key)) for key in ['00old', '01used', '02used', '03new', '04new']],
+                         [False, True, False, True, True])
+
+
+class CachedReplayTest(unittest.TestCase):
+    def replay(self, folder, cache, zoom_frac):
+        async def go():
+            replayer = Replayer(folder, prefetch=0)
+            replayers = [replayer.replay_seconds_async(pair, cache=cache) for pair in PAIRS]
+            genarr = BookShapper.gen_array_async(Replayer.multireplayL2_async(replayers), PAIRS, width_per_side=8, zoom_frac=zoom_frac)
+            return np.stack([np.stack([sec[pair]['bs'][0] for pair in PAIRS]) async for sec in genarr])
+        return asyncio.run(go())
+
+    def test_01_same_arrays(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for n, pair in enumerate(PAIRS):
+                for hour in range(2):
+                    write_recording(f'{tmp}/L2', pair, hour=f'2020-05-01T1{hour}-00-00', t0=1588327200000 + 3600000 * hour + 300 * n)
+                    # levels up to 20% away from the price, the outer ones beyond what a zoom of 1/32 bins
+                    fn = f'{tmp}/L2/{pair}/2020-05-01T1{hour}-00-00_snapshot.json'
+                    snapshot = json.load(open(fn))
+                    snapshot['bids'] += [[p, '5.0', []] for p in ['95.00', '92.00', '90.00', '80.00']]
+                    snapshot['asks'] += [[p, '5.0', []] for p in ['105.00', '108.00', '110.00', '120.00']]
+                    json.dump(snapshot, open(fn, 'w'))
+            cache = FrameCache(f'{tmp}/cache')
+            for zoom_frac in [1/256, 1/32]:
+                expected = self.replay(f'{tmp}/L2', None, zoom_frac)
+                for run in range(2):
+                    np.testing.assert_array_equal(self.replay(f'{tmp}/L2', cache, zoom_frac), expected)
+            self.assertGreater(cache.hits, 0)
+            with self.assertRaises(ValueError):
+                cache.check_zoom(1/16)
+
+    def test_02_same_stream(self):
+        def frames(folder, cache):
+            async def go():
+                replay = Replayer(folder, prefetch=0).replay_seconds_async('BTCUSDT', cache=cache)
+                await replay.__anext__()
+                return [(f['time'], f['price'], f['emaPrice'], list(f['bids'].index)) async for f in replay]
+            return asyncio.run(go())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for hour in range(2):
+                write_recording(f'{tmp}/L2', 'BTCUSDT', hour=f'2020-05-01T1{hour}-00-00', t0=1588327200000 + 3600000 * hour)
+            cache = FrameCache(f'{tmp}/cache')
+            expected = frames(f'{tmp}/L2', None)
+            self.assertEqual(frames(f'{tmp}/L2', cache), expected)
+            self.assertEqual(frames(f'{tmp}/L2', cache), expected)
+            self.assertEqual(cache.hits, 2)
+        times = [f[0] for f in expected]
+        self.assertEqual(times[1:], sorted(set(times[1:])))
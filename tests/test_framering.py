@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from deep_orderbook.framering import FrameRing
+from deep_orderbook.live_image import ImageStream
+
+
+class FrameRingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ring = FrameRing.create(shape=(4, 3, 2), path=f"{self.tmp.name}/test.ring")
+
+    def tearDown(self):
+        self.ring.close()
+        self.tmp.cleanup()
+
+    def test_01_shift(self):
+        viewer = FrameRing.attach(self.ring.path)
+        for i in range(1, 5):
+            self.ring.push(np.full((4, 2), i))
+        seq, image = viewer.read()
+        self.assertEqual(seq, 4)
+        self.assertEqual(list(image[0, :, 0]), [2, 3, 4])
+        self.assertFalse(image.flags.writeable)
+        viewer.close()
+
+    def test_02_valid(self):
+        self.ring.push(np.ones((4, 2)))
+        seq, image = self.ring.read()
+        self.ring.push(np.ones((4, 2)))
+        self.assertTrue(self.ring.valid(seq))
+        self.ring.push(np.ones((4, 2)))
+        self.assertFalse(self.ring.valid(seq))
+
+    def test_03_close(self):
+        viewer = FrameRing.attach(self.ring.path)
+        viewer.close()
+        self.assertTrue(os.path.exists(self.ring.path))
+        self.ring.close()
+        self.assertFalse(os.path.exists(self.ring.path))
+
+    def test_04_read_after_close(self):
+        self.ring.push(np.full((4, 2), 7))
+        seq, image = self.ring.read()
+        self.ring.close()
+        self.assertEqual(image[:, -1].sum(), 7 * 4 * 2)
+
+    def test_05_default_path(self):
+        rings = [FrameRing.create(shape=(4, 3, 2)) for _ in range(2)]
+        self.assertNotEqual(rings[0].path, rings[1].path)
+        for ring in rings:
+            ring.close()
+            self.assertFalse(os.path.exists(ring.path))
+
+
+class ImageStreamTest(unittest.TestCase):
+    def test_01_stop(self):
+        async def seconds():
+            while True:
+                await asyncio.sleep(0.001)
+                yield {'BTCUSDT': {'bs': [np.zeros((4, 3))]}}
+
+        async def setup():
+            stream.ring = FrameRing.create(shape=(4, 8, 3))
+            stream.genarr = seconds()
+
+        stream = ImageStream(['BTCUSDT'])
+        stream.setup = setup
+        runner = threading.Thread(target=stream.start)
+        runner.start()
+        while stream.ring is None or stream.ring.seq < 3:
+            time.sleep(0.01)
+        path = stream.ring.path
+        image = stream.read()
+        stream.stop()
+        runner.join(timeout=10)
+        self.assertFalse(runner.is_alive())
+        self.assertIsNone(stream.read())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(image.shape, (4, 8, 3))
+        self.assertEqual(image[:, -1].max(), 127.5)
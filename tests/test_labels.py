@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook import labels
+
+
+def day_prices(num, day, seed):
+    rng = np.random.default_rng(seed)
+    mid = 100 + np.cumsum(rng.normal(0, 0.01, num))
+    bid, ask = np.round(mid - 0.01, 2), np.round(mid + 0.01, 2)
+    low = np.where(rng.random(num) < 0.3, bid - 0.01, np.nan)
+    high = np.where(rng.random(num) < 0.3, ask + 0.01, np.nan)
+    t = np.arange(num)
+    return np.stack([np.stack([low, bid, ask], -1), np.stack([np.full(num, day), t, high], -1)], 1).astype(np.float32)
+
+
+def time2level_loop(prices, pricestep, side_width, future=labels.FUTURE):
+    """the original per-row, per-level loop"""
+    time2levels = np.zeros((prices.shape[0], 2 * side_width, 1), dtype=np.float32) + future
+    for i in range(prices.shape[0]):
+        timeupdn = []
+        for j in range(side_width):
+            thresh = j * pricestep
+            [_, b, a], [d, t, _] = prices[i]
+            waitUp = prices[i:i+future, 0, 1] < a + thresh
+            waitDn = prices[i:i+future, 0, 2] > b - thresh
+            tradeUp = prices[i:i+future, 1, 2] >= a + thresh
+            tradeDn = prices[i:i+future, 0, 0] <= b - thresh
+            tradeUp[0] = False
+            tradeDn[0] = False
+            waitUp &= ~tradeUp
+            waitDn &= ~tradeDn
+            timeupdn.insert(0, [np.argmin(waitDn) or future*10])
+            timeupdn.append([np.argmin(waitUp) or future*10])
+        time2levels[i] = timeupdn
+    return time2levels
+
+
+class LabelsTest(unittest.TestCase):
+    def test_01_backfill_halo(self):
+        days = [day_prices(300, 18000, 0), day_prices(200, 18001, 1)]
+        with tempfile.TemporaryDirectory() as tmp:
+            files = []
+            for n, prices in enumerate(days):
+                np.save(f"{tmp}/{n}-ps.npy", prices)
+                files.append((None, f"{tmp}/{n}-ps.npy", f"{tmp}/{n}-time2level.npy"))
+            saved = labels.backfill_time2level(files, side_bips=4, side_width=8, chunk_rows=64, workers=2)
+            self.assertEqual(len(saved), 2)
+            t2l = [np.load(fn_ts) for _, _, fn_ts in files]
+        # the first day looks ahead into the second one
+        step = labels.pricestep_of(days[0], side_bips=4, side_width=8)
+        expected = labels.time2level_rows(np.concatenate(days), step, side_width=8, num_rows=300)
+        np.testing.assert_array_equal(t2l[0], expected)
+        step = labels.pricestep_of(days[1], side_bips=4, side_width=8)
+        np.testing.assert_array_equal(t2l[1], labels.time2level_rows(days[1], step, side_width=8))
+
+    def test_02_same_as_loop(self):
+        prices = day_prices(400, 18000, 2)
+        step = labels.pricestep_of(prices, side_bips=4, side_width=8)
+        np.testing.assert_array_equal(labels.time2level_rows(prices, step, side_width=8), time2level_loop(prices, step, 8))
+
+    def test_03_multi_labels(self):
+        prices = day_prices(400, 18000, 3)
+        multi = labels.multi_labels(prices, side_width=8, bips=[2, 4], horizons=[30, 120])
+        self.assertEqual(multi.shape, (400, 16, 2, 2))
+        self.assertEqual(multi.dtype, np.uint16)
+        for h, horizon in enumerate([30, 120]):
+            for b, side_bips in enumerate([2, 4]):
+                step = labels.pricestep_of(prices, side_bips=side_bips, side_width=8)
+                np.testing.assert_array_equal(multi[:, :, h, b, None], time2level_loop(prices, step, 8, future=horizon))
+        with tempfile.TemporaryDirectory() as tmp:
+            labels.save_labels(f"{tmp}/labels.npz", multi, side_width=8, bips=[2, 4], horizons=[30, 120], chunk_rows=64)
+            part, meta = labels.load_labels(f"{tmp}/labels.npz", start=100, stop=250)
+            np.testing.assert_array_equal(part, multi[100:250])
+            self.assertEqual(meta['horizons'], [30, 120])
+            t2l, _ = labels.load_labels(f"{tmp}/labels.npz", horizon=120, side_bips=4)
+            np.testing.assert_array_equal(t2l, multi[:, :, 1, 1, None].astype(np.float32))
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+
+from deep_orderbook.orderflow import OrderFlow
+
+
+class OrderFlowTest(unittest.TestCase):
+    def test_01_levels(self):
+        flow = OrderFlow()
+        levels = flow.at(100)
+        flow.on_level('bids', 99.0, 2.0, 0.0)
+        flow.on_level('bids', 99.0, 0.5, 2.0)
+        flow.on_level('bids', 99.0, 0.0, 0.5)
+        flow.on_level('asks', 101.0, 3.0, 1.0)
+        self.assertIs(flow.at(100), levels)
+        self.assertEqual(levels['bids'][99.0], [2.0, 2.0, 1, 3])
+        self.assertEqual(levels['asks'][101.0], [2.0, 0.0, 0, 1])
+        # the next second starts afresh and leaves the finished one alone
+        self.assertEqual(flow.at(101), {'bids': {}, 'asks': {}})
+        self.assertEqual(len(levels['bids']), 1)
+
+    def test_02_binned(self):
+        edges = np.array([[98.0, 99.0, 100.0, 100.0, 101.0, 102.0]] * 2)
+        flow = {'bids': {99.5: [1.0, 0.0, 0, 1], 97.0: [5.0, 0.0, 0, 1]},
+                'asks': {100.5: [0.0, 2.0, 1, 2], 110.0: [5.0, 0.0, 0, 1]}}
+        binned = OrderFlow.binned([flow, None], edges)
+        self.assertEqual(binned.shape, (2, 6, 4))
+        np.testing.assert_allclose(binned[0, 1], np.arcsinh([1, 0, 0, 1]))
+        np.testing.assert_allclose(binned[0, 4], -np.arcsinh([0, 2, 1, 2]))
+        self.assertEqual(np.count_nonzero(binned[0]), 5)
+        self.assertFalse(binned[1].any())
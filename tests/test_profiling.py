@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook import labels
+from deep_orderbook.profiling import Profiler
+from deep_orderbook.__main__ import main
+from test_recorder import write_recording
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_01_stages(self):
+        prices = np.cumsum(np.random.default_rng(0).normal(size=(20000, 2, 3)), axis=0).astype(np.float32)
+        for mode in ['sample', 'cprofile']:
+            with Profiler(mode, interval=0.001) as profiler:
+                for _ in range(20):
+                    labels.first_passage(prices, future=60)
+            stages = dict((stage, frac) for stage, seconds, frac in profiler.breakdown() if stage != 'idle')
+            # the numpy calls are counted in the stage calling them
+            self.assertEqual(max(stages, key=stages.get), 'labels', (mode, stages))
+
+    def test_02_cli(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_recording(f'{tmp}/L2', 'BTCUSDT', seconds=60)
+            main(['--profile', '--profile-out', f'{tmp}/prof/replay', 'replay', '--data-folder', f'{tmp}/L2',
+                  '--side-width', '8', '--prefetch', '0'])
+            with open(f'{tmp}/prof/replay.folded') as fp:
+                stacks = [line.rsplit(' ', 1) for line in fp]
+            self.assertTrue(all(int(count) > 0 for stack, count in stacks))
+            self.assertTrue(os.path.exists(f'{tmp}/prof/replay.stages.txt'))
+
+            main(['--profile', 'cprofile', '--profile-out', f'{tmp}/prof/pre', 'precompute', '--data-folder', f'{tmp}/L2',
+                  '--side-width', '8', '--side-bips', '4', '--prefetch', '0', '--out-folder', tmp])
+            self.assertTrue(os.path.exists(f'{tmp}/prof/pre.prof'))
+            self.assertTrue(os.path.exists(f'{tmp}/sidepix008/2020-05-01-BTCUSDT-time2level-bip04.npy'))
@@ -1,7 +1,16 @@
+import os
+import json
+import time
+import random
 import asyncio
+import tempfile
 import unittest
 
-from deep_orderbook.recorder import Receiver
+from deep_orderbook.recorder import Receiver, Writer, DepthCachePlus, MessageDepthCacheManager
+from deep_orderbook.feeds import DepthEvent
+from deep_orderbook.mockexchange import MockExchange
+from deep_orderbook.shapper import BookShapper
+from test_tradebuckets import trade
 
 
 class ReceiverTest(unittest.TestCase):
@@ -36,3 +45,199 @@ class ReceiverTest(unittest.TestCase):
                     return
             self.assertTrue(False)
         self.loop.run_until_complete(go())
+
+
+def write_recording(folder, symb, hour='2020-05-01T10-00-00', t0=1588327200000, seconds=20):
+    os.makedirs(f"{folder}/{symb}", exist_ok=True)
+    snapshot = {'lastUpdateId': 100, 'bids': [['99.00', '1.0', []], ['98.00', '2.0', []]], 'asks': [['101.00', '1.0', []], ['102.00', '2.0', []]]}
+    updates = [{'e': 'depthUpdate', 'E': t0 + 500 * i, 's': symb, 'U': 101 + i, 'u': 101 + i,
+                'b': [['99.00', f'{1 + i}.0', []]], 'a': [['101.00', f'{1 + i}.0', []]]} for i in range(2 * seconds)]
+    trades = [{'e': 'aggTrade', 'E': t0 + 1000 * i, 's': symb, 'a': i, 'p': '101.00', 'q': '0.5',
+               'f': i, 'l': i, 'T': t0 + 1000 * i - 2, 'm': False, 'M': True} for i in range(seconds)]
+    for kind, content in [('snapshot', snapshot), ('update', updates), ('trades', trades)]:
+        with open(f"{folder}/{symb}/{hour}_{kind}.json", 'w') as fp:
+            json.dump(content, fp)
+
+
+class MockReceiverTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.symb = 'BTCUSDT'
+        write_recording(cls.tmp.name, cls.symb)
+        cls.exchange = MockExchange(cls.tmp.name, speed=100)
+        async def go():
+            cls.receiver = await Receiver.create(markets=[cls.symb], print_level=0, transport=cls.exchange)
+            await cls.exchange.wait_finished(timeout=30)
+        cls.loop.run_until_complete(go())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.receiver.bm.close())
+        cls.tmp.cleanup()
+
+    def test_01_replayed_book(self):
+        bids, asks = self.receiver.depth_managers[self.symb].get_depth_cache().get_bids_asks()
+        self.assertEqual(bids[0][0], 99.0)
+        self.assertGreater(bids[0][1], 1.0)
+
+    def test_02_stats(self):
+        stats = self.exchange.stats[f"{self.symb}@depth"]
+        self.assertEqual(stats['dropped'], 0)
+        self.assertGreater(stats['sent'], 0)
+        self.assertGreater(self.exchange.stats[f"{self.symb}@aggTrade"]['sent'], 0)
+
+    def test_03_multi_generator(self):
+        async def go():
+            shappers = {self.symb: await BookShapper.create()}
+            multi = self.receiver.multi_generator(shappers)
+            first = await multi.__anext__()
+            second = await multi.__anext__()
+            stats = self.receiver.tick_stats
+            self.assertEqual(stats['ticks'], 2)
+            # a loaded machine may skip a tick, which is then counted
+            self.assertEqual(second[self.symb]['time'] - first[self.symb]['time'], 1 + stats['skipped'])
+        self.receiver.tick_stats.clear()
+        self.loop.run_until_complete(go())
+
+    def test_04_overload(self):
+        slow_tick = 2
+
+        def build_frame(shapper, bids, asks, list_trades, flow, twake):
+            calls.append(twake)
+            if len(calls) == slow_tick:
+                time.sleep(2.3)
+            return Receiver.build_frame(shapper, bids, asks, list_trades, flow, twake)
+
+        async def send_trades(stop):
+            for n in range(1000):
+                if stop.is_set():
+                    return
+                await self.receiver.on_aggtrades(trade(int(time.time() * 1000), '100.0', qty=f'{n + 1}'))
+                sent.append(n + 1)
+                await asyncio.sleep(0.05)
+
+        async def go():
+            shappers = {self.symb: await BookShapper.create()}
+            multi = self.receiver.multi_generator(shappers)
+            frames = [await multi.__anext__()]
+            stop = asyncio.Event()
+            sender = asyncio.ensure_future(send_trades(stop))
+            for _ in range(4):
+                frames.append(await multi.__anext__())
+            stop.set()
+            await sender
+            return [(sec[self.symb]['time'], list(sec[self.symb]['trades']['q'])) for sec in frames]
+
+        calls, sent = [], []
+        self.receiver.build_frame = build_frame
+        self.receiver.tick_stats.clear()
+        try:
+            frames = self.loop.run_until_complete(go())
+        finally:
+            del self.receiver.build_frame
+        stats = self.receiver.tick_stats
+        times = [t for t, _ in frames]
+        self.assertEqual(stats['ticks'], 5)
+        self.assertGreaterEqual(stats['skipped'], 1)
+        self.assertEqual(times[-1] - times[0], len(times) - 1 + stats['skipped'])
+        self.assertLess(stats['lag_max'], 3.5)
+        # the trades of the skipped ticks are in the next one, once
+        served = [q for _, qs in frames for q in qs]
+        pending = [float(t['q']) for t in self.receiver.tick_trades.get(self.symb, [])]
+        self.assertEqual(sorted(served + pending), sent)
+        self.assertGreater(len(frames[slow_tick][1]), len(frames[-1][1]))
+
+
+class DepthCachePlusTest(unittest.TestCase):
+    @staticmethod
+    def uncrossed(bids, asks):
+        """the repair of the crossed book by rescanning it, as it was done before the sorted sides"""
+        best_bid, best_ask = max(bids), min(asks)
+        if best_bid >= best_ask:
+            bids = {p: q for p, q in bids.items() if p < best_ask}
+            asks = {p: q for p, q in asks.items() if p > best_bid}
+        return sorted(bids.items(), reverse=True), sorted(asks.items())
+
+    def test_01_uncross(self):
+        rnd = random.Random(0)
+        cache = DepthCachePlus('BTCUSDT')
+        for p in range(90, 100):
+            cache.add_bid([f'{p}.0', '1.0'])
+            cache.add_ask([f'{p + 11}.0', '1.0'])
+        for i in range(2000):
+            side = cache.add_bid if rnd.random() < 0.5 else cache.add_ask
+            side([f'{rnd.randint(85, 115)}.0', rnd.choice(['0.0', '0.5', '2.0'])])
+            if not cache._bids or not cache._asks:
+                continue
+            expected = self.uncrossed(dict(cache._bids), dict(cache._asks))
+            if not expected[0] or not expected[1]:
+                cache.uncross()
+                continue
+            bids, asks = cache.get_bids_asks()
+            self.assertEqual([tuple(l) for l in bids], expected[0])
+            self.assertEqual([tuple(l) for l in asks], expected[1])
+            self.assertEqual(cache.best(), (bids[0], asks[0]))
+        self.assertGreater(cache.stats['crossed'], 0)
+        self.assertEqual(sorted(cache._bid_keys), cache._bid_keys)
+        self.assertEqual(len(cache._ask_keys), len(cache._asks))
+
+
+class SnapshotClient:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_order_book(self, symbol, limit=100):
+        self.calls += 1
+        return {'lastUpdateId': 10, 'bids': [['99.0', '1.0'], ['98.0', '1.0']], 'asks': [['101.0', '1.0'], ['102.0', '1.0']]}
+
+
+class ResyncTest(unittest.TestCase):
+    def test_01_crossed_resync(self):
+        async def go():
+            manager = await MessageDepthCacheManager.create(client=None, loop=None, symbol='BTCUSDT', refresh_interval=None)
+            manager._client = client = SnapshotClient()
+            await manager._init_cache()
+            cache = manager.get_depth_cache()
+            await manager.on_event(DepthEvent('BTCUSDT', 1000, 11, 11, [(101.5, 1.0)], []))
+            self.assertEqual(cache.best(), ([99.0, 1.0], [102.0, 1.0]))
+            self.assertEqual(cache.gap_hint, 1000)
+            # not right after the last snapshot
+            await manager.on_event(DepthEvent('BTCUSDT', 2000, 12, 12, [(98.0, 1.0)], []))
+            self.assertEqual(client.calls, 1)
+            manager._snapshot_time -= 60
+            await manager.on_event(DepthEvent('BTCUSDT', 3000, 13, 13, [(97.0, 1.0)], []))
+            self.assertEqual(client.calls, 2)
+            self.assertEqual(cache.stats['resyncs'], 1)
+            self.assertIsNone(cache.gap_hint)
+            self.assertEqual(cache.best(), ([99.0, 1.0], [101.0, 1.0]))
+        asyncio.run(go())
+
+
+class WriterTest(unittest.TestCase):
+    def test_01_flush(self):
+        markets = ['BTCUSDT', 'ETHBTC']
+        with tempfile.TemporaryDirectory() as tmp:
+            for symb in markets:
+                write_recording(f'{tmp}/in', symb)
+            exchange = MockExchange(f'{tmp}/in', speed=None)
+
+            async def go():
+                writer = await Writer.create(markets=markets, data_folder=f'{tmp}/out', print_level=0, transport=exchange)
+                await exchange.wait_finished(timeout=30)
+                await writer.save_updates_since(1588327200)
+                await writer.save_snapshot(1588327200)
+                await writer.bm.close()
+                return writer
+            writer = asyncio.run(go())
+            for symb in markets:
+                with open(f'{tmp}/out/L2/{symb}/2020-05-01T10-00-00_update.json') as fp:
+                    updates = json.load(fp)
+                self.assertEqual([u['u'] for u in updates], list(range(101, 141)))
+                with open(f'{tmp}/out/L2/{symb}/2020-05-01T10-00-00_snapshot.json') as fp:
+                    self.assertEqual(json.load(fp)['lastUpdateId'], 100)
+                self.assertEqual(writer.writers[symb].updates, [])
+                self.assertEqual(writer.writers[symb].stats['full'], 1)
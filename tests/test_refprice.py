@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+
+from deep_orderbook import refprice
+from deep_orderbook.refprice import RefPrice
+
+
+def ema_loop(values, alpha, init=None):
+    out, prev = [], init
+    for v in values:
+        prev = v * alpha + (prev if prev is not None else v) * (1 - alpha)
+        out.append(prev)
+    return np.array(out)
+
+
+class RefPriceTest(unittest.TestCase):
+    def test_01_ema(self):
+        values = 9000 + np.cumsum(np.random.RandomState(0).normal(size=1000))
+        for alpha in [1.0, 0.5, 1/32, 1e-4]:
+            np.testing.assert_allclose(refprice.ema(values, alpha), ema_loop(values, alpha), rtol=1e-12)
+        np.testing.assert_allclose(refprice.ema(values, 1/32, init=8000.0), ema_loop(values, 1/32, init=8000.0), rtol=1e-12)
+        self.assertEqual(len(refprice.ema([], 1/32)), 0)
+
+    def test_02_halflife(self):
+        alpha = refprice.alpha_of(halflife=10)
+        self.assertAlmostEqual((1 - alpha) ** 10, 0.5)
+        self.assertEqual(RefPrice(alpha=0.1).alpha, 0.1)
+
+    def test_03_batch(self):
+        rs = np.random.RandomState(1)
+        bids = 100 + np.cumsum(rs.normal(size=300)) * 0.01
+        tops = np.stack([bids, rs.uniform(0.1, 5, 300), bids + 0.01, rs.uniform(0.1, 5, 300)], axis=1)
+        step = RefPrice()
+        expected = np.array([step.step(*row) for row in tops.tolist()])
+        batch = RefPrice()
+        # in two batches, the second one starting from the EMA of the first
+        px1, ema1 = batch.batch(tops[:100])
+        px2, ema2 = batch.batch(tops[100:])
+        np.testing.assert_array_equal(np.concatenate([px1, px2]), expected[:, 0])
+        np.testing.assert_allclose(np.concatenate([ema1, ema2]), expected[:, 1], rtol=1e-12)
+        self.assertAlmostEqual(batch.ema, step.ema, places=10)
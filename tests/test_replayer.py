@@ -1,7 +1,10 @@
 import asyncio
+import tempfile
 import unittest
 
 from deep_orderbook.replayer import Replayer
+from deep_orderbook.shapper import BookShapper
+from test_recorder import write_recording
 
 
 class ReplayerTest(unittest.TestCase):
@@ -17,3 +20,55 @@ class ReplayerTest(unittest.TestCase):
             upd = self.replayer.updates_files(pair=self.symb)
             end = upd[0].split('_')[-1]
             self.assertEqual(end, 'update.json')
+
+
+async def frames(pair, times):
+    yield pair
+    for n, t in enumerate(times):
+        yield {'time': t, 'n': n}
+
+
+class MultiReplayTest(unittest.TestCase):
+    STREAMS = {'A': [10, 10, 11, 13, 200, 201], 'B': [11, 12, 12, 14, 15, 202]}
+
+    def merged(self, **kwargs):
+        async def collect():
+            gen = Replayer.multireplayL2_async([frames(p, ts) for p, ts in self.STREAMS.items()], **kwargs)
+            return [{p: f['n'] for p, f in curs.items()} async for curs in gen]
+        return asyncio.run(collect())
+
+    def test_01_every_second(self):
+        merged = self.merged()
+        # starts at the latest first second, jumps the gap to the next update
+        self.assertEqual(merged[:5], [{'A': 1, 'B': 0}, {'A': 2, 'B': 0}, {'A': 2, 'B': 2},
+                                      {'A': 3, 'B': 2}, {'A': 3, 'B': 3}])
+        self.assertEqual(len(merged), 8)
+        self.assertEqual(merged[-1], {'A': 4, 'B': 4})
+
+    def test_02_changes_only(self):
+        merged = self.merged(every_second=False)
+        self.assertEqual(len(merged), 7)
+        self.assertTrue(all(a != b for a, b in zip(merged, merged[1:])))
+
+
+class PrefetchTest(unittest.TestCase):
+    def test_01_same_frames(self):
+        def replay(folder, **kwargs):
+            async def go():
+                replay = Replayer(folder, **kwargs).replayL2_async('BTCUSDT', await BookShapper.create())
+                return [f async for f in replay][1:]
+            return asyncio.run(go())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for hour in range(5):
+                write_recording(tmp, 'BTCUSDT', hour=f'2020-05-01T1{hour}-00-00', t0=1588327200000 + 3600000 * hour)
+            expected = replay(tmp, prefetch=0)
+            replays = [replay(tmp, prefetch=2), replay(tmp, prefetch=2, prefetch_processes=True)]
+        self.assertEqual(len(expected), 5 * 40)
+        for frames in replays:
+            self.assertEqual(len(frames), len(expected))
+            for e, f in zip(expected, frames):
+                self.assertEqual((e['time'], e['price'], e['emaPrice']), (f['time'], f['price'], f['emaPrice']))
+                self.assertTrue(e['bids'].equals(f['bids']))
+                self.assertTrue(e['asks'].equals(f['asks']))
+                self.assertTrue(e['trades'].equals(f['trades']))
@@ -1 +1,32 @@
 import unittest
+import numpy as np
+import pandas as pd
+
+from deep_orderbook.shapper import BookShapper
+
+
+def frame(seed, num_trades):
+    rng = np.random.default_rng(seed)
+    mid = 100 + rng.normal()
+    bids = np.round(mid - 0.01 * np.arange(1, 80), 2)
+    asks = np.round(mid + 0.01 * np.arange(1, 60), 2)
+    trades = pd.DataFrame({'p': np.round(mid + 0.01 * rng.integers(-5, 5, num_trades), 2),
+                           'q': rng.random(num_trades), 'delay': 3.0, 'num': rng.integers(1, 4, num_trades).astype(float),
+                           'up': rng.choice([-1.0, 1.0], num_trades)}).set_index('p').sort_index()
+    return {'time': 1590000000 + seed, 'price': mid, 'emaPrice': mid,
+            'bids': pd.DataFrame({'price': bids, 'size': rng.random(len(bids))}).set_index('price'),
+            'asks': pd.DataFrame({'price': asks, 'size': rng.random(len(asks))}).set_index('price'),
+            'trades': trades}
+
+
+class ShapperTest(unittest.TestCase):
+    def test_01_bin_books_batch(self):
+        spacing = np.arange(16) / 15
+        frames = [frame(seed, num) for seed, num in enumerate([1, 2, 10, 30])]
+        refs = [f['price'] + 0.003 for f in frames]
+        batch = BookShapper.bin_books_batch(frames, refs, zoom_frac=1/256, spacing=spacing)
+        self.assertEqual(batch.shape, (4, 32, 3))
+        for f, ref, arr in zip(frames, refs, batch):
+            bib, aib, trb, tra = BookShapper.bin_books(f['bids'], f['asks'], f['trades'], ref_price=ref, zoom_frac=1/256, spacing=spacing)
+            expected = np.concatenate([bib.values - aib.values, (tra.values - trb.values)[:, ::2]], axis=-1)
+            np.testing.assert_allclose(arr, expected, rtol=1e-6, atol=1e-6)
@@ -0,0 +1,43 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+
+from deep_orderbook import snapshots
+from deep_orderbook.feeds import Snapshot
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.shapper import BookShapper
+from test_recorder import write_recording
+
+
+class SnapshotsTest(unittest.TestCase):
+    def test_01_delta(self):
+        bids, asks = {99.0: 1.0, 98.0: 2.0, 90.0: 1.0}, {101.0: 1.0, 102.0: 2.0}
+        snapshot = Snapshot(7, [(99.0, 3.0), (98.0, 2.0), (97.0, 1.0)], [(102.0, 2.0)])
+        delta = snapshots.delta(bids, asks, snapshot)
+        # the level at 90 is below the depth of the snapshot
+        self.assertEqual(delta['bids'], [(99.0, 3.0), (97.0, 1.0)])
+        self.assertEqual(delta['asks'], [(101.0, 0.0)])
+        self.assertEqual(snapshots.expand(bids, asks, delta), snapshot)
+        self.assertFalse(snapshots.delta(dict(snapshot.bids), dict(snapshot.asks), snapshot)['bids'])
+        with self.assertRaises(ValueError):
+            snapshots.expand({99.0: 3.0}, asks, delta)
+
+    def test_02_replay(self):
+        def frames(folder):
+            async def go():
+                replay = Replayer(folder, prefetch=0).replayL2_async('BTCUSDT', await BookShapper.create())
+                return [f async for f in replay][1:]
+            return asyncio.run(go())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for hour in range(3):
+                write_recording(f'{tmp}/full', 'BTCUSDT', hour=f'2020-05-01T1{hour}-00-00', t0=1588327200000 + 3600000 * hour)
+            shutil.copytree(f'{tmp}/full', f'{tmp}/delta')
+            stats = snapshots.encode_folder(Replayer(f'{tmp}/delta', prefetch=0), 'BTCUSDT')
+            self.assertEqual(stats, {'full': 1, 'delta': 2})
+            expected, replayed = frames(f'{tmp}/full'), frames(f'{tmp}/delta')
+        self.assertEqual(len(expected), len(replayed))
+        for e, r in zip(expected, replayed):
+            self.assertTrue(e['bids'].equals(r['bids']))
+            self.assertTrue(e['asks'].equals(r['asks']))
@@ -0,0 +1,28 @@
+import pickle
+import unittest
+import numpy as np
+
+from deep_orderbook.sparse import SparseFrames
+from test_storage import books
+
+
+class SparseFramesTest(unittest.TestCase):
+    def test_01_densify(self):
+        arr = books(300)
+        arr[7] = 0
+        frames = SparseFrames.encode(arr)
+        self.assertEqual(frames.indices.dtype, np.uint16)
+        self.assertLess(frames.nbytes, arr.nbytes / 2)
+        np.testing.assert_array_equal(frames.densify(), arr)
+        out = np.full((128,) + arr.shape[1:], np.nan, dtype=np.float32)
+        view = frames.densify_into(out, start=5, stop=105)
+        self.assertIs(view.base, out)
+        np.testing.assert_array_equal(view, arr[5:105])
+        np.testing.assert_array_equal(frames[250:].densify(), arr[250:])
+
+    def test_02_bytes(self):
+        arr = books(50, seed=1)
+        for frames in [SparseFrames.encode(arr), SparseFrames.encode(arr)[10:20], SparseFrames.encode(arr[:0])]:
+            for copy in [SparseFrames.from_bytes(frames.to_bytes()), pickle.loads(pickle.dumps(frames))]:
+                self.assertEqual(copy.shape, frames.shape)
+                np.testing.assert_array_equal(copy.densify(), frames.densify())
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook import storage
+from deep_orderbook.replayer import Replayer
+
+
+def books(num, width=16, seed=0):
+    rng = np.random.default_rng(seed)
+    arr = np.zeros((num, 2 * width, 3), dtype=np.float32)
+    arr[:, width - 3:width + 3] = np.arcsinh(rng.normal(0, 5, (num, 6, 3)))
+    return arr
+
+
+class StorageTest(unittest.TestCase):
+    def test_01_codecs(self):
+        arr = books(1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            for codec, tol in (('float32', 0), ('float16', 1e-2), ('int8', 2e-2), ('sparse', 0)):
+                fn = f"{tmp}/{codec}{storage.EXT}"
+                storage.ChunkedArray.save(fn, arr, codec=codec, chunk_rows=128)
+                np.testing.assert_allclose(storage.load_array(fn), arr, atol=tol, rtol=0)
+            self.assertLess(os.path.getsize(f"{tmp}/int8{storage.EXT}"), arr.nbytes / 4)
+
+    def test_02_read_into(self):
+        arr = books(1000, seed=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = f"{tmp}/day{storage.EXT}"
+            storage.ChunkedArray.save(fn, arr, chunk_rows=128)
+            chunked = storage.ChunkedArray(fn)
+            out = np.empty((2000,) + arr.shape[1:], dtype=np.float32)
+            view = chunked.read_into(out, start=100, stop=700)
+            self.assertIs(view.base, out)
+            np.testing.assert_array_equal(view, arr[100:700])
+            np.testing.assert_array_equal(chunked.read(900), arr[900:])
+
+    def test_03_training_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = f"{tmp}/sidepix016"
+            os.makedirs(folder)
+            for day in ('2020-05-17', '2020-05-18'):
+                np.save(f"{folder}/{day}-ETHBTC-bs.npy", books(10))
+                np.save(f"{folder}/{day}-ETHBTC-ps.npy", np.ones((10, 2, 3), dtype=np.float32))
+            storage.compress_folder(folder)
+            os.remove(f"{folder}/2020-05-18-ETHBTC-ps.npy")
+            files = list(Replayer(tmp, prefetch=0).training_files('ETHBTC', side_bips=4, side_width=16))
+            self.assertEqual(len(files), 2)
+            for fn_bs, fn_ps, fn_ts in files:
+                self.assertTrue(fn_bs.endswith(storage.EXT) and fn_ps.endswith(storage.EXT))
+                self.assertTrue(fn_ts.endswith('time2level-bip04.npy'))
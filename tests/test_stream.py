@@ -0,0 +1,34 @@
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+
+from deep_orderbook import labels
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.shapper import BookShapper
+from deep_orderbook.stream import TrainingStream
+from test_recorder import write_recording
+
+
+class TrainingStreamTest(unittest.TestCase):
+    def test_01_windows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_recording(tmp, 'BTCUSDT', seconds=60)
+
+            async def arrays():
+                replayer = Replayer(tmp, prefetch=0).replayL2_async('BTCUSDT', await BookShapper.create())
+                multi = Replayer.multireplayL2_async([replayer])
+                return [sec['BTCUSDT'] async for sec in BookShapper.gen_array_async(multi, ['BTCUSDT'], width_per_side=8)]
+            seconds = asyncio.run(arrays())
+            books = np.stack([sec['bs'][0] for sec in seconds])
+            prices = np.stack([sec['ps'][0] for sec in seconds])
+
+            stream = TrainingStream(Replayer(tmp, prefetch=0), ['BTCUSDT'], side_bips=4, side_width=8, sample_length=10, future=5)
+            windows = list(stream.samples('BTCUSDT'))
+        self.assertEqual(len(windows), (len(seconds) - 5) // 10)
+        num = 10 * len(windows)
+        np.testing.assert_array_equal(np.concatenate([w[0] for w in windows]), books[:num])
+        np.testing.assert_array_equal(np.concatenate([w[2] for w in windows]), prices[:num])
+        step = labels.pricestep_of(prices, side_bips=4, side_width=8)
+        expected = labels.alpha(labels.time2level_rows(prices, step, side_width=8, num_rows=num, future=5))
+        np.testing.assert_array_equal(np.concatenate([w[1] for w in windows]), expected)
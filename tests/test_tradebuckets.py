@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+
+from deep_orderbook.tradebuckets import TradeBuckets
+from deep_orderbook.feeds import BinanceFeed
+
+
+def trade(ms, price, qty='1.0', maker=False):
+    return {'e': 'aggTrade', 'E': ms, 's': 'BTCUSDT', 'a': 1, 'p': price, 'q': qty,
+            'f': 1, 'l': 2, 'T': ms - 3, 'm': maker, 'M': True}
+
+
+def trades(*list_trades):
+    return BinanceFeed.trades(list_trades)
+
+
+class TradeBucketsTest(unittest.TestCase):
+    def test_01_pop(self):
+        buckets = TradeBuckets()
+        buckets.add(trades(trade(10500, '101.0'), trade(10600, '100.0', maker=True), trade(11200, '102.0')))
+        tr = buckets.pop(11)
+        self.assertEqual(list(tr.index), [100.0, 101.0])
+        self.assertEqual(list(tr.columns), ['q', 'delay', 'num', 'up'])
+        self.assertEqual(list(tr['up']), [-1.0, 1.0])
+        self.assertEqual(list(tr['num']), [2.0, 2.0])
+        self.assertIsNone(buckets.pop(11))
+        self.assertEqual(len(buckets.pop(12)), 1)
+
+    def test_02_watermark(self):
+        buckets = TradeBuckets()
+        buckets.add(trades(*[trade(1000 * s, '100.0') for s in range(10)]))
+        # the seconds the replay skipped are evicted when a later one is asked for
+        self.assertEqual(len(buckets.pop(6)), 1)
+        self.assertEqual(buckets.stats['dropped'], 5)
+        self.assertEqual(len(buckets), 4)
+        buckets.add(trades(trade(2000, '100.0'), trade(9500, '100.0')))
+        self.assertEqual(buckets.stats['late'], 1)
+        self.assertEqual(len(buckets.pop(10)), 2)
+        self.assertEqual(buckets.stats['merged'], 1)
+
+    def test_03_bounded(self):
+        buckets = TradeBuckets(max_seconds=100)
+        for hour in range(5):
+            buckets.add(trades(*[trade(1000 * (hour * 3600 + s), '100.0') for s in range(0, 3600, 10)]))
+            self.assertLessEqual(len(buckets), 100)
+        self.assertEqual(buckets.stats['dropped'], 5 * 360 - 100)
+        np.testing.assert_array_equal(buckets.pop(5 * 3600 - 9).index, [100.0])
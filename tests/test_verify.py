@@ -0,0 +1,49 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+from deep_orderbook import snapshots, verify
+from deep_orderbook.replayer import Replayer
+from deep_orderbook.__main__ import main
+from test_recorder import write_recording
+
+
+def write_hours(folder):
+    for hour in range(3):
+        write_recording(folder, 'BTCUSDT', hour=f'2020-05-01T1{hour}-00-00', t0=1588327200000 + 3600000 * hour)
+    # an update missing in the first hour, the second hour's snapshot being the book at its end
+    fn = f'{folder}/BTCUSDT/2020-05-01T10-00-00_update.json'
+    updates = json.load(open(fn))
+    json.dump(updates[:5] + updates[6:], open(fn, 'w'))
+    snapshot = {'lastUpdateId': 140, 'bids': [['99.00', '40.0'], ['98.00', '2.0']], 'asks': [['101.00', '40.0'], ['102.00', '2.0']]}
+    json.dump(snapshot, open(f'{folder}/BTCUSDT/2020-05-01T11-00-00_snapshot.json', 'w'))
+
+
+class VerifyTest(unittest.TestCase):
+    def test_01_statuses(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_hours(f'{tmp}/full')
+            shutil.copytree(f'{tmp}/full', f'{tmp}/delta')
+            snapshots.encode_folder(Replayer(f'{tmp}/delta', prefetch=0), 'BTCUSDT')
+            reports = [verify.verify(Replayer(f'{tmp}/{folder}', prefetch=0), ['BTCUSDT'], processes=processes)
+                       for folder, processes in [('full', 0), ('full', 2), ('delta', 0)]]
+        df = reports[0]
+        self.assertEqual(list(df['status']), ['gap', 'diverged', 'unchecked'])
+        self.assertEqual(list(df['gaps'][:2]), [1, 0])
+        self.assertEqual(list(df['bid_diff'][:2]), [0, 1])
+        self.assertEqual(verify.safe_hours(df), {})
+        for other in reports[1:]:
+            self.assertTrue(df.equals(other))
+
+    def test_02_checksum(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_hours(tmp)
+            snapshots.encode_folder(Replayer(tmp, prefetch=0), 'BTCUSDT')
+            fn = f'{tmp}/BTCUSDT/2020-05-01T11-00-00_snapshot.json'
+            delta = json.load(open(fn))
+            json.dump(dict(delta, checksum=delta['checksum'] + 1), open(fn, 'w'))
+            main(['verify', '--data-folder', tmp, '--processes', '0', '--report', f'{tmp}/verify.csv'])
+            with open(f'{tmp}/verify.csv') as fp:
+                statuses = [line.split(',')[-1].strip() for line in fp][1:]
+        self.assertEqual(statuses, ['checksum', 'unknown', 'unchecked'])